@@ -31,7 +31,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'core.apps.LazyAdminConfig',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -42,14 +42,17 @@ INSTALLED_APPS = [
     'core',
     'user',
     'movie',
+    'batch',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.LoadSheddingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,6 +91,61 @@ DATABASES = {
     }
 }
 
+# Read replicas, as a comma separated list of hosts sharing the
+# credentials of the primary
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica{index}'] = dict(
+        DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+REPLICA_PIN_SECONDS = float(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('DB_REPLICA_MAX_LAG', 2))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5))
+
+# Similar movies kept per movie, and the usage above which a tag or cast
+# is too common to make movies similar
+SIMILAR_MOVIES_TOP_K = int(os.environ.get('SIMILAR_MOVIES_TOP_K', 20))
+SIMILAR_MOVIES_MAX_USAGE = int(
+    os.environ.get('SIMILAR_MOVIES_MAX_USAGE', 1000))
+
+# Serve movie details from documents rendered whenever a movie, its tags
+# and casts or their names change, instead of rendering them on each read
+MOVIE_DOCUMENTS = os.environ.get('MOVIE_DOCUMENTS', '') == '1'
+
+# Views and plays are counted in each server process and written back
+# every VIEW_COUNTS_FLUSH_SECONDS, or once VIEW_COUNTS_MAX_BUFFERED movie
+# hours are buffered
+VIEW_COUNTS_FLUSH_SECONDS = float(
+    os.environ.get('VIEW_COUNTS_FLUSH_SECONDS', 10))
+VIEW_COUNTS_MAX_BUFFERED = 10000
+
+# Trending movies are ranked by their views and plays of the last
+# TRENDING_WINDOW_HOURS, a play weighing TRENDING_PLAY_WEIGHT views, and
+# the counts of an hour losing half their weight every half life
+TRENDING_WINDOW_HOURS = 7 * 24
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_PLAY_WEIGHT = 3
+
+# Adaptive limit of the requests each server process serves at once, the
+# latency above which it shrinks, and the share of the limit and of the
+# maximum queueing delay each request priority may use. The delay is read
+# from X-Request-Start only when a trusted proxy sets it.
+LOAD_SHED_INITIAL_LIMIT = int(os.environ.get('LOAD_SHED_INITIAL_LIMIT', 20))
+LOAD_SHED_MIN_LIMIT = int(os.environ.get('LOAD_SHED_MIN_LIMIT', 2))
+LOAD_SHED_MAX_LIMIT = int(os.environ.get('LOAD_SHED_MAX_LIMIT', 200))
+LOAD_SHED_TARGET_LATENCY_SECONDS = float(
+    os.environ.get('LOAD_SHED_TARGET_LATENCY', 0.5))
+LOAD_SHED_MAX_QUEUE_SECONDS = float(
+    os.environ.get('LOAD_SHED_MAX_QUEUE', 2))
+LOAD_SHED_RETRY_AFTER_SECONDS = 1
+LOAD_SHED_SHARES = {'high': 1.0, 'normal': 0.8, 'low': 0.5}
+LOAD_SHED_TRUST_REQUEST_START = \
+    os.environ.get('LOAD_SHED_TRUST_REQUEST_START', '') == '1'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -133,11 +191,20 @@ MEDIA_ROOT = '/vol/web/media'
 
 STATIC_ROOT = '/vol/web/static'
 
+# Limits enforced on poster uploads before they are decoded, and the
+# size above which they are downscaled and re-encoded
+POSTER_MAX_BYTES = 20 * 1024 * 1024
+POSTER_MAX_PIXELS = 50 * 1000 * 1000
+POSTER_MAX_SIDE = 2000
+POSTER_NORMALIZE_BYTES = 2 * 1024 * 1024
+POSTER_DECODE_BUDGET = 64 * 1024 * 1024
+
 AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': (
         'rest_framework.parsers.FormParser',
-        'rest_framework.parsers.MultiPartParser'
+        'rest_framework.parsers.MultiPartParser',
+        'rest_framework.parsers.JSONParser',
     )
 }
\ No newline at end of file
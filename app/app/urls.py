@@ -18,8 +18,14 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from core.views import HealthView
+
+admin.autodiscover()
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/movie/', include('movie.urls')),
+    path('api/batch/', include('batch.urls')),
+    path('api/health/', HealthView.as_view(), name='health'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
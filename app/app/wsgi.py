@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+# The serve command's workers write the view counts back themselves,
+# other servers load this module
+from core import counters  # noqa: E402
+
+counters.start_writer()
@@ -0,0 +1,28 @@
+from rest_framework import serializers
+
+
+class OperationSerializer(serializers.Serializer):
+    """Serializes a sub-request of a batch"""
+    id = serializers.RegexField(r'^[A-Za-z_]\w*$', max_length=50,
+                                required=False)
+    method = serializers.ChoiceField(
+        choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'))
+    path = serializers.RegexField(r'^/api/', max_length=2000)
+    body = serializers.JSONField(required=False, default=dict)
+
+
+class BatchSerializer(serializers.Serializer):
+    """Serializes an ordered list of sub-requests"""
+    max_operations = 50
+    atomic = serializers.BooleanField(default=False)
+    operations = OperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        if len(operations) > self.max_operations:
+            raise serializers.ValidationError(
+                f'At most {self.max_operations} operations are allowed.')
+        ids = [operation['id'] for operation in operations
+               if 'id' in operation]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError('Operation ids must be unique.')
+        return operations
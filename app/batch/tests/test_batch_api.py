@@ -0,0 +1,170 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Tag, Cast, Movie
+from movie.views import TagApiViewSet
+
+BATCH_URL = reverse('batch:batch')
+TAGS_PATH = reverse('movie:tag-list')
+CASTS_PATH = reverse('movie:cast-list')
+MOVIES_PATH = reverse('movie:movie-list')
+
+
+class PublicBatchApiTests(TestCase):
+    """Tests for the batch endpoint without authentication"""
+
+    def test_login_required(self):
+        """Test that login is required for batches"""
+        res = APIClient().post(BATCH_URL, {'operations': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(TestCase):
+    """Tests for batches of an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, operations, **params):
+        res = self.client.post(BATCH_URL, dict(params, operations=operations),
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_operations_refer_to_earlier_results(self):
+        """Test a movie is created with the tag and cast created before"""
+        data = self.batch([
+            {'id': 'cast', 'method': 'POST', 'path': CASTS_PATH,
+             'body': {'name': 'Al Pacino'}},
+            {'method': 'POST', 'path': TAGS_PATH, 'body': {'name': 'Crime'}},
+            {'id': 'movie', 'method': 'POST', 'path': MOVIES_PATH,
+             'body': {'title': 'Heat', 'duration': '02:50:00',
+                      'price': '5.99', 'tag': ['${1.id}'],
+                      'cast': ['${cast.id}']}},
+            {'method': 'GET', 'path': f'{MOVIES_PATH}${{movie.id}}/'},
+        ])
+        self.assertEqual([result['status'] for result in data['results']],
+                         [201, 201, 201, 200])
+        self.assertFalse(data['rolled_back'])
+        movie = Movie.objects.get(user=self.user)
+        self.assertEqual(list(movie.tag.all()), [Tag.objects.get()])
+        self.assertEqual(list(movie.cast.all()), [Cast.objects.get()])
+        self.assertEqual(data['results'][3]['body']['cast'][0]['name'],
+                         'Al Pacino')
+
+    @override_settings(MOVIE_DOCUMENTS=True)
+    def test_stored_documents_referred_to(self):
+        """Test movie documents are results later operations refer to"""
+        data = self.batch([
+            {'id': 'movie', 'method': 'POST', 'path': MOVIES_PATH,
+             'body': {'title': 'Heat', 'duration': '02:50:00',
+                      'price': '5.99', 'tag': [], 'cast': []}},
+            {'id': 'detail', 'method': 'GET',
+             'path': f'{MOVIES_PATH}${{movie.id}}/'},
+            {'method': 'POST', 'path': TAGS_PATH,
+             'body': {'name': '${detail.title}'}},
+        ])
+        self.assertEqual([result['status'] for result in data['results']],
+                         [201, 200, 201])
+        self.assertEqual(data['results'][1]['body']['title'], 'Heat')
+        self.assertEqual(Tag.objects.get().name, 'Heat')
+
+    def test_dollar_amounts_are_data(self):
+        """Test only ${...} in a body or path refers to a result"""
+        data = self.batch([
+            {'method': 'POST', 'path': TAGS_PATH, 'body': {'name': '$5.99'}},
+            {'method': 'POST', 'path': TAGS_PATH,
+             'body': {'name': 'Sale $5.99'}},
+            {'method': 'POST', 'path': CASTS_PATH,
+             'body': {'name': 'Tag ${0.id} is ${0.name}'}},
+        ])
+        self.assertEqual([result['status'] for result in data['results']],
+                         [201, 201, 201])
+        tag = Tag.objects.get(name='$5.99')
+        self.assertTrue(Tag.objects.filter(name='Sale $5.99').exists())
+        self.assertEqual(Cast.objects.get().name,
+                         f'Tag {tag.id} is $5.99')
+
+    def test_failed_dependency_reported(self):
+        """Test operations referring to a failed one are not run"""
+        data = self.batch([
+            {'id': 'tag', 'method': 'POST', 'path': TAGS_PATH, 'body': {}},
+            {'method': 'POST', 'path': CASTS_PATH, 'body': {'name': 'Ng'}},
+            {'method': 'GET', 'path': f'{TAGS_PATH}?ids=${{tag.id}}'},
+            {'method': 'GET', 'path': '/api/unknown/'},
+        ])
+        self.assertEqual([result['status'] for result in data['results']],
+                         [400, 201, 424, 404])
+        self.assertTrue(Cast.objects.exists())
+
+    def test_atomic_batch_rolled_back(self):
+        """Test an atomic batch is undone at the first failure"""
+        data = self.batch([
+            {'method': 'POST', 'path': TAGS_PATH, 'body': {'name': 'Crime'}},
+            {'method': 'POST', 'path': MOVIES_PATH, 'body': {'title': ''}},
+            {'method': 'POST', 'path': CASTS_PATH, 'body': {'name': 'Ng'}},
+        ], atomic=True)
+        self.assertEqual([result['status'] for result in data['results']],
+                         [201, 400])
+        self.assertTrue(data['rolled_back'])
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(Cast.objects.exists())
+
+    def test_operation_errors_contained(self):
+        """Test an operation raising fails alone unless the batch is atomic"""
+        operations = [
+            {'method': 'POST', 'path': CASTS_PATH, 'body': {'name': 'Ng'}},
+            {'method': 'GET', 'path': TAGS_PATH},
+            {'method': 'POST', 'path': TAGS_PATH, 'body': {'name': 'Crime'}},
+        ]
+        with patch.object(TagApiViewSet, 'list',
+                          side_effect=ValueError), \
+                self.assertLogs('batch.views', 'ERROR'):
+            data = self.batch(operations)
+            self.assertEqual(
+                [result['status'] for result in data['results']],
+                [201, 500, 201])
+            self.assertEqual(Tag.objects.count(), 1)
+
+            data = self.batch(operations, atomic=True)
+        self.assertEqual([result['status'] for result in data['results']],
+                         [201, 500])
+        self.assertTrue(data['rolled_back'])
+        self.assertEqual(Cast.objects.count(), 1)
+
+    def test_invalid_batches_rejected(self):
+        """Test nested, oversized and non API batches are rejected"""
+        res = self.client.post(BATCH_URL, {'operations': [
+            {'method': 'GET', 'path': '/admin/'}]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.post(BATCH_URL, {'operations': [
+            {'method': 'GET', 'path': TAGS_PATH}] * 51}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        data = self.batch([{'method': 'POST', 'path': BATCH_URL,
+                            'body': {'operations': []}}])
+        self.assertEqual(data['results'][0]['status'], 400)
+
+    def test_authenticated_once(self):
+        """Test the token is looked up once for the whole batch"""
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        with CaptureQueriesContext(connection) as queries:
+            res = client.post(BATCH_URL, {'operations': [
+                {'method': 'GET', 'path': TAGS_PATH}] * 5}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        token_queries = [query for query in queries.captured_queries
+                         if Token._meta.db_table in query['sql']]
+        self.assertEqual(len(token_queries), 1)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .views import BatchView
+
+app_name = 'batch'
+
+urlpatterns = [
+    path('', BatchView.as_view(), name='batch'),
+]
@@ -0,0 +1,148 @@
+import io
+import re
+import json
+import logging
+from contextlib import nullcontext
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import Resolver404, resolve
+
+from rest_framework import status, views
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .serializers import BatchSerializer
+
+
+logger = logging.getLogger(__name__)
+
+# ${<operation>.<key>[.<key>...]} refers to the response of an earlier
+# operation, by its id or position. Other dollar signs are data.
+REFERENCE = re.compile(r'\$\{(\w+)((?:\.\w+)+)\}')
+
+
+class UnresolvedReference(Exception):
+    """Raised when an operation refers to a missing or failed result"""
+
+
+class BatchView(views.APIView):
+    """Runs an ordered list of API requests in a single request
+
+    The sub-requests reuse the authentication of the batch through
+    BatchAuthentication and are dispatched in process to the views of the
+    API. With atomic set they run in one transaction which is rolled back
+    at the first failure. An operation raising an error fails with a 500
+    of its own.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    parser_classes = (JSONParser,)
+    low_priority_actions = ('post',)
+
+    def _lookup(self, results, name, keys):
+        """Returns a value of the response of an earlier operation"""
+        if name not in results or results[name]['status'] >= 400:
+            raise UnresolvedReference(f'${{{name}{keys}}}')
+        value = results[name]['body']
+        try:
+            for key in keys.split('.')[1:]:
+                value = value[int(key) if isinstance(value, list) else key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise UnresolvedReference(f'${{{name}{keys}}}')
+        return value
+
+    def _resolve(self, value, results):
+        """Replaces the references in a path or body by their values"""
+        if isinstance(value, dict):
+            return {key: self._resolve(item, results)
+                    for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._resolve(item, results) for item in value]
+        if not isinstance(value, str):
+            return value
+        match = REFERENCE.fullmatch(value)
+        if match:
+            return self._lookup(results, *match.groups())
+        return REFERENCE.sub(
+            lambda match: str(self._lookup(results, *match.groups())),
+            value
+        )
+
+    def _dispatch(self, request, method, path, body):
+        """Calls the view of a sub-request, returning status and data"""
+        path, _, query = path.partition('?')
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'}
+        if getattr(match.func, 'cls', None) is BatchView:
+            return status.HTTP_400_BAD_REQUEST, \
+                {'detail': 'Batches cannot be nested.'}
+        content = b'' if method == 'GET' else json.dumps(body).encode()
+        environ = dict(request.META)
+        environ.pop('HTTP_AUTHORIZATION', None)
+        environ.update({
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(content)),
+            'wsgi.input': io.BytesIO(content),
+        })
+        sub_request = WSGIRequest(environ)
+        sub_request.batch_auth = (request.user, request.auth)
+        # Not closed, closing a response signals the end of the request
+        # and with it closes the database connection
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        if hasattr(response, 'data'):
+            return response.status_code, response.data
+        # Views may answer with JSON already encoded, as the stored movie
+        # documents are
+        data = None
+        if not response.streaming and response.content and \
+                response['Content-Type'].startswith('application/json'):
+            data = json.loads(response.content)
+        return response.status_code, data
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        atomic = serializer.validated_data['atomic']
+        results = {}
+        responses = []
+        rolled_back = False
+        with transaction.atomic() if atomic else nullcontext():
+            for index, operation in enumerate(
+                    serializer.validated_data['operations']):
+                try:
+                    code, data = self._dispatch(
+                        request, operation['method'],
+                        self._resolve(operation['path'], results),
+                        self._resolve(operation['body'], results)
+                    )
+                except UnresolvedReference as exc:
+                    code = status.HTTP_424_FAILED_DEPENDENCY
+                    data = {'detail': f'Unresolved reference {exc}'}
+                except Exception:
+                    logger.exception('Batch operation %s failed', index)
+                    code = status.HTTP_500_INTERNAL_SERVER_ERROR
+                    data = {'detail': 'Internal server error.'}
+                result = {'id': operation.get('id'), 'status': code,
+                          'body': data}
+                results[str(index)] = result
+                if 'id' in operation:
+                    results[operation['id']] = result
+                responses.append(result)
+                if atomic and code >= 400:
+                    transaction.set_rollback(True)
+                    rolled_back = True
+                    break
+        return Response({'results': responses, 'rolled_back': rolled_back})
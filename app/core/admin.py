@@ -1,13 +1,46 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 
 from .models import User, Tag, Cast, Movie
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator which uses the planner's row estimate for large results"""
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        """Returns the exact count of small results, else the estimate"""
+        queryset = self.object_list
+        sql, params = queryset.query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate < self.exact_count_limit:
+            return queryset.count()
+        return estimate
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """Admin avoiding full table counts and unbounded relation widgets"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+
+
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
+    search_fields = ('^email', '^name')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal Info'), {'fields': ('name',)}),
@@ -27,7 +60,23 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class TagAdmin(ScalableModelAdmin):
+    list_display = ('name', 'user')
+    search_fields = ('^name',)
+
+
+class CastAdmin(ScalableModelAdmin):
+    list_display = ('name', 'user')
+    search_fields = ('^name',)
+
+
+class MovieAdmin(ScalableModelAdmin):
+    list_display = ('title', 'user', 'duration', 'price')
+    search_fields = ('^title',)
+    autocomplete_fields = ('user', 'tag', 'cast')
+
+
 admin.site.register(User, UserAdmin)
-admin.site.register(Tag)
-admin.site.register(Cast)
-admin.site.register(Movie)
+admin.site.register(Tag, TagAdmin)
+admin.site.register(Cast, CastAdmin)
+admin.site.register(Movie, MovieAdmin)
@@ -1,5 +1,31 @@
 from django.apps import AppConfig
+from django.contrib.admin.apps import SimpleAdminConfig
+from django.core import checks
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+
+class LazyAdminConfig(SimpleAdminConfig):
+    """Admin which imports the admin modules of the apps on first use
+
+    The modules are discovered when the URL conf or the admin checks are
+    loaded, so management commands which do neither start faster.
+    """
+
+    def ready(self):
+        checks.register(check_discovered_admin, checks.Tags.admin)
+
+
+def check_discovered_admin(app_configs, **kwargs):
+    """Runs the admin checks once every admin module is imported"""
+    from django.contrib import admin
+    from django.contrib.admin.checks import check_admin_app, \
+        check_dependencies
+    admin.autodiscover()
+    return check_dependencies(app_configs=app_configs, **kwargs) + \
+        check_admin_app(app_configs, **kwargs)
@@ -0,0 +1,321 @@
+import gc
+import os
+import json
+import math
+import time
+import random
+import datetime
+import decimal
+import statistics
+from collections import Counter
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from core.models import Tag, Cast, Movie, SimilarMovie
+
+
+BENCH_EMAIL = 'bench-user-{}@example.com'
+BENCH_PASSWORD = 'benchpass123'
+BENCH_ADMIN_EMAIL = 'bench-admin@example.com'
+
+# Loaded on first use only, so commands which neither serve requests nor
+# run the system checks do not pay for them
+DEFERRED_MODULES = (
+    'PIL',
+    'core.admin',
+    'django.contrib.auth.admin',
+    'rest_framework.authtoken.admin',
+    'rest_framework.renderers',
+    'movie.views',
+    'user.views',
+)
+
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of values using linear interpolation"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return ordered[int(rank)]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_latencies(latencies, elapsed, queries):
+    """Returns the latency, throughput and query summary of a scenario"""
+    count = len(latencies)
+    return {
+        'requests': count,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'throughput_rps': round(count / elapsed, 3) if elapsed else 0.0,
+        'queries_per_request': round(sum(queries) / count, 3)
+        if count else 0.0,
+    }
+
+
+def measure(func, warmup=2, repeats=7, min_time=0.2):
+    """Returns timing and allocation statistics of calling func
+
+    The loop count is calibrated so a sample takes at least min_time, the
+    first warmup samples are discarded and the median of repeats samples is
+    reported with its spread.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time or number >= 10 ** 6:
+            break
+        number *= 2
+
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for index in range(warmup + repeats):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            if index >= warmup:
+                samples.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        func()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(samples)
+    return {
+        'loops': number,
+        'repeats': repeats,
+        'median_s': median,
+        'min_s': min(samples),
+        'stdev_s': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'calls_per_sec': 1 / median if median else 0.0,
+        'peak_alloc_bytes': peak,
+        'retained_bytes': retained,
+    }
+
+
+def compare_results(current, baseline, tolerance=0.2):
+    """Returns a list of regressions of current results against baseline"""
+    regressions = []
+    for name, base in baseline.get('scenarios', {}).items():
+        result = current.get('scenarios', {}).get(name)
+        if result is None:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: {key} {result[key]} > {base[key]}'
+                )
+        if result['throughput_rps'] < \
+                base['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput_rps {result['throughput_rps']} "
+                f"< {base['throughput_rps']}"
+            )
+        if result['queries_per_request'] > base['queries_per_request']:
+            regressions.append(
+                f"{name}: queries_per_request "
+                f"{result['queries_per_request']} "
+                f"> {base['queries_per_request']}"
+            )
+        # Failing requests are usually fast ones, so more of them would
+        # pass for an improvement of the latencies
+        if error_rate(result) > error_rate(base):
+            regressions.append(
+                f"{name}: errors {result.get('errors', 0)} of "
+                f"{result['requests']} > {base.get('errors', 0)} of "
+                f"{base['requests']}"
+            )
+    return regressions
+
+
+def error_rate(result):
+    """Returns the share of the requests of a scenario which failed"""
+    if not result.get('requests'):
+        return 0.0
+    return result.get('errors', 0) / result['requests']
+
+
+def load_results(path):
+    """Reads a benchmark results file"""
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def write_results(path, results):
+    """Writes a benchmark results file"""
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def memory_usage(pid):
+    """Returns the resident, proportional and unique set sizes of a process
+
+    The proportional size splits pages shared copy-on-write between the
+    processes sharing them, the unique size counts private pages only.
+    """
+    usage = {'rss_bytes': 0, 'pss_bytes': 0, 'uss_bytes': 0}
+    fields = {'Rss': 'rss_bytes', 'Pss': 'pss_bytes',
+              'Private_Clean': 'uss_bytes', 'Private_Dirty': 'uss_bytes'}
+    path = f'/proc/{pid}/smaps_rollup'
+    if not os.path.exists(path):
+        path = f'/proc/{pid}/smaps'
+    with open(path) as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+            if name in fields:
+                usage[fields[name]] += int(value.split()[0]) * 1024
+    return usage
+
+
+def child_pids(pid):
+    """Returns the ids of the child processes of a process"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def parse_importtime(output):
+    """Returns the modules reported by python -X importtime in load order
+
+    Each module is a (name, self_s, cumulative_s) tuple; the times of
+    modules imported by it are included in its cumulative time only.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append((fields[2].strip(), int(fields[0]) / 10 ** 6,
+                        int(fields[1]) / 10 ** 6))
+    return modules
+
+
+def summarize_imports(modules, top=10):
+    """Returns the total import time and the slowest packages and modules"""
+    packages = Counter()
+    for name, self_s, _ in modules:
+        packages[name.split('.')[0]] += self_s
+    return {
+        'modules': len(modules),
+        'import_s': round(sum(packages.values()), 6),
+        'packages': [[name, round(seconds, 6)]
+                     for name, seconds in packages.most_common(top)],
+        'slowest': [[name, round(cumulative_s, 6)]
+                    for name, _, cumulative_s in sorted(
+                        modules, key=lambda module: -module[2])[:top]],
+    }
+
+
+def compare_startup(current, baseline, tolerance=0.2):
+    """Returns a list of start-up regressions against baseline"""
+    regressions = []
+    for name, base in baseline.get('startup', {}).items():
+        result = current.get('startup', {}).get(name)
+        if result is None:
+            continue
+        if result['wall_s'] > base['wall_s'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: wall_s {result['wall_s']} > {base['wall_s']}")
+        added = sorted(set(result['deferred']) - set(base['deferred']))
+        if added:
+            regressions.append(f"{name}: imports {', '.join(added)}")
+    return regressions
+
+
+def bench_users():
+    """Returns the users created by seed_catalog"""
+    return get_user_model().objects.filter(
+        email__startswith='bench-user-'
+    ).order_by('id')
+
+
+def seed_catalog(users=1, movies=100, tags=10, casts=10,
+                 tags_per_movie=3, casts_per_movie=3, seed=0,
+                 batch_size=1000, email=BENCH_EMAIL):
+    """Creates a reproducible benchmark catalog and returns its users
+
+    Users seeded before keep their catalog, so seeding again only adds
+    the missing users.
+    """
+    rng = random.Random(seed)
+    password = make_password(BENCH_PASSWORD)
+    user_model = get_user_model()
+    emails = [email.format(i) for i in range(users)]
+    existing = set(user_model.objects.filter(
+        email__in=emails).values_list('email', flat=True))
+    user_model.objects.bulk_create(
+        [user_model(email=address, name=f'Bench {i}', password=password)
+         for i, address in enumerate(emails) if address not in existing],
+        batch_size=batch_size
+    )
+    seeded = list(user_model.objects.filter(
+        email__in=emails).order_by('id'))
+    for user in seeded:
+        if user.email in existing:
+            continue
+        tag_ids = [tag.id for tag in Tag.objects.bulk_create(
+            [Tag(user=user, name=f'Tag {i}') for i in range(tags)],
+            batch_size=batch_size
+        )]
+        cast_ids = [cast.id for cast in Cast.objects.bulk_create(
+            [Cast(user=user, name=f'Cast {i}') for i in range(casts)],
+            batch_size=batch_size
+        )]
+        for start in range(0, movies, batch_size):
+            created = Movie.objects.bulk_create([
+                Movie(
+                    user=user,
+                    title=f'Movie {i}',
+                    duration=datetime.timedelta(
+                        minutes=rng.randint(20, 240)),
+                    price=decimal.Decimal(rng.randint(100, 25000)) / 1000,
+                ) for i in range(start, min(start + batch_size, movies))
+            ])
+            tag_rows = []
+            cast_rows = []
+            for movie in created:
+                for tag_id in rng.sample(tag_ids,
+                                         min(tags_per_movie, len(tag_ids))):
+                    tag_rows.append(Movie.tag.through(
+                        movie_id=movie.id, tag_id=tag_id))
+                for cast_id in rng.sample(cast_ids,
+                                          min(casts_per_movie,
+                                              len(cast_ids))):
+                    cast_rows.append(Movie.cast.through(
+                        movie_id=movie.id, cast_id=cast_id))
+            Movie.tag.through.objects.bulk_create(tag_rows)
+            Movie.cast.through.objects.bulk_create(cast_rows)
+            Tag.objects.adjust_usage(Counter(row.tag_id for row in tag_rows))
+            Cast.objects.adjust_usage(
+                Counter(row.cast_id for row in cast_rows))
+        # Bulk created through rows send no m2m_changed
+        SimilarMovie.objects.rebuild(user.id, batch_size=batch_size)
+    return seeded
@@ -0,0 +1,86 @@
+import time
+import threading
+
+
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+
+# Limiter of the requests of the process, set by the middleware
+limiter = None
+
+# WSGI environ key in which serve's sync workers estimate the queueing
+# delay, in seconds, of the connections waiting to be accepted
+QUEUE_DELAY_ENV = 'serve.queue_delay'
+
+
+def request_start(meta):
+    """Returns when the proxy received a request, from X-Request-Start
+
+    The header holds seconds, milliseconds or microseconds since the
+    epoch, optionally prefixed with t= as nginx's $msec is.
+    """
+    value = meta.get('HTTP_X_REQUEST_START', '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        start = float(value)
+    except ValueError:
+        return None
+    while start > 1e11:
+        start /= 1000
+    return start
+
+
+class ConcurrencyLimiter:
+    """Adaptive limit on the requests a process serves at once
+
+    The limit grows additively, by one for every limit's worth of requests
+    answered within the target latency while at least half of it is in
+    use, and shrinks multiplicatively by backoff when a request, queueing
+    included, takes longer. It shrinks at most once per target latency,
+    so a burst of slow requests does not collapse it.
+    """
+
+    def __init__(self, initial, minimum, maximum, target_latency,
+                 backoff=0.9, clock=time.monotonic):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.clock = clock
+        self.inflight = 0
+        self.shed = 0
+        self.decreased = None
+        self.lock = threading.Lock()
+
+    def acquire(self, share=1.0):
+        """Returns if a request may start, counting it in flight"""
+        with self.lock:
+            if self.inflight >= max(self.limit * share, 1):
+                self.shed += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self, latency):
+        """Counts a request out and adjusts the limit to its latency"""
+        with self.lock:
+            busy = self.inflight >= self.limit / 2
+            self.inflight -= 1
+            now = self.clock()
+            if latency > self.target_latency:
+                if self.decreased is None or \
+                        now - self.decreased >= self.target_latency:
+                    self.limit = max(self.limit * self.backoff,
+                                     self.minimum)
+                    self.decreased = now
+            elif busy:
+                self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+    def stats(self):
+        """Returns the current limit, requests in flight and shed"""
+        with self.lock:
+            return {'limit': round(self.limit, 3),
+                    'inflight': self.inflight, 'shed': self.shed}
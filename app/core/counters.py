@@ -0,0 +1,124 @@
+import os
+import time
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from core.models import ViewCount
+
+
+logger = logging.getLogger(__name__)
+
+VIEW = 0
+PLAY = 1
+
+
+class CounterBuffer:
+    """Accumulates the views and plays of movies until written back
+
+    Counts are kept per movie and hour, so the buffer grows with the
+    movies viewed rather than with the views, and are written back with a
+    single upsert instead of an update of the movie per view.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.counts = {}
+        self.flushed = clock()
+        self.lock = threading.Lock()
+
+    def add(self, movie_id, kind):
+        """Counts a view or play of a movie, writing back a full buffer"""
+        key = (movie_id, ViewCount.bucket_of(timezone.now()))
+        with self.lock:
+            counts = self.counts.setdefault(key, [0, 0])
+            counts[kind] += 1
+            full = len(self.counts) >= settings.VIEW_COUNTS_MAX_BUFFERED
+        if full:
+            try:
+                self.flush()
+            except DatabaseError:
+                logger.exception('Writing back view counts failed')
+
+    def due(self):
+        """Returns if the flush interval passed since the last write"""
+        return self.clock() - self.flushed >= \
+            settings.VIEW_COUNTS_FLUSH_SECONDS
+
+    def flush(self):
+        """Writes the buffered counts back, keeping them if that fails"""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            self.flushed = self.clock()
+        if not counts:
+            return 0
+        try:
+            ViewCount.objects.add(counts)
+        except DatabaseError:
+            with self.lock:
+                for key, (views, plays) in counts.items():
+                    merged = self.counts.setdefault(key, [0, 0])
+                    merged[VIEW] += views
+                    merged[PLAY] += plays
+            raise
+        return len(counts)
+
+
+buffer = CounterBuffer()
+
+
+def record_view(movie_id):
+    """Counts a view of a movie"""
+    buffer.add(movie_id, VIEW)
+
+
+def record_play(movie_id):
+    """Counts a play of a movie"""
+    buffer.add(movie_id, PLAY)
+
+
+def write_back(force=False):
+    """Writes the counts of the process back when due, or now if forced
+
+    Called by the workers of the serve command between requests and
+    before they exit, and by the writer thread under other servers.
+    Counts which fail to be written are logged and retried at the next
+    interval.
+    """
+    if not force and not buffer.due():
+        return
+    try:
+        buffer.flush()
+    except DatabaseError:
+        logger.exception('Writing back view counts failed')
+    finally:
+        close_old_connections()
+
+
+def start_writer():
+    """Writes the counts back from a thread every interval and at exit
+
+    For servers other than serve, started by the WSGI and ASGI modules.
+    Servers preloading the application, as gunicorn with --preload, fork
+    their workers after, so the thread is started again in every child.
+    """
+    def run():
+        while True:
+            time.sleep(settings.VIEW_COUNTS_FLUSH_SECONDS)
+            write_back()
+
+    def start():
+        threading.Thread(target=run, name='counters', daemon=True).start()
+
+    def start_in_child():
+        # The lock may have been held by the thread of the parent
+        buffer.lock = threading.Lock()
+        start()
+
+    start()
+    os.register_at_fork(after_in_child=start_in_child)
+    atexit.register(write_back, force=True)
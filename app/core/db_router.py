@@ -0,0 +1,119 @@
+import time
+import itertools
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from rest_framework.authentication import TokenAuthentication, \
+    get_authorization_header
+
+
+LAG_SQL = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery()
+        OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM
+        now() - pg_last_xact_replay_timestamp()), 0)
+END
+'''
+
+_state = threading.local()
+
+
+def use_replica():
+    """Lets the reads of the current thread go to a replica"""
+    _state.replica = True
+
+
+def use_primary():
+    """Sends the reads of the current thread to the primary"""
+    _state.replica = False
+
+
+def pin_primary(user):
+    """Keeps the reads of a user on the primary for REPLICA_PIN_SECONDS
+
+    The pin is a row of the primary, so every server process honours it
+    for every client of the user, cookies or not.
+    """
+    from core.models import PrimaryPin
+    PrimaryPin.objects.pin(user.pk, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    """Returns if the user of a request wrote within the pin window
+
+    Tokens are authenticated by the view, after the database is chosen,
+    so a user not known yet is found from the token of the request.
+    """
+    from core.models import PrimaryPin
+    pins = PrimaryPin.objects.active()
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return pins.filter(user=user).exists()
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or \
+            auth[0].lower() != TokenAuthentication.keyword.lower().encode():
+        return False
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        return False
+    return pins.filter(user__auth_token__key=key).exists()
+
+
+def replica_lag(alias):
+    """Returns the replication lag of a replica in seconds"""
+    with connections[alias].cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaRouter:
+    """Routes reads to healthy replicas when the current request allows it
+
+    Writes, reads inside a transaction and reads of requests which did not
+    opt in use the primary, as do all reads when no replica is healthy.
+    """
+
+    def __init__(self):
+        self.health = {}
+        self.counter = itertools.count()
+
+    def healthy_replicas(self):
+        """Returns the replicas reachable within the allowed lag"""
+        now = time.monotonic()
+        healthy = []
+        for alias in settings.DATABASE_REPLICAS:
+            checked, ok = self.health.get(alias, (None, False))
+            if checked is None or \
+                    now - checked >= settings.REPLICA_CHECK_INTERVAL:
+                try:
+                    ok = replica_lag(alias) <= \
+                        settings.REPLICA_MAX_LAG_SECONDS
+                except DatabaseError:
+                    ok = False
+                    connections[alias].close()
+                self.health[alias] = (now, ok)
+            if ok:
+                healthy.append(alias)
+        return healthy
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'replica', False) or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = self.healthy_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return replicas[next(self.counter) % len(replicas)]
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
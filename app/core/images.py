@@ -0,0 +1,82 @@
+import io
+import os
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+
+# Formats accepted for posters and the extensions they are stored with
+POSTER_FORMATS = {'JPEG': 'jpg', 'PNG': 'png'}
+
+
+class ImageRejected(ValueError):
+    """Raised when an upload cannot be accepted as a poster"""
+
+
+def probe_poster(upload):
+    """Returns the unloaded image of an upload after checking its limits
+
+    Only the header is parsed, so the format, the byte size and the pixel
+    count are enforced before any pixel is decoded. The file is then
+    verified, as ImageField does.
+    """
+    if upload.size > settings.POSTER_MAX_BYTES:
+        raise ImageRejected(
+            f'Images may not exceed {settings.POSTER_MAX_BYTES} bytes.')
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ImageRejected('Upload a valid JPEG or PNG image.')
+    if image.format not in POSTER_FORMATS:
+        raise ImageRejected('Upload a valid JPEG or PNG image.')
+    width, height = image.size
+    if width * height > settings.POSTER_MAX_PIXELS:
+        raise ImageRejected(
+            f'Images may not exceed {settings.POSTER_MAX_PIXELS} pixels.')
+    # Checks the structure of the file, such as the chunks and checksums
+    # of a PNG, without decoding pixels. Like Django's ImageField, any
+    # error of Pillow rejects the upload. A verified image cannot be
+    # loaded, so it is opened again.
+    try:
+        image.verify()
+        upload.seek(0)
+        return Image.open(upload)
+    except Exception:
+        raise ImageRejected('Upload a valid JPEG or PNG image.')
+
+
+def normalize_poster(upload, image):
+    """Returns the upload, downscaled and re-encoded if it is oversized
+
+    JPEG images are decoded at a reduced scale where possible, and images
+    whose decoded pixels would not fit POSTER_DECODE_BUDGET are refused.
+    """
+    side = settings.POSTER_MAX_SIDE
+    if max(image.size) <= side and \
+            upload.size <= settings.POSTER_NORMALIZE_BYTES:
+        upload.seek(0)
+        return upload
+    image_format = image.format
+    image.draft('RGB', (side, side))
+    width, height = image.size
+    if width * height * len(image.getbands()) > \
+            settings.POSTER_DECODE_BUDGET:
+        raise ImageRejected('The image is too large to be processed.')
+    try:
+        image.thumbnail((side, side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if image_format == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(buffer, 'JPEG', quality=85, optimize=True)
+        else:
+            image.save(buffer, 'PNG', optimize=True)
+    except (OSError, SyntaxError, ValueError):
+        raise ImageRejected('Upload a valid JPEG or PNG image.')
+    name = f'{os.path.splitext(upload.name)[0]}.' \
+        f'{POSTER_FORMATS[image_format]}'
+    return SimpleUploadedFile(name, buffer.getvalue(),
+                              content_type=Image.MIME[image_format])
@@ -0,0 +1,140 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.benchmark import measure, seed_catalog, write_results
+from core.models import Movie
+from movie.serializers import MovieSerializer, MovieDetailSerializer,\
+    TagSerializer, CastSerializer
+from user.serializers import UserSerializer
+
+
+BENCH_EMAIL = 'serializer-bench-{}@example.com'
+
+
+def _represent(serializer_class, objects):
+    return lambda: serializer_class(objects, many=True).data
+
+
+def _validate(serializer_class, payloads, context=None):
+    def validate():
+        serializer = serializer_class(data=payloads, many=True,
+                                      context=context)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+    return validate
+
+
+class Command(BaseCommand):
+    """Django command to microbenchmark the API serializers"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[1, 100, 10000])
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument('--repeats', type=int, default=5)
+        parser.add_argument('--min-time', type=float, default=0.2,
+                            help='Minimum seconds per timed sample')
+        parser.add_argument('--benchmark', action='append',
+                            help='Only run benchmarks starting with this')
+        parser.add_argument('--output', help='Write results as JSON')
+
+    def handle(self, *args, **options):
+        results = {
+            'warmup': options['warmup'],
+            'repeats': options['repeats'],
+            'benchmarks': {},
+        }
+        with transaction.atomic():
+            for name, size, func in self._benchmarks(options['sizes']):
+                if options['benchmark'] and not any(
+                        name.startswith(prefix)
+                        for prefix in options['benchmark']):
+                    continue
+                stats = measure(func, warmup=options['warmup'],
+                                repeats=options['repeats'],
+                                min_time=options['min_time'])
+                stats['size'] = size
+                stats['objects_per_sec'] = stats['calls_per_sec'] * size
+                results['benchmarks'][f'{name}[{size}]'] = stats
+                self.stdout.write(
+                    f"{name}[{size}]: "
+                    f"{stats['objects_per_sec']:.1f} objects/s "
+                    f"(+-{self._spread(stats):.1f}%) "
+                    f"peak={stats['peak_alloc_bytes'] / 1024:.1f}KiB"
+                )
+            transaction.set_rollback(True)
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(self.style.SUCCESS(
+                f"Results written to {options['output']}"))
+
+    def _spread(self, stats):
+        """Returns the relative standard deviation in percent"""
+        if not stats['median_s']:
+            return 0.0
+        return stats['stdev_s'] / stats['median_s'] * 100
+
+    def _benchmarks(self, sizes):
+        """Yields the name, size and callable of every benchmark"""
+        largest = max(sizes)
+        user = seed_catalog(users=1, movies=largest, tags=largest,
+                            casts=largest, email=BENCH_EMAIL)[0]
+        movies = list(Movie.objects.filter(user=user).prefetch_related(
+            'tag', 'cast').order_by('id'))
+        tags = list(user.tag_set.order_by('id'))
+        casts = list(user.cast_set.order_by('id'))
+        users = [get_user_model()(email=f'user-{i}@example.com',
+                                  name=f'User {i}')
+                 for i in range(largest)]
+        movie_payloads = [{
+            'title': movie.title,
+            'duration': '01:30:00',
+            'price': str(movie.price),
+            'tag': [tag.id for tag in movie.tag.all()],
+            'cast': [cast.id for cast in movie.cast.all()],
+        } for movie in movies]
+        user_payloads = [{
+            'email': f'new-{i}@example.com',
+            'password': 'password123',
+            'name': f'User {i}',
+        } for i in range(largest)]
+        renderer = JSONRenderer()
+        request = Request(APIRequestFactory().post('/'))
+        request.user = user
+        context = {'request': request}
+
+        for size in sizes:
+            yield ('movie-representation', size,
+                   _represent(MovieSerializer, movies[:size]))
+            yield ('movie-detail-representation', size,
+                   _represent(MovieDetailSerializer, movies[:size]))
+            yield ('tag-representation', size,
+                   _represent(TagSerializer, tags[:size]))
+            yield ('cast-representation', size,
+                   _represent(CastSerializer, casts[:size]))
+            yield ('user-representation', size,
+                   _represent(UserSerializer, users[:size]))
+            yield ('movie-validation', size,
+                   _validate(MovieSerializer, movie_payloads[:size],
+                             context))
+            yield ('tag-validation', size, _validate(
+                TagSerializer, [{'name': tag.name} for tag in tags[:size]]))
+            yield ('cast-validation', size, _validate(
+                CastSerializer,
+                [{'name': cast.name} for cast in casts[:size]]))
+            yield ('user-validation', size,
+                   _validate(UserSerializer, user_payloads[:size]))
+
+            movie_data = MovieSerializer(movies[:size], many=True).data
+            detail_data = MovieDetailSerializer(movies[:size],
+                                                many=True).data
+            yield ('movie-render', size,
+                   lambda data=movie_data: renderer.render(data))
+            yield ('movie-detail-render', size,
+                   lambda data=detail_data: renderer.render(data))
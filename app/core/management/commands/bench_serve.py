@@ -0,0 +1,102 @@
+import sys
+import time
+import signal
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import memory_usage, child_pids, write_results
+
+
+class Command(BaseCommand):
+    """Django command to measure the start-up and memory of serve
+
+    The serve command is started with and without preloading, timed until
+    it answers its first request and measured once every worker served a
+    few requests.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Requests sent before measuring memory')
+        parser.add_argument('--path', default='/api/movie/tags/')
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--output', help='Write results as JSON')
+
+    def handle(self, *args, **options):
+        results = {'workers': options['workers'], 'modes': {}}
+        for mode in ('preload', 'no-preload'):
+            stats = self._measure(mode, options)
+            results['modes'][mode] = stats
+            self.stdout.write(
+                f"{mode}: cold start {stats['cold_start_s']:.2f}s, "
+                f"per worker pss="
+                f"{stats['worker_pss_bytes'] / 2 ** 20:.1f}MiB "
+                f"uss={stats['worker_uss_bytes'] / 2 ** 20:.1f}MiB, "
+                f"total pss={stats['total_pss_bytes'] / 2 ** 20:.1f}MiB"
+            )
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(self.style.SUCCESS(
+                f"Results written to {options['output']}"))
+
+    def _measure(self, mode, options):
+        command = [sys.executable, sys.argv[0], 'serve',
+                   '--bind', '127.0.0.1:0',
+                   '--workers', str(options['workers'])]
+        if mode == 'no-preload':
+            command.append('--no-preload')
+        start = time.perf_counter()
+        server = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL,
+                                  universal_newlines=True)
+        try:
+            url = self._listening(server) + options['path']
+            deadline = start + options['timeout']
+            while not self._get(url):
+                if time.perf_counter() > deadline:
+                    raise CommandError(f'{mode}: no response from {url}')
+                time.sleep(0.01)
+            cold_start = time.perf_counter() - start
+            while len(child_pids(server.pid)) < options['workers']:
+                time.sleep(0.05)
+            for _ in range(options['requests']):
+                self._get(url)
+            master = memory_usage(server.pid)
+            workers = [memory_usage(pid) for pid in child_pids(server.pid)]
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(options['timeout'])
+        return {
+            'cold_start_s': cold_start,
+            'master_pss_bytes': master['pss_bytes'],
+            'worker_rss_bytes': statistics.mean(
+                worker['rss_bytes'] for worker in workers),
+            'worker_pss_bytes': statistics.mean(
+                worker['pss_bytes'] for worker in workers),
+            'worker_uss_bytes': statistics.mean(
+                worker['uss_bytes'] for worker in workers),
+            'total_pss_bytes': master['pss_bytes'] + sum(
+                worker['pss_bytes'] for worker in workers),
+        }
+
+    def _listening(self, server):
+        """Returns the base URL printed by a starting server"""
+        for line in server.stdout:
+            if line.startswith('Listening at '):
+                return line.split()[2]
+        raise CommandError('serve exited before listening')
+
+    def _get(self, url):
+        """Returns if the server answered a request"""
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+        except urllib.error.HTTPError:
+            pass
+        except OSError:
+            return False
+        return True
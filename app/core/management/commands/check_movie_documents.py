@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from core.models import Movie, MovieDocument
+
+
+class Command(BaseCommand):
+    """Django command to find and repair drifted movie documents
+
+    Movies are rendered again in id batches and compared with their stored
+    documents, which finds the missing and stale ones; documents of
+    deleted movies are orphans. With --repair they are rendered again or
+    deleted, which also fills the documents when they are first enabled.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Render missing and stale documents again '
+                                 'and delete orphaned ones')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        checked = missing = stale = 0
+        last = 0
+        while True:
+            movies = list(Movie.objects.filter(id__gt=last).order_by(
+                'id').prefetch_related('tag', 'cast')[:batch_size])
+            if not movies:
+                break
+            last = movies[-1].id
+            stored = dict(MovieDocument.objects.filter(
+                movie_id__in=[movie.id for movie in movies]
+            ).values_list('movie_id', 'body'))
+            drifted = []
+            for movie, body in zip(movies,
+                                   MovieDocument.objects.render(movies)):
+                if movie.id not in stored:
+                    missing += 1
+                elif bytes(stored[movie.id]) != body:
+                    stale += 1
+                else:
+                    continue
+                drifted.append(movie.id)
+            if drifted and options['repair']:
+                MovieDocument.objects.refresh(drifted)
+            checked += len(movies)
+
+        orphans = MovieDocument.objects.filter(
+            ~Exists(Movie.objects.filter(id=OuterRef('movie_id'))))
+        orphaned = orphans.delete()[0] if options['repair'] else \
+            orphans.count()
+
+        summary = f'Checked {checked} movies: {missing} missing, ' \
+            f'{stale} stale and {orphaned} orphaned documents'
+        if options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'{summary}, repaired'))
+        elif missing or stale or orphaned:
+            raise CommandError(summary)
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,66 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import Change, ChangeHorizon
+
+
+COLLAPSE_SQL = '''
+DELETE FROM core_change c
+WHERE c.seq > %s AND c.seq <= %s AND EXISTS (
+    SELECT 1 FROM core_change d
+    WHERE d.user_id = c.user_id AND d.kind = c.kind
+    AND d.object_id = c.object_id AND d.seq > c.seq
+)
+'''
+
+
+class Command(BaseCommand):
+    """Django command to compact the change feed
+
+    Entries superseded by a later change of the same object are removed and
+    tombstones older than the retention period are dropped, moving the
+    user's sync horizon past them.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Retention period of tombstones')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        collapsed = self._collapse(options['batch_size'])
+        dropped = self._drop_tombstones(
+            timezone.now() - datetime.timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {collapsed} superseded changes and '
+            f'{dropped} expired tombstones'
+        ))
+
+    def _collapse(self, batch_size):
+        """Deletes superseded changes in bounded sequence ranges"""
+        last = Change.objects.aggregate(last=Max('seq'))['last'] or 0
+        removed = 0
+        for start in range(0, last, batch_size):
+            with connection.cursor() as cursor:
+                cursor.execute(COLLAPSE_SQL, [start, start + batch_size])
+                removed += cursor.rowcount
+        return removed
+
+    def _drop_tombstones(self, cutoff):
+        """Deletes old tombstones and records the new horizons"""
+        dropped = 0
+        expired = Change.objects.filter(action=Change.ACTION_DELETE,
+                                        created__lt=cutoff)
+        for row in expired.values('user').annotate(seq=Max('seq')):
+            with transaction.atomic():
+                horizon, _ = ChangeHorizon.objects.select_for_update(
+                ).get_or_create(user_id=row['user'])
+                horizon.seq = max(horizon.seq, row['seq'])
+                horizon.save()
+                dropped += expired.filter(
+                    user_id=row['user'], seq__lte=row['seq']).delete()[0]
+        return dropped
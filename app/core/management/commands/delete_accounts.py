@@ -0,0 +1,128 @@
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from rest_framework.authtoken.models import Token
+
+from core.models import Tag, Cast, Movie, ChangeHorizon
+
+
+MOVIE_BATCH_SQL = '''
+SELECT id FROM core_movie WHERE user_id = %s ORDER BY id LIMIT %s
+'''
+
+DELETE_MOVIES_SQL = '''
+DELETE FROM core_movie WHERE user_id = %s AND id = ANY(%s)
+RETURNING image
+'''
+
+DELETE_SIMILAR_SQL = '''
+DELETE FROM core_similarmovie WHERE id IN (
+    SELECT id FROM core_similarmovie WHERE user_id = %s LIMIT %s
+)
+'''
+
+DELETE_MEMBERS_SQL = '''
+DELETE FROM {table} WHERE id IN (
+    SELECT id FROM {table} WHERE user_id = %s ORDER BY id LIMIT %s
+)
+RETURNING id
+'''
+
+DELETE_CHANGES_SQL = '''
+DELETE FROM core_change WHERE seq IN (
+    SELECT seq FROM core_change WHERE user_id = %s ORDER BY seq LIMIT %s
+)
+'''
+
+
+class Command(BaseCommand):
+    """Django command to delete user accounts with their catalogs
+
+    Deleting a user through the ORM loads every dependent row into memory
+    first. Here the account is deactivated and its token revoked, then
+    movies with their documents and view counts, tags, casts and changes
+    are deleted in bounded batches of short transactions, so memory stays
+    constant and locks are brief. The poster files of a batch are removed
+    once it is committed. An interrupted run is resumed by running the
+    command again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users',
+                            required=True,
+                            help='Email of a user to delete, repeatable')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(email__in=options['users'])
+        missing = set(options['users']) - set(
+            users.values_list('email', flat=True))
+        if missing:
+            raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        for user in users.order_by('id'):
+            self._delete_account(user, max(options['batch_size'], 1))
+
+    def _delete_account(self, user, batch_size):
+        """Deletes the catalog of a user in batches, then the user"""
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        Token.objects.filter(user=user).delete()
+
+        total = Movie.objects.filter(user=user).count()
+        deleted = files = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(MOVIE_BATCH_SQL, [user.pk, batch_size])
+                movie_ids = [row[0] for row in cursor.fetchall()]
+                if not movie_ids:
+                    break
+                for field in ('tag', 'cast'):
+                    cursor.execute(
+                        f'DELETE FROM '
+                        f'{getattr(Movie, field).through._meta.db_table} '
+                        f'WHERE movie_id = ANY(%s)', [movie_ids])
+                cursor.execute('DELETE FROM core_moviedocument '
+                               'WHERE movie_id = ANY(%s)', [movie_ids])
+                cursor.execute('DELETE FROM core_viewcount '
+                               'WHERE movie_id = ANY(%s)', [movie_ids])
+                cursor.execute(DELETE_MOVIES_SQL, [user.pk, movie_ids])
+                images = [row[0] for row in cursor.fetchall() if row[0]]
+            for name in images:
+                default_storage.delete(name)
+            deleted += len(movie_ids)
+            files += len(images)
+            self.stdout.write(f'{user.email}: deleted {deleted} of {total} '
+                              f'movies and {files} posters')
+
+        self._delete_batches(DELETE_SIMILAR_SQL, user, batch_size)
+        for model in (Tag, Cast):
+            field = model._meta.model_name
+            table = getattr(Movie, field).through._meta.db_table
+            while True:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(DELETE_MEMBERS_SQL.format(
+                        table=model._meta.db_table), [user.pk, batch_size])
+                    member_ids = [row[0] for row in cursor.fetchall()]
+                    if not member_ids:
+                        break
+                    # Left by movies of other users the member was added to
+                    cursor.execute(f'DELETE FROM {table} '
+                                   f'WHERE {field}_id = ANY(%s)', [member_ids])
+        self._delete_batches(DELETE_CHANGES_SQL, user, batch_size)
+        ChangeHorizon.objects.filter(user=user).delete()
+
+        # Nothing of the catalog is left for the collector to load
+        email = user.email
+        user.delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {email} with {deleted} movies and {files} posters'))
+
+    def _delete_batches(self, sql, user, batch_size):
+        """Runs a batched delete until it deletes no more rows"""
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [user.pk, batch_size])
+                if cursor.rowcount < batch_size:
+                    return
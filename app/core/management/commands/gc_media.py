@@ -0,0 +1,83 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Movie, MOVIE_IMAGE_DIR
+
+
+class Command(BaseCommand):
+    """Django command to delete poster files no movie refers to
+
+    The upload directory is walked lazily and its files are looked up in
+    batches against the image index of the movies, so memory is bounded
+    by the batch size whatever the number of files. Files younger than
+    the grace period are kept, as their movie may not be committed yet.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Minimum age of the files deleted')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the files without deleting them')
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options['grace_hours'] * 3600
+        batch_size = max(options['batch_size'], 1)
+        scanned = removed = freed = 0
+        batch = []
+        for entry in self._scan(os.path.join(settings.MEDIA_ROOT,
+                                             MOVIE_IMAGE_DIR)):
+            scanned += 1
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < cutoff:
+                batch.append((entry, stat.st_size))
+            if len(batch) >= batch_size:
+                count, size = self._collect(batch, options['dry_run'])
+                removed, freed, batch = removed + count, freed + size, []
+        if batch:
+            count, size = self._collect(batch, options['dry_run'])
+            removed, freed = removed + count, freed + size
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {removed} unreferenced files ({freed} bytes) '
+            f'of {scanned} scanned'
+        ))
+
+    def _scan(self, path):
+        """Yields the files under a directory without listing it whole"""
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._scan(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    def _collect(self, batch, dry_run):
+        """Deletes the files of a batch no movie refers to"""
+        names = {
+            os.path.relpath(entry.path, settings.MEDIA_ROOT).replace(
+                os.sep, '/'): (entry, size)
+            for entry, size in batch
+        }
+        referenced = set(Movie.objects.filter(
+            image__in=list(names)).values_list('image', flat=True))
+        removed = freed = 0
+        for name, (entry, size) in names.items():
+            if name in referenced:
+                continue
+            if dry_run:
+                self.stdout.write(f'Would remove {name}')
+            else:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            freed += size
+        return removed, freed
@@ -0,0 +1,320 @@
+import io
+import os
+import csv
+import json
+import decimal
+import hashlib
+import itertools
+import multiprocessing
+from collections import Counter, deque
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_duration
+
+from core.models import Tag, Cast, Movie, Change, MovieDocument, \
+    SimilarMovie, ImportCheckpoint
+
+
+LIST_SEPARATOR = '|'
+PRICE_QUANTUM = decimal.Decimal('0.001')
+MAX_PRICE = decimal.Decimal('9999.999')
+
+
+def _names(value):
+    """Returns a list of tag or cast names from a CSV cell or JSON list"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    names = []
+    for name in value:
+        name = str(name).strip()
+        if len(name) > 255:
+            raise ValueError(f'name longer than 255 characters: {name!r}')
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _duration(value):
+    """Parses a duration given in minutes or as [DD ][HH:[MM:]]ss"""
+    if isinstance(value, (int, float)):
+        value = str(value)
+    value = (value or '').strip()
+    if value.isdigit():
+        value = f'{int(value) * 60}'
+    duration = parse_duration(value)
+    if duration is None:
+        raise ValueError(f'invalid duration: {value!r}')
+    return duration
+
+
+def _price(value):
+    """Parses a price into the precision stored by Movie.price"""
+    try:
+        price = decimal.Decimal(str(value).strip()).quantize(PRICE_QUANTUM)
+    except (decimal.InvalidOperation, TypeError):
+        raise ValueError(f'invalid price: {value!r}')
+    if not 0 <= price <= MAX_PRICE:
+        raise ValueError(f'price out of range: {value!r}')
+    return price
+
+
+def parse_record(fmt, raw):
+    """Returns the movie fields and names of one raw record"""
+    record = json.loads(raw) if fmt == 'jsonl' else raw
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+    title = (record.get('title') or '').strip()
+    if not title or len(title) > 255:
+        raise ValueError('title is required and at most 255 characters')
+    url = (record.get('url') or '').strip()
+    if len(url) > 400:
+        raise ValueError('url longer than 400 characters')
+    return {
+        'title': title,
+        'url': url,
+        'duration': _duration(record.get('duration')),
+        'price': _price(record.get('price')),
+        'tag': _names(record.get('tag', record.get('tags'))),
+        'cast': _names(record.get('cast', record.get('casts'))),
+    }
+
+
+def parse_chunk(fmt, chunk):
+    """Parses a chunk of numbered raw records into movies and errors"""
+    movies = []
+    errors = []
+    for number, raw in chunk:
+        try:
+            movies.append((number, parse_record(fmt, raw)))
+        except ValueError as exc:
+            errors.append({'record': number, 'error': str(exc),
+                           'raw': raw})
+    return movies, errors
+
+
+def read_records(path, fmt):
+    """Yields raw records of a CSV or JSONL file one at a time"""
+    with open(path, newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield line
+
+
+def checkpoint_name(path):
+    """Returns the default checkpoint name of a file, its absolute path
+
+    Paths longer than the name column keep their end, with the file name,
+    after a hash of the whole path telling them apart.
+    """
+    path = os.path.abspath(path)
+    max_length = ImportCheckpoint._meta.get_field('name').max_length
+    if len(path) <= max_length:
+        return path
+    digest = hashlib.sha256(path.encode()).hexdigest()
+    return f'{digest}:{path[len(digest) + 1 - max_length:]}'
+
+
+class Command(BaseCommand):
+    """Django command to bulk import a movie catalog for a user"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument('--user', required=True,
+                            help='Email of the catalog owner')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int,
+                            default=max((os.cpu_count() or 1) - 1, 0),
+                            help='Parse processes, 0 parses inline')
+        parser.add_argument('--checkpoint',
+                            help='Name of the checkpoint, defaults to the '
+                                 'absolute path of the file, hashed if '
+                                 'longer than 255 characters')
+        parser.add_argument('--errors',
+                            help='Defaults to <path>.errors.jsonl')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError(f'Unknown format: {fmt}')
+        try:
+            self.user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}")
+        self.checkpoint = options['checkpoint'] or checkpoint_name(path)
+        if len(self.checkpoint) > \
+                ImportCheckpoint._meta.get_field('name').max_length:
+            raise CommandError('The checkpoint name is too long')
+        self.progress = self._load_checkpoint(options['restart'])
+        self.names = {Tag: {}, Cast: {}}
+
+        records = itertools.islice(
+            enumerate(read_records(path, fmt), start=1),
+            self.progress['records'], None
+        )
+        chunks = iter(lambda: list(
+            itertools.islice(records, options['batch_size'])), [])
+        errors_path = options['errors'] or f'{path}.errors.jsonl'
+        mode = 'w' if self.progress['records'] == 0 else 'a'
+        with open(errors_path, mode, encoding='utf-8') as errors_file:
+            for movies, errors, last in self._parse(
+                    fmt, chunks, options['workers']):
+                for error in errors:
+                    errors_file.write(json.dumps(error) + '\n')
+                errors_file.flush()
+                self.progress['records'] = last
+                self.progress['imported'] += len(movies)
+                self.progress['errors'] += len(errors)
+                self._write(movies)
+                self.stdout.write(
+                    f"{self.progress['records']} records, "
+                    f"{self.progress['imported']} imported, "
+                    f"{self.progress['errors']} rejected"
+                )
+        self._analyze()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.progress['imported']} movies, "
+            f"{self.progress['errors']} rejected (see {errors_path})"
+        ))
+
+    def _parse(self, fmt, chunks, workers):
+        """Yields parsed chunks in file order with bounded read-ahead"""
+        if workers == 0:
+            for chunk in chunks:
+                yield parse_chunk(fmt, chunk) + (chunk[-1][0],)
+            return
+        with multiprocessing.Pool(workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((pool.apply_async(parse_chunk, (fmt, chunk)),
+                                chunk[-1][0]))
+                if len(pending) >= workers * 2:
+                    result, last = pending.popleft()
+                    yield result.get() + (last,)
+            while pending:
+                result, last = pending.popleft()
+                yield result.get() + (last,)
+
+    def _resolve(self, model, names):
+        """Returns ids of the user's tags or casts, creating missing ones"""
+        cache = self.names[model]
+        missing = [name for name in names if name not in cache]
+        if missing:
+            for pk, name in model.objects.filter(
+                    user=self.user, name__in=missing
+            ).order_by('-id').values_list('id', 'name'):
+                cache[name] = pk
+            created = model.objects.bulk_create([
+                model(user=self.user, name=name)
+                for name in missing if name not in cache
+            ])
+            for obj in created:
+                cache[obj.name] = obj.id
+            Change.objects.record(
+                self.user.id, model._meta.model_name,
+                [obj.id for obj in created], Change.ACTION_UPSERT
+            )
+        return cache
+
+    def _copy(self, cursor, model, columns, rows):
+        """Streams rows into the table of model with COPY"""
+        buffer = io.StringIO()
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f'COPY {model._meta.db_table} ({", ".join(columns)}) '
+            f'FROM STDIN WITH (FORMAT csv)', buffer
+        )
+
+    def _write(self, movies):
+        """Inserts a parsed batch and records the progress it makes
+
+        Both commit in one transaction, so a resumed import neither skips
+        nor repeats a batch. Rejected records are reported before, and may
+        be reported again when the import stops before the commit.
+        """
+        with transaction.atomic():
+            if movies:
+                self._insert(movies)
+            self._save_checkpoint()
+
+    def _insert(self, movies):
+        """Inserts a parsed batch and its m2m rows"""
+        tag_names = {name for _, movie in movies for name in movie['tag']}
+        cast_names = {name for _, movie in movies for name in movie['cast']}
+        with connection.cursor() as cursor:
+            tag_ids = self._resolve(Tag, tag_names)
+            cast_ids = self._resolve(Cast, cast_names)
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                "FROM generate_series(1, %s)",
+                [Movie._meta.db_table, len(movies)]
+            )
+            movie_ids = [row[0] for row in cursor.fetchall()]
+            self._copy(cursor, Movie, (
+                'id', 'user_id', 'title', 'url', 'duration', 'price'
+            ), ((
+                movie_id, self.user.id, movie['title'], movie['url'],
+                f"{movie['duration'].total_seconds()} seconds",
+                movie['price'],
+            ) for movie_id, (_, movie) in zip(movie_ids, movies)))
+            self._copy(cursor, Movie.tag.through, ('movie_id', 'tag_id'), (
+                (movie_id, tag_ids[name])
+                for movie_id, (_, movie) in zip(movie_ids, movies)
+                for name in movie['tag']
+            ))
+            self._copy(cursor, Movie.cast.through, ('movie_id', 'cast_id'), (
+                (movie_id, cast_ids[name])
+                for movie_id, (_, movie) in zip(movie_ids, movies)
+                for name in movie['cast']
+            ))
+            usage = {
+                'tag': Counter(tag_ids[name] for _, movie in movies
+                               for name in movie['tag']),
+                'cast': Counter(cast_ids[name] for _, movie in movies
+                                for name in movie['cast']),
+            }
+            Tag.objects.adjust_usage(usage['tag'])
+            Cast.objects.adjust_usage(usage['cast'])
+            Change.objects.record(self.user.id, Change.KIND_MOVIE,
+                                  movie_ids, Change.ACTION_UPSERT)
+            if settings.MOVIE_DOCUMENTS:
+                MovieDocument.objects.refresh(movie_ids)
+            # COPY sends no m2m_changed, the similar movies of the batch
+            # and of the movies sharing its tags and casts are updated here
+            for field, members in usage.items():
+                SimilarMovie.objects.update_members(
+                    self.user.id, field, movie_ids, list(members))
+
+    def _analyze(self):
+        """Refreshes planner statistics of the tables the import grew"""
+        with connection.cursor() as cursor:
+            for model in (Movie, Movie.tag.through, Movie.cast.through):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def _load_checkpoint(self, restart):
+        """Returns the progress recorded by an interrupted import"""
+        progress = {'records': 0, 'imported': 0, 'errors': 0}
+        checkpoint = ImportCheckpoint.objects.filter(
+            name=self.checkpoint, user=self.user).first()
+        if not restart and checkpoint is not None:
+            self.stdout.write(f'Resuming after record {checkpoint.records}')
+            progress = {key: getattr(checkpoint, key) for key in progress}
+        return progress
+
+    def _save_checkpoint(self):
+        """Records the progress of the import"""
+        ImportCheckpoint.objects.update_or_create(
+            user=self.user, name=self.checkpoint, defaults=self.progress)
@@ -0,0 +1,277 @@
+import io
+import time
+import random
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+
+from core.benchmark import BENCH_PASSWORD, BENCH_ADMIN_EMAIL, bench_users,\
+    summarize_latencies, compare_results, load_results, write_results
+from core.models import Movie
+
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+ADMIN = 'admin'
+
+
+def _movie_payload(ctx):
+    """Returns a movie payload using the context's tags and casts"""
+    return {
+        'title': f'Load {ctx["rng"].randint(0, 10 ** 9)}',
+        'duration': '01:30:00',
+        'price': '9.990',
+        'tag': ctx['rng'].sample(ctx['tag_ids'], min(2, len(ctx['tag_ids']))),
+        'cast': ctx['rng'].sample(ctx['cast_ids'],
+                                  min(2, len(ctx['cast_ids']))),
+    }
+
+
+def _form(data):
+    """Returns keyword arguments for a form encoded PUT/PATCH body"""
+    return {'data': urlencode(data, doseq=True),
+            'content_type': FORM_CONTENT_TYPE}
+
+
+def _image():
+    """Returns a small JPEG upload"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='JPEG')
+    return SimpleUploadedFile('poster.jpg', buffer.getvalue(),
+                              content_type='image/jpeg')
+
+
+def _movie_id(ctx):
+    return ctx['rng'].choice(ctx['movie_ids'])
+
+
+SCENARIOS = {
+    'user-create': lambda ctx: ('post', reverse('user:create'), {'data': {
+        'email': f'load-{ctx["rng"].randint(0, 10 ** 12)}@example.com',
+        'password': BENCH_PASSWORD,
+        'name': 'Load',
+    }}, False),
+    'user-token': lambda ctx: ('post', reverse('user:token'), {'data': {
+        'email': ctx['user'].email, 'password': BENCH_PASSWORD,
+    }}, False),
+    'user-me': lambda ctx: ('get', reverse('user:me'), {}, True),
+    'user-me-update': lambda ctx: (
+        'patch', reverse('user:me'), _form({'name': 'Bench'}), True),
+    'tag-list': lambda ctx: ('get', reverse('movie:tag-list'), {}, True),
+    'tag-list-assigned': lambda ctx: (
+        'get', reverse('movie:tag-list'), {'data': {'assigned_only': 1}},
+        True),
+    'tag-create': lambda ctx: (
+        'post', reverse('movie:tag-list'), {'data': {'name': 'Load'}}, True),
+    'cast-list': lambda ctx: ('get', reverse('movie:cast-list'), {}, True),
+    'cast-create': lambda ctx: (
+        'post', reverse('movie:cast-list'), {'data': {'name': 'Load'}},
+        True),
+    'movie-list': lambda ctx: ('get', reverse('movie:movie-list'), {}, True),
+    'movie-list-filtered': lambda ctx: (
+        'get', reverse('movie:movie-list'),
+        {'data': {'tag': ctx['rng'].choice(ctx['tag_ids'])}}, True),
+    'movie-list-facets': lambda ctx: (
+        'get', reverse('movie:movie-list'),
+        {'data': {'tag': ctx['rng'].choice(ctx['tag_ids']),
+                  'facets': 'tag,cast', 'limit': 50}}, True),
+    'change-feed': lambda ctx: (
+        'get', reverse('movie:changes'), {'data': {'limit': 100}}, True),
+    'movie-export': lambda ctx: (
+        'get', reverse('movie:movie-export'), {}, True),
+    'movie-create': lambda ctx: (
+        'post', reverse('movie:movie-list'), {'data': _movie_payload(ctx)},
+        True),
+    'movie-retrieve': lambda ctx: (
+        'get', reverse('movie:movie-detail', args=[_movie_id(ctx)]), {},
+        True),
+    'movie-update': lambda ctx: (
+        'put', reverse('movie:movie-detail', args=[_movie_id(ctx)]),
+        _form(_movie_payload(ctx)), True),
+    'movie-partial-update': lambda ctx: (
+        'patch', reverse('movie:movie-detail', args=[_movie_id(ctx)]),
+        _form({'price': '7.990'}), True),
+    'movie-destroy': lambda ctx: (
+        'delete',
+        reverse('movie:movie-detail', args=[ctx['disposable'].pop()]), {},
+        True),
+    'movie-upload-image': lambda ctx: (
+        'post', reverse('movie:movie-upload-image', args=[_movie_id(ctx)]),
+        {'data': {'image': _image()}}, True),
+    'admin-movie-changelist': lambda ctx: (
+        'get', reverse('admin:core_movie_changelist'), {}, ADMIN),
+    'admin-movie-search': lambda ctx: (
+        'get', reverse('admin:core_movie_changelist'),
+        {'data': {'q': 'Movie 1'}}, ADMIN),
+    'admin-movie-change': lambda ctx: (
+        'get', reverse('admin:core_movie_change', args=[_movie_id(ctx)]), {},
+        ADMIN),
+    'admin-user-changelist': lambda ctx: (
+        'get', reverse('admin:core_user_changelist'), {}, ADMIN),
+    'admin-tag-autocomplete': lambda ctx: (
+        'get', reverse('admin:core_tag_autocomplete'),
+        {'data': {'term': 'Tag'}}, ADMIN),
+}
+
+
+class Command(BaseCommand):
+    """Django command to drive concurrent load against the API"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--scenario', action='append',
+                            choices=sorted(SCENARIOS),
+                            help='Scenario to run, defaults to all')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--output', default='loadtest.json')
+        parser.add_argument('--baseline',
+                            help='Results file to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        contexts = self._contexts(options)
+        results = {
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'seed': options['seed'],
+            'users': len(contexts),
+            'scenarios': {},
+        }
+        for name in options['scenario'] or sorted(SCENARIOS):
+            if name == 'movie-destroy':
+                self._add_disposable(contexts, options['requests'])
+            summary = self._run(SCENARIOS[name], contexts, options)
+            results['scenarios'][name] = summary
+            self.stdout.write(
+                f"{name}: p50={summary['p50_ms']}ms "
+                f"p95={summary['p95_ms']}ms p99={summary['p99_ms']}ms "
+                f"rps={summary['throughput_rps']} "
+                f"queries={summary['queries_per_request']} "
+                f"errors={summary['errors']}"
+            )
+        write_results(options['output'], results)
+        self.stdout.write(self.style.SUCCESS(
+            f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            regressions = compare_results(
+                results, load_results(options['baseline']),
+                options['tolerance']
+            )
+            if regressions:
+                raise CommandError(
+                    'Regressions found:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions found'))
+
+    def _contexts(self, options):
+        """Returns one request context per seeded user"""
+        contexts = []
+        admin = get_user_model().objects.filter(
+            email=BENCH_ADMIN_EMAIL).first()
+        if admin is None:
+            admin = get_user_model().objects.create_superuser(
+                BENCH_ADMIN_EMAIL, BENCH_PASSWORD)
+        for user in bench_users():
+            token, _ = Token.objects.get_or_create(user=user)
+            contexts.append({
+                'admin': admin,
+                'user': user,
+                'auth': f'Token {token.key}',
+                'movie_ids': list(Movie.objects.filter(
+                    user=user).values_list('id', flat=True)[:1000]),
+                'tag_ids': list(user.tag_set.values_list(
+                    'id', flat=True)[:1000]),
+                'cast_ids': list(user.cast_set.values_list(
+                    'id', flat=True)[:1000]),
+                'disposable': [],
+            })
+        if not contexts or not all(ctx['movie_ids'] for ctx in contexts):
+            raise CommandError('No seeded catalog, run seed_catalog first')
+        return contexts
+
+    def _add_disposable(self, contexts, count):
+        """Creates movies which the destroy scenario can delete"""
+        for ctx in contexts:
+            template = Movie.objects.get(id=ctx['movie_ids'][0])
+            ctx['disposable'] = [movie.id for movie in
+                                 Movie.objects.bulk_create([Movie(
+                                     user=ctx['user'],
+                                     title='Disposable',
+                                     duration=template.duration,
+                                     price=template.price,
+                                 ) for _ in range(count)])]
+
+    def _run(self, scenario, contexts, options):
+        """Runs one scenario and returns its summary"""
+        latencies = []
+        queries = []
+        errors = []
+        lock = threading.Lock()
+        counter = itertools.count()
+        concurrency = options['concurrency']
+
+        def worker(index):
+            client = Client(HTTP_HOST=options['host'])
+            rng = random.Random(options['seed'] + index)
+            count = [0]
+            logged_in = False
+
+            def count_queries(execute, sql, params, many, context):
+                count[0] += 1
+                return execute(sql, params, many, context)
+
+            try:
+                while next(counter) < options['requests']:
+                    ctx = dict(rng.choice(contexts), rng=rng)
+                    with lock:
+                        method, path, kwargs, auth = scenario(ctx)
+                    if auth == ADMIN:
+                        if not logged_in:
+                            client.force_login(ctx['admin'])
+                            logged_in = True
+                    elif auth:
+                        kwargs['HTTP_AUTHORIZATION'] = ctx['auth']
+                    count[0] = 0
+                    with connection.execute_wrapper(count_queries):
+                        start = time.perf_counter()
+                        res = getattr(client, method)(path, **kwargs)
+                        if res.streaming:
+                            for _ in res.streaming_content:
+                                pass
+                        latency = time.perf_counter() - start
+                    with lock:
+                        latencies.append(latency)
+                        queries.append(count[0])
+                        if res.status_code >= 400:
+                            errors.append(res.status_code)
+            finally:
+                if concurrency > 1:
+                    connection.close()
+
+        start = time.perf_counter()
+        if concurrency == 1:
+            worker(0)
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                for future in [pool.submit(worker, index)
+                               for index in range(concurrency)]:
+                    future.result()
+        elapsed = time.perf_counter() - start
+
+        summary = summarize_latencies(latencies, elapsed, queries)
+        summary['errors'] = len(errors)
+        return summary
@@ -0,0 +1,231 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import Movie
+
+
+CONSTRAINTS_SQL = '''
+SELECT conname, pg_get_constraintdef(oid), confrelid = %s::regclass
+FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype <> 'p'
+ORDER BY conname
+'''
+
+INDEXES_SQL = '''
+SELECT i.relname, pg_get_indexdef(i.oid)
+FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+WHERE x.indrelid = %s::regclass AND NOT EXISTS (
+    SELECT 1 FROM pg_constraint c
+    WHERE c.conrelid = x.indrelid AND c.conindid = x.indexrelid
+)
+ORDER BY i.relname
+'''
+
+REFERENCES_SQL = '''
+SELECT conrelid::regclass::text, conname
+FROM pg_constraint
+WHERE confrelid = %s::regclass AND contype = 'f'
+AND conrelid <> ALL(%s::regclass[])
+'''
+
+MIRROR_SQL = '''
+CREATE FUNCTION {shadow}_mirror() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM {shadow} WHERE id = OLD.id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO {shadow} SELECT NEW.* ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$;
+CREATE TRIGGER {shadow}_mirror AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {shadow}_mirror();
+'''
+
+# Rows are locked while copied so a concurrent update or delete waits and
+# its mirror trigger sees the copy
+BACKFILL_SQL = '''
+INSERT INTO {shadow}
+SELECT * FROM {table} WHERE id > %s AND id <= %s FOR SHARE
+ON CONFLICT DO NOTHING
+'''
+
+
+def _renamed(name, suffix):
+    """Returns name with a suffix, within the identifier length limit"""
+    return f'{name[:63 - len(suffix)]}{suffix}'
+
+
+class Command(BaseCommand):
+    """Django command to hash partition the movie tables
+
+    Movies are partitioned by user and the tag and cast through tables by
+    movie, so the per-user queries of the API scan a single partition.
+    Shadow tables are created and kept in sync by triggers while existing
+    rows are copied in batches, then swapped in place of the originals in
+    one short transaction. The originals are kept as <table>_old until
+    --drop-old is given.
+
+    Unique constraints of partitioned tables must include the partition
+    key, so the primary keys become (id, <key>) and foreign keys
+    referencing core_movie are dropped; the ORM keeps cascading deletes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--drop-old', action='store_true',
+                            help='Drop the tables left by the swap')
+
+    def handle(self, *args, **options):
+        if connection.pg_version < 110000:
+            raise CommandError('Hash partitioning needs PostgreSQL 11+')
+        self.tables = (
+            (Movie._meta.db_table, 'user_id'),
+            (Movie.tag.through._meta.db_table, 'movie_id'),
+            (Movie.cast.through._meta.db_table, 'movie_id'),
+        )
+        if options['drop_old']:
+            self._drop_old()
+            return
+        if self._relkind(self.tables[0][0]) == 'p':
+            raise CommandError('The movie tables are already partitioned')
+
+        with transaction.atomic():
+            for table, key in self.tables:
+                if self._relkind(f'{table}_p') is None:
+                    self._create_shadow(table, key, options['partitions'])
+        for table, key in self.tables:
+            self._backfill(table, options['batch_size'])
+        with transaction.atomic():
+            self._swap()
+        with connection.cursor() as cursor:
+            for table, key in self.tables:
+                cursor.execute(f'ANALYZE {table}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Partitioned the movie tables into {options['partitions']} "
+            f"partitions, the originals are kept as *_old"
+        ))
+
+    def _relkind(self, name):
+        """Returns the kind of a relation or None if it does not exist"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)',
+                [name]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _create_shadow(self, table, key, partitions):
+        """Creates the partitioned copy of a table and its mirror trigger"""
+        shadow = f'{table}_p'
+        movie_table = Movie._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS) '
+                f'PARTITION BY HASH ({key})'
+            )
+            for remainder in range(partitions):
+                cursor.execute(
+                    f'CREATE TABLE {shadow}{remainder} PARTITION OF {shadow} '
+                    f'FOR VALUES WITH (MODULUS {partitions}, '
+                    f'REMAINDER {remainder})'
+                )
+            cursor.execute(f'ALTER TABLE {shadow} ADD CONSTRAINT '
+                           f'{shadow}_pkey PRIMARY KEY (id, {key})')
+            cursor.execute(CONSTRAINTS_SQL, [movie_table, table])
+            for name, definition, to_movie in cursor.fetchall():
+                if not to_movie:
+                    cursor.execute(
+                        f'ALTER TABLE {shadow} ADD CONSTRAINT '
+                        f'{_renamed(name, "_p")} {definition}'
+                    )
+            cursor.execute(INDEXES_SQL, [table])
+            for name, definition in cursor.fetchall():
+                cursor.execute(re.sub(
+                    r'^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+',
+                    rf'\1 {_renamed(name, "_p")} ON {shadow}', definition
+                ))
+            cursor.execute(MIRROR_SQL.format(shadow=shadow, table=table))
+        self.stdout.write(f'Created {shadow} with {partitions} partitions')
+
+    def _backfill(self, table, batch_size):
+        """Copies the rows of a table into its shadow in id batches"""
+        shadow = f'{table}_p'
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT max(id) FROM {table}')
+            last = cursor.fetchone()[0] or 0
+        for start in range(0, last, batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    BACKFILL_SQL.format(shadow=shadow, table=table),
+                    [start, start + batch_size]
+                )
+            self.stdout.write(f'{table}: copied ids up to '
+                              f'{min(start + batch_size, last)} of {last}')
+
+    def _swap(self):
+        """Replaces the original tables with their partitioned copies"""
+        names = [table for table, _ in self.tables]
+        movie_table = Movie._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {", ".join(names)} '
+                           f'IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(REFERENCES_SQL, [movie_table, names])
+            for referencing, name in cursor.fetchall():
+                cursor.execute(
+                    f'ALTER TABLE {referencing} DROP CONSTRAINT {name}')
+            # The movie table goes last as its name identifies references
+            for table, _ in reversed(self.tables):
+                shadow = f'{table}_p'
+                cursor.execute(f'DROP TRIGGER {shadow}_mirror ON {table}')
+                cursor.execute(f'DROP FUNCTION {shadow}_mirror()')
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')",
+                               [table])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(CONSTRAINTS_SQL, [movie_table, table])
+                constraints = cursor.fetchall()
+                cursor.execute(INDEXES_SQL, [table])
+                indexes = [name for name, _ in cursor.fetchall()]
+
+                cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT '
+                               f'{table}_pkey TO {table}_old_pkey')
+                for name, _, to_movie in constraints:
+                    cursor.execute(
+                        f'ALTER TABLE {table} RENAME CONSTRAINT {name} '
+                        f'TO {_renamed(name, "_old")}'
+                    )
+                    if not to_movie:
+                        cursor.execute(
+                            f'ALTER TABLE {shadow} RENAME CONSTRAINT '
+                            f'{_renamed(name, "_p")} TO {name}'
+                        )
+                for name in indexes:
+                    cursor.execute(f'ALTER INDEX {name} '
+                                   f'RENAME TO {_renamed(name, "_old")}')
+                    cursor.execute(f'ALTER INDEX {_renamed(name, "_p")} '
+                                   f'RENAME TO {name}')
+                cursor.execute(f'ALTER TABLE {shadow} RENAME CONSTRAINT '
+                               f'{shadow}_pkey TO {table}_pkey')
+                cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+                cursor.execute(f'ALTER TABLE {shadow} RENAME TO {table}')
+                cursor.execute(f'ALTER SEQUENCE {sequence} '
+                               f'OWNED BY {table}.id')
+
+    def _drop_old(self):
+        """Drops the original tables once the partitioned ones are live"""
+        old = [f'{table}_old' for table, _ in reversed(self.tables)
+               if self._relkind(f'{table}_old') is not None]
+        if not old:
+            raise CommandError('There are no original tables to drop')
+        with connection.cursor() as cursor:
+            # Deferred foreign key checks of the old tables must not be left
+            # pending when they are dropped
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute(f'DROP TABLE {", ".join(old)}')
+        self.stdout.write(self.style.SUCCESS(f'Dropped {", ".join(old)}'))
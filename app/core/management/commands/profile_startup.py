@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import DEFERRED_MODULES, parse_importtime, \
+    summarize_imports, compare_startup, load_results, write_results
+
+
+# Lists the loaded modules on exit, as -X importtime misses the modules
+# loaded by importlib
+LOADED_MODULES_SCRIPT = '''
+import sys, atexit
+atexit.register(lambda: print('Loaded modules:', *sorted(sys.modules),
+                              file=sys.stderr))
+'''
+
+# Runs a management command like manage.py
+COMMAND_SCRIPT = LOADED_MODULES_SCRIPT + '''
+import runpy
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+# Boots the project, answers one request in process and exits
+FIRST_REQUEST_SCRIPT = LOADED_MODULES_SCRIPT + '''
+import os
+from wsgiref.util import setup_testing_defaults
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+environ = {'PATH_INFO': sys.argv[1], 'HTTP_HOST': 'localhost'}
+setup_testing_defaults(environ)
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None:
+                     statuses.append(status)))
+print(statuses[0])
+'''
+
+
+class Command(BaseCommand):
+    """Django command to profile the start-up of the project
+
+    Reports the time to run a management command and the time to answer
+    the first request from a fresh interpreter, with the import time of
+    each spent per package and the deferred modules either imported.
+    Commands with their own options are given after --, for example
+    profile_startup -- migrate --plan.
+    """
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('command', nargs='*', default=['wait_for_db'])
+        parser.add_argument('--path', default='/api/movie/tags/',
+                            help='Path of the first request')
+        parser.add_argument('--repeats', type=int, default=5,
+                            help='Runs timed, the fastest is reported')
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--output', help='Write results as JSON')
+        parser.add_argument('--baseline', help='Fail on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        self.cwd = settings.BASE_DIR
+        manage = os.path.join(self.cwd, 'manage.py')
+        runs = {
+            'command': (' '.join(options['command']),
+                        ['-c', COMMAND_SCRIPT, manage] + options['command']),
+            'first_request': (f"GET {options['path']}",
+                              ['-c', FIRST_REQUEST_SCRIPT, options['path']]),
+        }
+        results = {'startup': {}}
+        for name, (label, argv) in runs.items():
+            stats = self._profile(argv, options)
+            results['startup'][name] = stats
+            self.stdout.write(
+                f"{name} ({label}): "
+                f"{stats['wall_s']:.3f}s, {stats['modules']} modules "
+                f"imported in {stats['import_s']:.3f}s"
+            )
+            for package, seconds in stats['packages']:
+                self.stdout.write(f'  {package:<32} {seconds * 1000:8.1f}ms')
+            self.stdout.write(
+                f"  deferred modules imported: "
+                f"{', '.join(stats['deferred']) or 'none'}"
+            )
+
+        if options['output']:
+            write_results(options['output'], results)
+            self.stdout.write(self.style.SUCCESS(
+                f"Results written to {options['output']}"))
+        if options['baseline']:
+            regressions = compare_startup(
+                results, load_results(options['baseline']),
+                options['tolerance']
+            )
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def _run(self, argv, *flags):
+        """Runs the interpreter and returns its wall time and output"""
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, *flags, *argv], cwd=self.cwd,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        elapsed = time.perf_counter() - start
+        if process.returncode:
+            raise CommandError(f"{' '.join(argv)} failed:\n{process.stderr}")
+        return elapsed, process
+
+    def _profile(self, argv, options):
+        """Returns the fastest wall time and the import profile of a run"""
+        wall = min(self._run(argv)[0]
+                   for _ in range(max(options['repeats'], 1)))
+        _, process = self._run(argv, '-X', 'importtime')
+        modules = parse_importtime(process.stderr)
+        imported = set()
+        for line in process.stderr.splitlines():
+            if line.startswith('Loaded modules:'):
+                imported.update(line.split()[2:])
+        stats = summarize_imports(modules, options['top'])
+        stats['modules'] = len(imported)
+        stats['wall_s'] = round(wall, 6)
+        stats['deferred'] = [
+            name for name in DEFERRED_MODULES if name in imported]
+        stats['last_line'] = ''.join(
+            process.stdout.strip().splitlines()[-1:])
+        return stats
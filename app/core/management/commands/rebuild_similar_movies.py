@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core.models import SimilarMovie
+
+
+class Command(BaseCommand):
+    """Django command to recompute the similar movies of every movie
+
+    Each user's catalog is recomputed in batches of movies, which bounds
+    the memory of the scoring query.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users',
+                            help='Email of a user to rebuild, repeatable')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(movie__isnull=False)
+        if options['users']:
+            users = users.filter(email__in=options['users'])
+        movies = 0
+        for user_id in users.distinct().order_by('id').values_list(
+                'id', flat=True):
+            movies += SimilarMovie.objects.rebuild(user_id,
+                                                   options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the similar movies of {movies} movies'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from core.models import Tag, Cast
+
+
+class Command(BaseCommand):
+    """Django command to repair the usage counts of tags and casts"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Tag, Cast):
+            last = model.objects.aggregate(last=Max('id'))['last'] or 0
+            fixed = 0
+            for start in range(1, last + 1, batch_size):
+                with transaction.atomic():
+                    fixed += model.objects.recount_usage(
+                        start, start + batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                f'Corrected {fixed} {model._meta.verbose_name_plural}'))
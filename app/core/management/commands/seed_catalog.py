@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.benchmark import seed_catalog, bench_users
+
+
+class Command(BaseCommand):
+    """Django command to seed a reproducible catalog for benchmarks"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--movies', type=int, default=100,
+                            help='Movies per user')
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Tags per user')
+        parser.add_argument('--casts', type=int, default=10,
+                            help='Casts per user')
+        parser.add_argument('--tags-per-movie', type=int, default=3)
+        parser.add_argument('--casts-per-movie', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete a previously seeded catalog first')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['clear']:
+                bench_users().delete()
+            before = bench_users().count()
+            users = seed_catalog(
+                users=options['users'],
+                movies=options['movies'],
+                tags=options['tags'],
+                casts=options['casts'],
+                tags_per_movie=options['tags_per_movie'],
+                casts_per_movie=options['casts_per_movie'],
+                seed=options['seed'],
+            )
+            seeded = bench_users().count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {seeded} users with {options["movies"]} movies each, '
+            f'kept {len(users) - seeded} seeded before'
+        ))
@@ -0,0 +1,67 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.server import Arbiter, bind, load_application, warm_up
+
+
+class Command(BaseCommand):
+    """Django command to serve the API from pre-forked worker processes
+
+    The application is loaded once in the master and shared with the
+    workers copy-on-write. Send SIGHUP to reload the code gracefully and
+    SIGTERM to stop.
+    """
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='127.0.0.1:8000',
+                            help='host:port to listen on')
+        parser.add_argument('--workers', type=int,
+                            default=os.cpu_count() or 1)
+        parser.add_argument('--worker-class', choices=('sync', 'asgi'),
+                            default='sync',
+                            help='asgi workers need uvicorn installed')
+        parser.add_argument('--max-requests', type=int, default=0,
+                            help='Recycle a worker after this many requests')
+        parser.add_argument('--max-requests-jitter', type=int, default=0,
+                            help='Random extra requests before recycling')
+        parser.add_argument('--max-rss', type=int, default=0,
+                            help='Recycle a worker above this many MiB RSS')
+        parser.add_argument('--graceful-timeout', type=int, default=30)
+        parser.add_argument('--backlog', type=int, default=2048)
+        parser.add_argument('--no-preload', action='store_false',
+                            dest='preload',
+                            help='Load the application in each worker')
+
+    def handle(self, *args, **options):
+        if options['worker_class'] == 'asgi':
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('ASGI workers need uvicorn installed')
+        if options['workers'] < 1:
+            raise CommandError('At least one worker is needed')
+        application = None
+        if options['preload']:
+            application = load_application(options['worker_class'])
+            warm_up()
+        sock = bind(options['bind'], options['backlog'])
+        host, port = sock.getsockname()[:2]
+        self.stdout.write(f'Listening at http://{host}:{port} '
+                          f'({os.getpid()})')
+        self.stdout.flush()
+        Arbiter(
+            sock, application,
+            worker_class=options['worker_class'],
+            workers=options['workers'],
+            max_requests=options['max_requests'],
+            max_requests_jitter=options['max_requests_jitter'],
+            max_rss=options['max_rss'] * 1024 * 1024,
+            graceful_timeout=options['graceful_timeout'],
+            log=self.log
+        ).run()
+
+    def log(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
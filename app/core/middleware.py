@@ -0,0 +1,136 @@
+import math
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from rest_framework.permissions import SAFE_METHODS
+
+from core import db_router, concurrency
+
+
+def view_action(request, view_func):
+    """Returns the viewset action or lower case method a view serves"""
+    method = 'get' if request.method == 'HEAD' else request.method.lower()
+    return (getattr(view_func, 'actions', None) or {}).get(method, method)
+
+
+def view_attr(view_func, name):
+    """Returns an attribute of the class of a view, if any"""
+    return getattr(getattr(view_func, 'cls', None) or
+                   getattr(view_func, 'view_class', None), name, ())
+
+
+class ReplicaRoutingMiddleware:
+    """Sends the reads of opted-in safe requests to the read replicas
+
+    Views opt in by listing the viewset actions or lower case methods they
+    serve from replicas in replica_actions. A user who wrote is pinned to
+    the primary for REPLICA_PIN_SECONDS, to read their own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.use_primary()
+        # The view leaves the user it authenticated on the request
+        user = getattr(request, 'user', None)
+        if request.method not in SAFE_METHODS and \
+                response.status_code < 400 and \
+                user is not None and user.is_authenticated:
+            db_router.pin_primary(user)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS:
+            return None
+        if view_action(request, view_func) in \
+                view_attr(view_func, 'replica_actions') and \
+                not db_router.is_pinned(request):
+            db_router.use_replica()
+        return None
+
+
+class LoadSheddingMiddleware:
+    """Sheds requests beyond an adaptive concurrency limit with a 503
+
+    Requests are admitted while the requests in flight are below their
+    priority's share of the limit, and their queueing delay below the same
+    share of LOAD_SHED_MAX_QUEUE_SECONDS. The delay is taken from
+    X-Request-Start when LOAD_SHED_TRUST_REQUEST_START says a proxy sets
+    it, else from the estimate serve's sync workers make from the backlog
+    of the listening socket. A sync
+    worker serves one request at a time, so its limit never sheds and only
+    the queueing delay does; the limit applies to asgi workers. Views list
+    cheap actions or lower case methods in high_priority_actions and
+    expensive ones in low_priority_actions, so the expensive ones are shed
+    first.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiter = concurrency.limiter = concurrency.ConcurrencyLimiter(
+            settings.LOAD_SHED_INITIAL_LIMIT, settings.LOAD_SHED_MIN_LIMIT,
+            settings.LOAD_SHED_MAX_LIMIT,
+            settings.LOAD_SHED_TARGET_LATENCY_SECONDS
+        )
+
+    def __call__(self, request):
+        now = time.time()
+        request._shed_start = now - self.queue_delay(request, now)
+        request._shed_acquired = False
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release(request)
+            raise
+        if response.streaming:
+            # The content is produced while the server sends it, so the
+            # request stays in flight until the response is closed
+            response._resource_closers.append(
+                lambda: self.release(request))
+        else:
+            self.release(request)
+        return response
+
+    def queue_delay(self, request, now):
+        """Returns how long a request waited before reaching the process"""
+        start = None
+        if settings.LOAD_SHED_TRUST_REQUEST_START:
+            start = concurrency.request_start(request.META)
+        if start is None:
+            return request.META.get(concurrency.QUEUE_DELAY_ENV, 0)
+        # Clocks of the proxy and the server may disagree slightly
+        return max(now - start, 0)
+
+    def release(self, request):
+        """Counts an admitted request out of the limiter once"""
+        if request._shed_acquired:
+            request._shed_acquired = False
+            self.limiter.release(time.time() - request._shed_start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        action = view_action(request, view_func)
+        if action in view_attr(view_func, 'high_priority_actions'):
+            priority = concurrency.PRIORITY_HIGH
+        elif action in view_attr(view_func, 'low_priority_actions'):
+            priority = concurrency.PRIORITY_LOW
+        else:
+            priority = concurrency.PRIORITY_NORMAL
+        share = settings.LOAD_SHED_SHARES[priority]
+        queued = time.time() - request._shed_start
+        if queued <= settings.LOAD_SHED_MAX_QUEUE_SECONDS * share and \
+                self.limiter.acquire(share):
+            request._shed_acquired = True
+            return None
+        response = JsonResponse(
+            {'detail': 'The server is overloaded, retry later.'},
+            status=503
+        )
+        response['Retry-After'] = str(math.ceil(
+            settings.LOAD_SHED_RETRY_AFTER_SECONDS))
+        return response
@@ -0,0 +1,55 @@
+# Generated by Django 3.0.7 on 2026-10-19 04:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BACKFILL_SQL = '''
+INSERT INTO core_change (user_id, kind, object_id, action, created)
+SELECT user_id, %s, id, 'upsert', now() FROM {table} ORDER BY id
+'''
+
+
+def backfill_changes(apps, schema_editor):
+    """Records the existing catalogs so full syncs see every object"""
+    for kind, table in (('tag', 'core_tag'), ('cast', 'core_cast'),
+                        ('movie', 'core_movie')):
+        schema_editor.execute(BACKFILL_SQL.format(table=table), [kind])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_movie_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeHorizon',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('movie', 'Movie'), ('tag', 'Tag'), ('cast', 'Cast')], max_length=5)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=6)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'seq'], name='core_change_user_id_b07c4f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['user', 'kind', 'object_id'], name='core_change_user_id_72ab0d_idx'),
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
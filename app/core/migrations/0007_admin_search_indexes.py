@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+# Admin searches are prefix lookups, which Postgres runs as
+# UPPER(column::text) LIKE UPPER('term%'), so the indexes are built on
+# that expression with the pattern operator class.
+SEARCH_INDEXES = (
+    ('core_user_email_search', 'core_user', 'email'),
+    ('core_user_name_search', 'core_user', 'name'),
+    ('core_tag_name_search', 'core_tag', 'name'),
+    ('core_cast_name_search', 'core_cast', 'name'),
+    ('core_movie_title_search', 'core_movie', 'title'),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_change'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX {name} ON {table} '
+            f'((UPPER({column}::text)) text_pattern_ops)',
+            f'DROP INDEX {name}',
+        ) for name, table, column in SEARCH_INDEXES
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.7 on 2026-10-19 04:07
+
+from django.db import migrations, models
+
+
+RECOUNT_SQL = '''
+UPDATE core_{kind} SET usage_count = counts.usage_count
+FROM (SELECT {kind}_id, count(*) AS usage_count FROM core_movie_{kind}
+      GROUP BY {kind}_id) AS counts
+WHERE core_{kind}.id = counts.{kind}_id
+'''
+
+
+def count_usage(apps, schema_editor):
+    """Counts the movies of the existing tags and casts"""
+    for kind in ('tag', 'cast'):
+        schema_editor.execute(RECOUNT_SQL.format(kind=kind))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cast',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_usage, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cast',
+            index=models.Index(fields=['user', 'usage_count', 'name'], name='core_cast_user_id_f58b2b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'usage_count', 'name'], name='core_tag_user_id_337884_idx'),
+        ),
+    ]
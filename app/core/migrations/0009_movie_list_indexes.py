@@ -0,0 +1,35 @@
+# Generated by Django 3.0.7 on 2026-10-19 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_usage_count'),
+    ]
+
+    operations = [
+        # Title prefix filters are case insensitive, see the search indexes
+        migrations.RunSQL(
+            'CREATE INDEX core_movie_user_title_prefix ON core_movie '
+            '(user_id, (UPPER(title::text)) text_pattern_ops)',
+            'DROP INDEX core_movie_user_title_prefix',
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['user', 'id'], name='core_movie_user_id_d6ee04_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['user', 'title', 'id'], name='core_movie_user_id_f49da6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['user', 'price', 'id'], name='core_movie_user_id_778322_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['user', 'duration', 'id'], name='core_movie_user_id_9458f7_idx'),
+        ),
+    ]
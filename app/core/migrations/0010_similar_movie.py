@@ -0,0 +1,33 @@
+# Generated by Django 3.0.7 on 2026-10-19 04:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_movie_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarMovie',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('movie', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Movie')),
+                ('similar', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='similarmovie',
+            index=models.Index(fields=['movie', '-score', 'similar'], name='core_simila_movie_i_acf2bc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='similarmovie',
+            unique_together={('movie', 'similar')},
+        ),
+    ]
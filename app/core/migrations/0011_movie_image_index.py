@@ -0,0 +1,17 @@
+# Generated by Django 3.0.7 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_similar_movie'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['image'], name='core_movie_image_43adb5_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.7 on 2026-10-19 04:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_movie_image_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieDocument',
+            fields=[
+                ('movie', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='core.Movie')),
+                ('body', models.BinaryField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
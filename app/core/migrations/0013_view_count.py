@@ -0,0 +1,34 @@
+# Generated by Django 3.0.7 on 2026-10-19 05:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_movie_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('movie', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='viewcount',
+            index=models.Index(fields=['user', 'bucket'], name='core_viewco_user_id_d93924_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='viewcount',
+            unique_together={('movie', 'bucket')},
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.7 on 2026-10-19 05:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_primary_pin'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importcheckpoint',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterUniqueTogether(
+            name='importcheckpoint',
+            unique_together={('user', 'name')},
+        ),
+    ]
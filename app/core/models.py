@@ -1,17 +1,22 @@
 import uuid
+import datetime
 import os
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, connections, transaction
+from django.db.models.functions import Coalesce, Now
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager,\
                                         PermissionsMixin
 
 from django.conf import settings
 
 
+MOVIE_IMAGE_DIR = 'uploads/movie/'
+
+
 def movie_image_file_path(instance, filename):
     """Generate file path for movie image"""
     ext = filename.split('.')[-1]
     filename = f'{uuid.uuid4()}.{ext}'
-    return os.path.join('uploads/movie/', filename)
+    return os.path.join(MOVIE_IMAGE_DIR, filename)
 
 
 class UserManager(BaseUserManager):
@@ -46,6 +51,35 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+class MovieAttrManager(models.Manager):
+    """Manages tags and casts"""
+
+    def adjust_usage(self, deltas):
+        """Adds the given delta to the usage count of each object id"""
+        by_delta = {}
+        for pk, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(pk)
+        for delta, pks in by_delta.items():
+            self.filter(pk__in=pks).update(
+                usage_count=models.F('usage_count') + delta)
+
+    def recount_usage(self, start=None, stop=None):
+        """Corrects usage counts in an id range, returns the number fixed"""
+        field = f'{self.model._meta.model_name}_id'
+        through = getattr(Movie, self.model._meta.model_name).through
+        count = through.objects.filter(
+            **{field: models.OuterRef('pk')}
+        ).values(field).annotate(count=models.Count('*')).values('count')
+        count = Coalesce(models.Subquery(count), 0)
+        queryset = self.exclude(usage_count=count)
+        if start is not None:
+            queryset = queryset.filter(pk__gte=start)
+        if stop is not None:
+            queryset = queryset.filter(pk__lt=stop)
+        return queryset.update(usage_count=count)
+
+
 class Tag(models.Model):
     """Tag model"""
     name = models.CharField(max_length=255)
@@ -53,10 +87,22 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    usage_count = models.PositiveIntegerField(default=0)
+
+    objects = MovieAttrManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'usage_count', 'name'])]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # A rename renders the documents of the movies again in the same
+        # transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class Cast(models.Model):
     """Model for Cast"""
@@ -65,10 +111,88 @@ class Cast(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    usage_count = models.PositiveIntegerField(default=0)
+
+    objects = MovieAttrManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'usage_count', 'name'])]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # A rename renders the documents of the movies again in the same
+        # transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+ADD_MEMBERS_SQL = '''
+INSERT INTO {table} (movie_id, {column})
+SELECT movie_id, member_id
+FROM unnest(%s::integer[]) AS movie_id, unnest(%s::integer[]) AS member_id
+ORDER BY movie_id, member_id
+ON CONFLICT (movie_id, {column}) DO NOTHING
+RETURNING movie_id, {column}
+'''
+
+REMOVE_MEMBERS_SQL = '''
+DELETE FROM {table}
+WHERE movie_id = ANY(%s) AND {column} = ANY(%s)
+RETURNING movie_id, {column}
+'''
+
+
+class MovieManager(models.Manager):
+    """Manages movies"""
+
+    def add_members(self, user_id, field, movie_ids, member_ids):
+        """Adds tags or casts to movies, returns the pairs added
+
+        Pairs which already exist are skipped by the unique constraint of
+        the through table, so concurrent adds need no lock on the movies.
+        """
+        return self._change_members(ADD_MEMBERS_SQL, 1, user_id, field,
+                                    movie_ids, member_ids)
+
+    def remove_members(self, user_id, field, movie_ids, member_ids):
+        """Removes tags or casts from movies, returns the pairs removed"""
+        return self._change_members(REMOVE_MEMBERS_SQL, -1, user_id, field,
+                                    movie_ids, member_ids)
+
+    def _change_members(self, sql, delta, user_id, field, movie_ids,
+                        member_ids):
+        through = getattr(self.model, field).through
+        member_model = getattr(self.model, field).field.related_model
+        movie_ids = sorted(set(movie_ids))
+        member_ids = sorted(set(member_ids))
+        if not movie_ids or not member_ids:
+            return []
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(sql.format(
+                    table=through._meta.db_table, column=f'{field}_id'
+                ), [movie_ids, member_ids])
+                pairs = cursor.fetchall()
+            usage = {}
+            for _, member_id in pairs:
+                usage[member_id] = usage.get(member_id, 0) + delta
+            member_model.objects.adjust_usage(usage)
+            Change.objects.record(
+                user_id, Change.KIND_MOVIE,
+                sorted({movie_id for movie_id, _ in pairs}),
+                Change.ACTION_UPSERT
+            )
+            SimilarMovie.objects.update_members(
+                user_id, field, {movie_id for movie_id, _ in pairs},
+                {member_id for _, member_id in pairs}
+            )
+            if settings.MOVIE_DOCUMENTS:
+                MovieDocument.objects.refresh(
+                    movie_id for movie_id, _ in pairs)
+        return pairs
+
 
 class Movie(models.Model):
     """Movie Model"""
@@ -84,5 +208,457 @@ class Movie(models.Model):
     tag = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=movie_image_file_path)
 
+    objects = MovieManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'title', 'id']),
+            models.Index(fields=['user', 'price', 'id']),
+            models.Index(fields=['user', 'duration', 'id']),
+            models.Index(fields=['image']),
+        ]
+
     def __str__(self):
         return self.title
+
+
+class ChangeManager(models.Manager):
+    """Manages the change feed of the users"""
+    LOCK_NAMESPACE = 1
+
+    def lock(self, user_id):
+        """Waits for the transactions changing a user's objects to end"""
+        with connections[self.db].cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)',
+                           [self.LOCK_NAMESPACE, user_id])
+
+    def record(self, user_id, kind, object_ids, action):
+        """Appends changes of the user's objects to the feed
+
+        Changes of a user are serialized with an advisory lock so their
+        sequence numbers become visible in commit order.
+        """
+        object_ids = list(object_ids)
+        if not object_ids:
+            return
+        with transaction.atomic(using=self.db):
+            self.lock(user_id)
+            self.bulk_create([
+                self.model(user_id=user_id, kind=kind, object_id=object_id,
+                           action=action)
+                for object_id in object_ids
+            ])
+
+
+class Change(models.Model):
+    """Change of a movie, tag or cast in a user's catalog"""
+    KIND_MOVIE = 'movie'
+    KIND_TAG = 'tag'
+    KIND_CAST = 'cast'
+    KIND_CHOICES = (
+        (KIND_MOVIE, 'Movie'),
+        (KIND_TAG, 'Tag'),
+        (KIND_CAST, 'Cast'),
+    )
+    ACTION_UPSERT = 'upsert'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = (
+        (ACTION_UPSERT, 'Upsert'),
+        (ACTION_DELETE, 'Delete'),
+    )
+    seq = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False
+    )
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = ChangeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'seq']),
+            models.Index(fields=['user', 'kind', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f'{self.seq} {self.action} {self.kind} {self.object_id}'
+
+
+class ChangeHorizon(models.Model):
+    """Oldest sequence a user's clients can still sync incrementally from"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    seq = models.BigIntegerField(default=0)
+
+
+PIN_PRIMARY_SQL = '''
+INSERT INTO core_primarypin (user_id, until)
+VALUES (%s, now() + %s * interval '1 second')
+ON CONFLICT (user_id) DO UPDATE SET until = EXCLUDED.until
+'''
+
+
+class PrimaryPinManager(models.Manager):
+    """Pins the reads of users who wrote to the primary"""
+
+    def pin(self, user_id, seconds):
+        """Keeps a user's reads on the primary for seconds from now"""
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(PIN_PRIMARY_SQL, [user_id, seconds])
+
+    def active(self):
+        """Returns the pins not expired yet, read from the primary"""
+        return self.using(DEFAULT_DB_ALIAS).filter(until__gt=Now())
+
+
+class PrimaryPin(models.Model):
+    """Time until which a user's reads stay on the primary after a write"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    until = models.DateTimeField()
+
+    objects = PrimaryPinManager()
+
+
+class ImportCheckpoint(models.Model):
+    """Progress of an import, committed together with its batches"""
+    name = models.CharField(max_length=255)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    records = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'name')
+
+    def __str__(self):
+        return f'{self.name} after record {self.records}'
+
+
+# Pairs of movies sharing a tag or cast, for the movies in %(movies)s.
+# Tags and casts used by more than %(max_usage)s movies are skipped, which
+# bounds the pairs of a movie.
+SHARED_MEMBERS_SQL = '''
+SELECT a.movie_id, b.movie_id AS similar_id
+FROM core_movie_{kind} a
+JOIN core_{kind} m ON m.id = a.{kind}_id AND m.usage_count <= %(max_usage)s
+JOIN core_movie_{kind} b ON b.{kind}_id = a.{kind}_id
+    AND b.movie_id <> a.movie_id {similar_filter}
+WHERE a.movie_id = ANY(%(movies)s)
+'''
+
+SIMILAR_SCORES_SQL = '''
+SELECT movie_id, similar_id, count(*) AS score
+FROM ({tag} UNION ALL {cast}) shared
+GROUP BY movie_id, similar_id
+'''
+
+REFRESH_SIMILAR_SQL = '''
+INSERT INTO core_similarmovie (user_id, movie_id, similar_id, score)
+SELECT %(user)s, movie_id, similar_id, score FROM (
+    SELECT *, row_number() OVER (
+        PARTITION BY movie_id ORDER BY score DESC, similar_id
+    ) AS rank
+    FROM ({scores}) scores
+) ranked
+WHERE rank <= %(top_k)s
+'''
+
+# Scores are symmetric, the scores of the changed movies are stored in
+# the lists of their neighbours
+UPDATE_NEIGHBOURS_SQL = '''
+INSERT INTO core_similarmovie (user_id, movie_id, similar_id, score)
+SELECT %(user)s, similar_id, movie_id, score FROM ({scores}) scores
+ON CONFLICT (movie_id, similar_id) DO UPDATE SET score = EXCLUDED.score
+'''
+
+TRIM_SIMILAR_SQL = '''
+DELETE FROM core_similarmovie WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY movie_id ORDER BY score DESC, similar_id
+        ) AS rank
+        FROM core_similarmovie WHERE movie_id = ANY(%(neighbours)s)
+    ) ranked
+    WHERE rank > %(top_k)s
+)
+'''
+
+NEIGHBOURS_SQL = '''
+SELECT DISTINCT a.movie_id
+FROM core_movie_{kind} a
+JOIN core_{kind} m ON m.id = a.{kind}_id AND m.usage_count <= %(max_usage)s
+WHERE a.{kind}_id = ANY(%(members)s) AND NOT a.movie_id = ANY(%(movies)s)
+'''
+
+
+def _similar_scores(similar_filter=''):
+    """Returns the query scoring the movies sharing tags and casts"""
+    return SIMILAR_SCORES_SQL.format(**{
+        kind: SHARED_MEMBERS_SQL.format(kind=kind,
+                                        similar_filter=similar_filter)
+        for kind in ('tag', 'cast')
+    })
+
+
+class SimilarMovieManager(models.Manager):
+    """Maintains the most similar movies of each movie
+
+    Movies are as similar as the number of tags and casts they share. The
+    top SIMILAR_MOVIES_TOP_K of each movie are stored, so reads are a
+    single index range scan.
+    """
+
+    def _params(self, user_id, movie_ids, **params):
+        return dict(params, user=user_id, movies=sorted(set(movie_ids)),
+                    top_k=settings.SIMILAR_MOVIES_TOP_K,
+                    max_usage=settings.SIMILAR_MOVIES_MAX_USAGE)
+
+    def refresh(self, user_id, movie_ids):
+        """Recomputes the similar movies of movies"""
+        params = self._params(user_id, movie_ids)
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute('DELETE FROM core_similarmovie '
+                               'WHERE movie_id = ANY(%(movies)s)', params)
+                cursor.execute(REFRESH_SIMILAR_SQL.format(
+                    scores=_similar_scores()), params)
+
+    def update_members(self, user_id, field, movie_ids, member_ids):
+        """Updates the similar movies after tags or casts of movies changed
+
+        The changed movies are recomputed. Movies sharing the changed tags
+        or casts get their scores with the changed movies updated in their
+        lists, which may leave them short of a candidate until rebuilt.
+        """
+        if not movie_ids or not member_ids:
+            return
+        params = self._params(user_id, movie_ids,
+                              members=sorted(set(member_ids)))
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(NEIGHBOURS_SQL.format(kind=field), params)
+                params['neighbours'] = [row[0] for row in cursor.fetchall()]
+                cursor.execute(
+                    'DELETE FROM core_similarmovie '
+                    'WHERE movie_id = ANY(%(neighbours)s) '
+                    'AND similar_id = ANY(%(movies)s)', params)
+                cursor.execute(UPDATE_NEIGHBOURS_SQL.format(
+                    scores=_similar_scores(
+                        'AND b.movie_id = ANY(%(neighbours)s)')
+                ), params)
+                cursor.execute(TRIM_SIMILAR_SQL, params)
+            self.refresh(user_id, movie_ids)
+
+    def rebuild(self, user_id, batch_size=1000):
+        """Recomputes the similar movies of a user's catalog in batches"""
+        movie_ids = list(Movie.objects.filter(user_id=user_id).order_by(
+            'id').values_list('id', flat=True))
+        self.filter(user_id=user_id).exclude(
+            movie_id__in=movie_ids).delete()
+        for start in range(0, len(movie_ids), batch_size):
+            self.refresh(user_id, movie_ids[start:start + batch_size])
+        return len(movie_ids)
+
+
+class SimilarMovie(models.Model):
+    """Movie among the most similar ones of another movie"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    # Movies may live in a partitioned table, which cannot be referenced
+    movie = models.ForeignKey(
+        Movie,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        db_index=False,
+        related_name='+'
+    )
+    similar = models.ForeignKey(
+        Movie,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='+'
+    )
+    score = models.PositiveIntegerField()
+
+    objects = SimilarMovieManager()
+
+    class Meta:
+        unique_together = ('movie', 'similar')
+        indexes = [
+            models.Index(fields=['movie', '-score', 'similar']),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_id} ~ {self.similar_id} ({self.score})'
+
+
+class MovieDocumentManager(models.Manager):
+    """Maintains the rendered detail JSON of movies"""
+
+    def render(self, movies):
+        """Returns the encoded documents of movies with tags and casts"""
+        # Imported here as the serializers of the API depend on the models
+        from rest_framework.renderers import JSONRenderer
+        from movie.serializers import MovieDocumentSerializer
+        renderer = JSONRenderer()
+        return [renderer.render(data) for data in
+                MovieDocumentSerializer(movies, many=True).data]
+
+    def refresh(self, movie_ids, batch_size=1000):
+        """Re-renders the documents of movies, dropping those of gone ones
+
+        Renders take the change feed's lock of the movies' users, which
+        the changes of the movies hold until they commit, so a concurrent
+        change is either seen by the render or renders again after it.
+        The movie rows themselves are not locked.
+        """
+        movie_ids = sorted(set(movie_ids))
+        with transaction.atomic(using=self.db):
+            for user_id in Movie.objects.filter(id__in=movie_ids).order_by(
+                    'user_id').values_list('user_id', flat=True).distinct():
+                Change.objects.lock(user_id)
+            for start in range(0, len(movie_ids), batch_size):
+                batch = movie_ids[start:start + batch_size]
+                movies = list(Movie.objects.filter(id__in=batch).order_by(
+                    'id').prefetch_related('tag', 'cast'))
+                self.filter(movie_id__in=batch).delete()
+                self.bulk_create([
+                    self.model(movie_id=movie.id, user_id=movie.user_id,
+                               body=body)
+                    for movie, body in zip(movies, self.render(movies))
+                ])
+
+
+class MovieDocument(models.Model):
+    """Detail JSON of a movie, rendered whenever the movie changes"""
+    movie = models.OneToOneField(
+        Movie,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        db_constraint=False,
+        related_name='+'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    body = models.BinaryField()
+
+    objects = MovieDocumentManager()
+
+    def __str__(self):
+        return f'{self.movie_id}'
+
+
+# Counts of movies which were deleted in the meantime are dropped
+UPSERT_VIEW_COUNTS_SQL = '''
+INSERT INTO core_viewcount (user_id, movie_id, bucket, views, plays)
+SELECT m.user_id, c.movie_id, c.bucket, c.views, c.plays
+FROM unnest(%s::integer[], %s::timestamptz[], %s::integer[],
+            %s::integer[]) AS c (movie_id, bucket, views, plays)
+JOIN core_movie m ON m.id = c.movie_id
+ORDER BY c.movie_id, c.bucket
+ON CONFLICT (movie_id, bucket) DO UPDATE SET
+    views = core_viewcount.views + EXCLUDED.views,
+    plays = core_viewcount.plays + EXCLUDED.plays
+'''
+
+TRENDING_SQL = '''
+SELECT movie_id, sum(
+    (views + %s * plays) * power(0.5, EXTRACT(EPOCH FROM %s - bucket) / %s)
+)::float8 AS score
+FROM core_viewcount
+WHERE user_id = %s AND bucket > %s{movies}
+GROUP BY movie_id
+ORDER BY score DESC, movie_id
+LIMIT %s
+'''
+
+
+class ViewCountManager(models.Manager):
+    """Writes back and ranks the hourly views and plays of movies"""
+
+    def add(self, counts):
+        """Adds {(movie_id, bucket): [views, plays]} counts in one upsert"""
+        keys = sorted(counts)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(UPSERT_VIEW_COUNTS_SQL, [
+                [movie_id for movie_id, _ in keys],
+                [bucket for _, bucket in keys],
+                [counts[key][0] for key in keys],
+                [counts[key][1] for key in keys],
+            ])
+
+    def trending(self, user_id, limit, now, movies=None):
+        """Returns the (movie_id, score) of a user's most popular movies
+
+        Each hour's views and plays lose half their weight every
+        TRENDING_HALF_LIFE_HOURS, over the last TRENDING_WINDOW_HOURS.
+        Only the movies of the movies queryset are ranked when given, so
+        the limit applies to the filtered movies.
+        """
+        window = datetime.timedelta(hours=settings.TRENDING_WINDOW_HOURS)
+        condition, movie_params = '', ()
+        if movies is not None:
+            sql, movie_params = movies.order_by().values('id').query \
+                .get_compiler(self.db).as_sql()
+            condition = f' AND movie_id IN ({sql})'
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(TRENDING_SQL.format(movies=condition), [
+                settings.TRENDING_PLAY_WEIGHT, now,
+                settings.TRENDING_HALF_LIFE_HOURS * 3600,
+                user_id, now - window, *movie_params, limit,
+            ])
+            return cursor.fetchall()
+
+
+class ViewCount(models.Model):
+    """Views and plays of a movie within an hour"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    movie = models.ForeignKey(
+        Movie,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        db_index=False,
+        related_name='+'
+    )
+    bucket = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    plays = models.PositiveIntegerField(default=0)
+
+    objects = ViewCountManager()
+
+    class Meta:
+        unique_together = ('movie', 'bucket')
+        indexes = [models.Index(fields=['user', 'bucket'])]
+
+    @staticmethod
+    def bucket_of(when):
+        """Returns the start of the hour counting an event"""
+        return when.replace(minute=0, second=0, microsecond=0)
+
+    def __str__(self):
+        return f'{self.movie_id} at {self.bucket}: {self.views} views'
@@ -0,0 +1,373 @@
+import gc
+import os
+import sys
+import time
+import errno
+import random
+import select
+import signal
+import socket
+import struct
+import resource
+import importlib
+import threading
+import subprocess
+from importlib.util import find_spec
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+from core import counters, concurrency
+
+
+LISTEN_FD_ENV = 'SERVE_LISTEN_FD'
+OLD_WORKERS_ENV = 'SERVE_OLD_WORKERS'
+# Weight of the latest request in the average service time of a worker
+SERVICE_TIME_WEIGHT = 0.2
+
+
+def rss_bytes(pid='self'):
+    """Returns the resident set size of a process"""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_application(worker_class):
+    """Returns the WSGI or ASGI application of the project"""
+    if worker_class == 'asgi':
+        from django.core.asgi import get_asgi_application
+        return get_asgi_application()
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    if settings.DEBUG and apps.is_installed('django.contrib.staticfiles'):
+        from django.contrib.staticfiles.handlers import StaticFilesHandler
+        application = StaticFilesHandler(application)
+    return application
+
+
+def warm_up():
+    """Imports the URL conf, views and serializers of every app
+
+    Everything loaded before the workers are forked is shared with them
+    copy-on-write, and frozen out of the collector so a collection in a
+    worker does not touch and copy those pages.
+    """
+    get_resolver().url_patterns
+    for app_config in apps.get_app_configs():
+        module = f'{app_config.name}.serializers'
+        if find_spec(module) is not None:
+            importlib.import_module(module)
+    connections.close_all()
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def bind(address, backlog):
+    """Returns the listening socket, reusing one inherited on reload"""
+    if os.environ.get(LISTEN_FD_ENV):
+        sock = socket.socket(fileno=int(os.environ.pop(LISTEN_FD_ENV)))
+    else:
+        host, port = address.rsplit(':', 1)
+        sock = socket.socket(
+            socket.AF_INET6 if ':' in host else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host.strip('[]'), int(port)))
+        sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def listen_backlog(sock):
+    """Returns the connections waiting to be accepted on a socket
+
+    Linux reports them in the unacked field of the TCP_INFO of a listening
+    socket. Returns None where it is not available.
+    """
+    if not hasattr(socket, 'TCP_INFO'):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+    except OSError:
+        return None
+    fields = struct.unpack_from('=8B6I', info)
+    # The state is TCP_LISTEN, else the field counts unacknowledged data
+    if fields[0] != 10:
+        return None
+    return fields[12]
+
+
+class WorkerServer(WSGIServer):
+    """WSGI server of a worker, accepting from the shared socket"""
+    timeout = 1.0
+
+    def __init__(self, sock, application, workers=1):
+        super().__init__(sock.getsockname()[:2], QuietHandler,
+                         bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name = socket.getfqdn(self.server_address[0])
+        self.server_port = self.server_address[1]
+        self.setup_environ()
+        self.set_app(application)
+        self.workers = workers
+        self.handled = 0
+        self.backlog = None
+        self.service_time = 0.0
+
+    def get_request(self):
+        request = super().get_request()
+        self.backlog = listen_backlog(self.socket)
+        return request
+
+    def finish_request(self, request, client_address):
+        started = time.monotonic()
+        super().finish_request(request, client_address)
+        weight = SERVICE_TIME_WEIGHT if self.handled else 1
+        self.service_time += \
+            (time.monotonic() - started - self.service_time) * weight
+        self.handled += 1
+
+    def queue_delay(self):
+        """Estimates how long the connections left to accept will wait
+
+        Every worker takes one connection from the shared socket per
+        request, so the backlog drains in its length times the service
+        time, divided among the workers.
+        """
+        if not self.backlog:
+            return 0.0
+        return self.backlog * self.service_time / self.workers
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Request handler which leaves access logging to the proxy"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_environ(self):
+        env = super().get_environ()
+        env[concurrency.QUEUE_DELAY_ENV] = self.server.queue_delay()
+        return env
+
+
+class Worker:
+    """Serves requests from the shared socket until stopped or recycled"""
+
+    def __init__(self, sock, application, worker_class, max_requests,
+                 max_rss, workers=1):
+        self.sock = sock
+        self.application = application
+        self.worker_class = worker_class
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.workers = workers
+        self.alive = True
+
+    def install_signals(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    def run(self):
+        if self.application is None:
+            self.application = load_application(self.worker_class)
+        try:
+            if self.worker_class == 'asgi':
+                self.run_asgi()
+            else:
+                self.run_sync()
+        finally:
+            counters.write_back(force=True)
+
+    def stop(self, signum=None, frame=None):
+        self.alive = False
+
+    def exhausted(self, handled):
+        """Returns if the worker served its share and should be replaced"""
+        return bool(self.max_requests and handled >= self.max_requests) \
+            or bool(self.max_rss and rss_bytes() > self.max_rss)
+
+    def run_sync(self):
+        server = WorkerServer(self.sock, self.application, self.workers)
+        while self.alive and not self.exhausted(server.handled):
+            # Returns after the timeout when idle, so counts are written
+            # back while no request comes
+            server.handle_request()
+            counters.write_back()
+
+    def run_asgi(self):
+        import uvicorn
+        config = uvicorn.Config(
+            self.application, lifespan='off', access_log=False,
+            limit_max_requests=self.max_requests or None
+        )
+        server = uvicorn.Server(config)
+
+        def watch():
+            while not server.should_exit:
+                if not self.alive or self.exhausted(0):
+                    server.should_exit = True
+                counters.write_back()
+                time.sleep(1)
+
+        threading.Thread(target=watch, daemon=True).start()
+        server.run(sockets=[self.sock])
+
+
+class Arbiter:
+    """Master process keeping a pool of forked workers alive
+
+    SIGTERM and SIGINT stop the workers gracefully. SIGHUP re-executes
+    the master with the listening socket inherited, so new code is loaded
+    while the old workers finish their requests and no connection is
+    refused.
+    """
+    SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT,
+               signal.SIGCHLD)
+
+    def __init__(self, sock, application, worker_class='sync', workers=1,
+                 max_requests=0, max_requests_jitter=0, max_rss=0,
+                 graceful_timeout=30, log=print):
+        self.sock = sock
+        self.application = application
+        self.worker_class = worker_class
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_rss
+        self.graceful_timeout = graceful_timeout
+        self.log = log
+        self.children = {}
+        self.signals = []
+
+    def run(self):
+        self.wakeup, wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup, False)
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write)
+        for signum in self.SIGNALS:
+            signal.signal(signum, self.queue)
+        old = [int(pid) for pid in
+               os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+        self.spawn_workers()
+        self.kill(old, signal.SIGTERM)
+        while True:
+            select.select([self.wakeup], [], [], 1.0)
+            try:
+                os.read(self.wakeup, 1024)
+            except BlockingIOError:
+                pass
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return
+                if signum == signal.SIGHUP:
+                    self.reload()
+            self.reap()
+            self.spawn_workers()
+
+    def queue(self, signum, frame):
+        self.signals.append(signum)
+
+    def spawn_workers(self):
+        while len(self.children) < self.workers:
+            max_requests = self.max_requests
+            if max_requests and self.max_requests_jitter:
+                max_requests += random.randint(0, self.max_requests_jitter)
+            # Signals stay blocked until the child replaced the handlers of
+            # the master, so a stop sent right after the fork is not lost
+            signal.pthread_sigmask(signal.SIG_BLOCK, self.SIGNALS)
+            try:
+                pid = os.fork()
+                if pid == 0:
+                    self.run_worker(max_requests)
+            finally:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+            self.children[pid] = time.monotonic()
+            self.log(f'Booted worker {pid}')
+
+    def run_worker(self, max_requests):
+        """Runs in the forked child and never returns"""
+        status = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            os.close(self.wakeup)
+            worker = Worker(self.sock, self.application, self.worker_class,
+                            max_requests, self.max_rss, self.workers)
+            worker.install_signals()
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self.SIGNALS)
+            worker.run()
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def reap(self):
+        """Collects exited workers, pausing if they crash right at boot"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            self.log(f'Worker {pid} exited with status {status}')
+            if status and time.monotonic() - started < 1:
+                time.sleep(1)
+
+    def kill(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError as exc:
+                if exc.errno != errno.ESRCH:
+                    raise
+
+    def stop(self):
+        """Lets the workers finish their requests, then kills stragglers"""
+        self.log('Shutting down')
+        self.kill(list(self.children), signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.kill(list(self.children), signal.SIGKILL)
+        self.reap()
+        self.sock.close()
+
+    def reload(self):
+        """Re-executes the master if the new code passes the checks"""
+        check = subprocess.run([sys.executable, sys.argv[0], 'check'],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+        if check.returncode:
+            self.log('Not reloading, the checks failed:\n' +
+                     check.stdout.decode(errors='replace'))
+            return
+        self.log('Reloading')
+        os.set_inheritable(self.sock.fileno(), True)
+        signal.set_wakeup_fd(-1)
+        env = dict(os.environ)
+        env[LISTEN_FD_ENV] = str(self.sock.fileno())
+        env[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in self.children)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
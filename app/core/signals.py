@@ -0,0 +1,232 @@
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete,\
+    pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Tag, Cast, Movie, Change, SimilarMovie, MovieDocument
+
+
+KINDS = {
+    Movie: Change.KIND_MOVIE,
+    Tag: Change.KIND_TAG,
+    Cast: Change.KIND_CAST,
+}
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Cast)
+def record_save(sender, instance, raw=False, **kwargs):
+    """Records a created or updated movie, tag or cast"""
+    if raw:
+        return
+    Change.objects.record(instance.user_id, KINDS[sender], [instance.pk],
+                          Change.ACTION_UPSERT)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Cast)
+def record_delete(sender, instance, **kwargs):
+    """Records a deleted movie, tag or cast"""
+    Change.objects.record(instance.user_id, KINDS[sender], [instance.pk],
+                          Change.ACTION_DELETE)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Cast)
+def record_detached_movies(sender, instance, **kwargs):
+    """Records the movies which lose a deleted tag or cast"""
+    Change.objects.record(
+        instance.user_id, Change.KIND_MOVIE,
+        instance.movie_set.values_list('id', flat=True),
+        Change.ACTION_UPSERT
+    )
+
+
+@receiver(m2m_changed, sender=Movie.tag.through)
+@receiver(m2m_changed, sender=Movie.cast.through)
+def record_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """Records the movies whose tags or casts changed"""
+    if reverse:
+        if action == 'pre_clear':
+            pk_set = set(instance.movie_set.values_list('id', flat=True))
+        elif action not in ('post_add', 'post_remove'):
+            return
+        movie_ids = pk_set
+    else:
+        if action not in ('post_add', 'post_remove', 'post_clear') or \
+                (action != 'post_clear' and not pk_set):
+            return
+        movie_ids = [instance.pk]
+    Change.objects.record(instance.user_id, Change.KIND_MOVIE, movie_ids,
+                          Change.ACTION_UPSERT)
+
+
+@receiver(m2m_changed, sender=Movie.tag.through)
+@receiver(m2m_changed, sender=Movie.cast.through)
+def count_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keeps the usage counts of tags and casts in step with movies"""
+    attr_model = Tag if sender is Movie.tag.through else Cast
+    field = f'{attr_model._meta.model_name}_id'
+    owner, member = (field, 'movie_id') if reverse else ('movie_id', field)
+    if action == 'post_add' and pk_set:
+        if reverse:
+            deltas = {instance.pk: len(pk_set)}
+        else:
+            deltas = {pk: 1 for pk in pk_set}
+    elif action in ('pre_remove', 'pre_clear'):
+        # Rows are counted before they go as the pk_set of a removal can
+        # hold ids which were never added
+        rows = sender.objects.filter(**{owner: instance.pk})
+        if action == 'pre_remove':
+            if not pk_set:
+                return
+            rows = rows.filter(**{f'{member}__in': pk_set})
+        if reverse:
+            deltas = {instance.pk: -rows.count()}
+        else:
+            deltas = {pk: -1 for pk in rows.values_list(field, flat=True)}
+    else:
+        return
+    attr_model.objects.adjust_usage(deltas)
+
+
+@receiver(m2m_changed, sender=Movie.tag.through)
+@receiver(m2m_changed, sender=Movie.cast.through)
+def update_similar(sender, instance, action, reverse, pk_set, **kwargs):
+    """Updates the similar movies of movies whose tags or casts changed"""
+    field = 'tag' if sender is Movie.tag.through else 'cast'
+    if action == 'pre_clear':
+        # The cleared rows are gone when post_clear is sent
+        related = instance.movie_set if reverse else getattr(instance, field)
+        instance._similar_cleared = set(
+            related.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_similar_cleared', None)
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+    movie_ids, member_ids = (pk_set, [instance.pk]) if reverse else \
+        ([instance.pk], pk_set)
+    SimilarMovie.objects.update_members(instance.user_id, field, movie_ids,
+                                        member_ids)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Cast)
+def detach_similar(sender, instance, **kwargs):
+    """Remembers the movies made similar by a deleted tag or cast
+
+    The through rows are deleted with the tag or cast without m2m_changed.
+    Tags and casts above SIMILAR_MOVIES_MAX_USAGE never counted.
+    """
+    if instance.usage_count <= settings.SIMILAR_MOVIES_MAX_USAGE:
+        instance._similar_detached = list(
+            instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Cast)
+def refresh_detached_similar(sender, instance, **kwargs):
+    """Recomputes the similar movies of the movies which lost a tag or cast
+
+    Only these movies shared the tag or cast, so the lists of the others
+    keep their scores.
+    """
+    movie_ids = instance.__dict__.pop('_similar_detached', None)
+    if movie_ids:
+        SimilarMovie.objects.refresh(instance.user_id, movie_ids)
+
+
+@receiver(pre_delete, sender=Movie)
+def release_usage(sender, instance, **kwargs):
+    """Decrements the usage counts of the tags and casts of a movie"""
+    for attr_model, through in ((Tag, Movie.tag.through),
+                                (Cast, Movie.cast.through)):
+        field = f'{attr_model._meta.model_name}_id'
+        attr_model.objects.adjust_usage({
+            pk: -1 for pk in through.objects.filter(
+                movie_id=instance.pk).values_list(field, flat=True)
+        })
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def delete_changes(sender, instance, **kwargs):
+    """Deletes the change feed of a deleted user
+
+    The feed is not cascaded with the user because the deletion of the
+    user's catalog records changes until the user itself is deleted.
+    """
+    Change.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Movie)
+def refresh_document(sender, instance, raw=False, **kwargs):
+    """Renders the document of a created or updated movie"""
+    if raw or not settings.MOVIE_DOCUMENTS:
+        return
+    MovieDocument.objects.refresh([instance.pk])
+
+
+@receiver(m2m_changed, sender=Movie.tag.through)
+@receiver(m2m_changed, sender=Movie.cast.through)
+def refresh_member_documents(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    """Renders the documents of movies whose tags or casts changed"""
+    if not settings.MOVIE_DOCUMENTS:
+        return
+    if action == 'pre_clear' and reverse:
+        instance._documents_cleared = set(
+            instance.movie_set.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        movie_ids = instance.__dict__.pop('_documents_cleared', None) \
+            if reverse else [instance.pk]
+    elif action in ('post_add', 'post_remove') and pk_set:
+        movie_ids = pk_set if reverse else [instance.pk]
+    else:
+        return
+    if movie_ids:
+        MovieDocument.objects.refresh(movie_ids)
+
+
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Cast)
+def detect_rename(sender, instance, raw=False, update_fields=None,
+                  **kwargs):
+    """Remembers if a saved tag or cast changes its name"""
+    if raw or not settings.MOVIE_DOCUMENTS or instance.pk is None or \
+            (update_fields is not None and 'name' not in update_fields):
+        return
+    instance._documents_renamed = sender.objects.filter(
+        pk=instance.pk).exclude(name=instance.name).exists()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Cast)
+def refresh_named_documents(sender, instance, **kwargs):
+    """Renders the documents of the movies of a renamed tag or cast"""
+    if instance.__dict__.pop('_documents_renamed', False):
+        MovieDocument.objects.refresh(
+            instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Cast)
+def detach_documents(sender, instance, **kwargs):
+    """Remembers the movies whose documents show a deleted tag or cast"""
+    if settings.MOVIE_DOCUMENTS:
+        instance._documents_detached = list(
+            instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Cast)
+def refresh_detached_documents(sender, instance, **kwargs):
+    """Renders the documents of the movies which lost a tag or cast"""
+    movie_ids = instance.__dict__.pop('_documents_detached', None)
+    if movie_ids:
+        MovieDocument.objects.refresh(movie_ids)
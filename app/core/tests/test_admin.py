@@ -1,7 +1,22 @@
+import datetime
+
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator
+from core.models import Tag, Cast, Movie
+
+
+def sample_movie(user, title='Heat'):
+    """Create and return a movie"""
+    return Movie.objects.create(
+        user=user, title=title, price=5.99,
+        duration=datetime.timedelta(hours=2, minutes=50)
+    )
+
 
 class AdminSiteTests(TestCase):
 
@@ -37,3 +52,65 @@ class AdminSiteTests(TestCase):
         url = reverse('admin:core_user_add')
         res = self.client.get(url)
         self.assertEqual(res.status_code, 200)
+
+    def test_user_search(self):
+        """Users can be searched by email prefix"""
+        other = get_user_model().objects.create_user(
+            email='other@test.com', password='password123')
+        url = reverse('admin:core_user_changelist')
+        res = self.client.get(url, {'q': 'test@'})
+        self.assertContains(res, self.user.email)
+        self.assertNotContains(res, other.email)
+
+    def test_movie_changelist_queries_bounded(self):
+        """Movie changelist queries do not grow with the rows shown"""
+        url = reverse('admin:core_movie_changelist')
+        sample_movie(self.user)
+        with CaptureQueriesContext(connection) as single:
+            self.client.get(url)
+        for i in range(5):
+            sample_movie(get_user_model().objects.create_user(
+                email=f'owner{i}@test.com', password='password123'))
+        with CaptureQueriesContext(connection) as many:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(single), len(many))
+
+    def test_movie_change_page_autocomplete(self):
+        """Movie change page only renders the selected relations"""
+        movie = sample_movie(self.user)
+        movie.tag.add(Tag.objects.create(user=self.user, name='Crime'))
+        Tag.objects.create(user=self.user, name='Unused')
+        Cast.objects.create(user=self.user, name='Al Pacino')
+        other = get_user_model().objects.create_user(
+            email='other@test.com', password='password123')
+        url = reverse('admin:core_movie_change', args=[movie.id])
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, 'Crime')
+        self.assertNotContains(res, 'Unused')
+        self.assertNotContains(res, 'Al Pacino')
+        self.assertNotContains(res, other.email)
+
+    def test_tag_autocomplete(self):
+        """Tags can be looked up by name prefix"""
+        Tag.objects.create(user=self.user, name='Crime')
+        Tag.objects.create(user=self.user, name='Drama')
+        url = reverse('admin:core_tag_autocomplete')
+        res = self.client.get(url, {'term': 'cri'})
+        self.assertEqual([r['text'] for r in res.json()['results']],
+                         ['Crime'])
+
+    def test_paginator_estimates_large_results(self):
+        """Large results are counted from the planner estimate"""
+        sample_movie(self.user)
+        paginator = EstimatedCountPaginator(
+            Movie.objects.order_by('id'), 100)
+        self.assertEqual(paginator.count, 1)
+        paginator = EstimatedCountPaginator(
+            Movie.objects.order_by('id'), 100)
+        paginator.exact_count_limit = 0
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsInstance(paginator.count, int)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('EXPLAIN'))
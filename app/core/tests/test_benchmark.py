@@ -0,0 +1,171 @@
+import io
+import os
+import json
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from core.benchmark import percentile, compare_results, seed_catalog,\
+    bench_users, parse_importtime, summarize_imports
+from core.models import Movie, Tag, Cast, SimilarMovie
+
+
+def sample_result(**params):
+    """Returns a sample scenario summary"""
+    defaults = {
+        'p50_ms': 10.0,
+        'p95_ms': 20.0,
+        'p99_ms': 30.0,
+        'throughput_rps': 100.0,
+        'queries_per_request': 3.0,
+        'requests': 100,
+        'errors': 0,
+    }
+    defaults.update(params)
+    return {'scenarios': {'movie-list': defaults}}
+
+
+class BenchmarkHelperTests(TestCase):
+    """Tests for the benchmark helpers"""
+
+    def test_percentile(self):
+        """Test percentiles are interpolated between samples"""
+        values = [4, 1, 3, 2]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 2.5)
+        self.assertEqual(percentile(values, 100), 4)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_compare_results_within_tolerance(self):
+        """Test results within the tolerance are not regressions"""
+        current = sample_result(p95_ms=23.0, throughput_rps=85.0)
+        self.assertEqual(compare_results(current, sample_result(), 0.2), [])
+
+    def test_compare_results_regressions(self):
+        """Test slower, lower throughput and chattier results regress"""
+        current = sample_result(p99_ms=50.0, throughput_rps=50.0,
+                                queries_per_request=4.0)
+        regressions = compare_results(current, sample_result(), 0.2)
+        self.assertEqual(len(regressions), 3)
+
+    def test_compare_results_errors_regress(self):
+        """Test failing requests regress even when they are faster"""
+        current = sample_result(p50_ms=1.0, p95_ms=2.0, p99_ms=3.0,
+                                throughput_rps=500.0, errors=40)
+        self.assertEqual(compare_results(current, sample_result(), 0.2),
+                         ['movie-list: errors 40 of 100 > 0 of 100'])
+
+    def test_parse_importtime(self):
+        """Test import times are parsed and summed per package"""
+        modules = parse_importtime(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       300 |        300 |   django.utils\n'
+            'import time:       200 |        500 | django\n'
+            'Waiting for database...\n'
+            'import time:      1000 |       1000 | PIL\n'
+        )
+        self.assertEqual(modules, [('django.utils', 0.0003, 0.0003),
+                                   ('django', 0.0002, 0.0005),
+                                   ('PIL', 0.001, 0.001)])
+        summary = summarize_imports(modules, top=1)
+        self.assertEqual(summary['import_s'], 0.0015)
+        self.assertEqual(summary['packages'], [['PIL', 0.001]])
+        self.assertEqual(summary['slowest'], [['PIL', 0.001]])
+
+    def test_seed_catalog_reproducible(self):
+        """Test seeding creates the requested dataset deterministically"""
+        users = seed_catalog(users=2, movies=5, tags=4, casts=3,
+                             tags_per_movie=2, casts_per_movie=1, seed=7)
+        self.assertEqual(len(users), 2)
+        self.assertEqual(Movie.objects.count(), 10)
+        self.assertEqual(Tag.objects.count(), 8)
+        self.assertEqual(Cast.objects.count(), 6)
+        self.assertEqual(Movie.tag.through.objects.count(), 20)
+        self.assertEqual(Movie.cast.through.objects.count(), 10)
+        seeded = list(SimilarMovie.objects.values_list(
+            'movie_id', 'similar_id', 'score'))
+        self.assertTrue(seeded)
+        call_command('rebuild_similar_movies', stdout=io.StringIO())
+        self.assertCountEqual(SimilarMovie.objects.values_list(
+            'movie_id', 'similar_id', 'score'), seeded)
+        first = list(Movie.objects.order_by('id').values_list(
+            'duration', 'price'))
+
+        bench_users().delete()
+        seed_catalog(users=2, movies=5, tags=4, casts=3,
+                     tags_per_movie=2, casts_per_movie=1, seed=7)
+        second = list(Movie.objects.order_by('id').values_list(
+            'duration', 'price'))
+        self.assertEqual(first, second)
+
+    def test_seed_catalog_again(self):
+        """Test seeding again keeps the users seeded before"""
+        first = seed_catalog(users=1, movies=2, tags=1, casts=1)
+        out = io.StringIO()
+        call_command('seed_catalog', users=2, movies=2, tags=1, casts=1,
+                     stdout=out)
+        self.assertEqual(bench_users().count(), 2)
+        self.assertEqual(bench_users().first(), first[0])
+        self.assertEqual(Movie.objects.count(), 4)
+        self.assertIn('Seeded 1 users with 2 movies each, kept 1',
+                      out.getvalue())
+
+
+class LoadTestCommandTests(TestCase):
+    """Tests for the loadtest command"""
+
+    def setUp(self):
+        seed_catalog(users=1, movies=5, tags=3, casts=3)
+        self.output = tempfile.NamedTemporaryFile(suffix='.json',
+                                                  delete=False).name
+
+    def tearDown(self):
+        os.remove(self.output)
+
+    def test_loadtest_writes_results(self):
+        """Test the loadtest records a summary per scenario"""
+        call_command('loadtest', requests=3, concurrency=1,
+                     scenario=['movie-list', 'movie-retrieve'],
+                     output=self.output, host='testserver',
+                     stdout=io.StringIO())
+        with open(self.output) as results_file:
+            results = json.load(results_file)
+        self.assertEqual(set(results['scenarios']),
+                         {'movie-list', 'movie-retrieve'})
+        summary = results['scenarios']['movie-list']
+        self.assertEqual(summary['requests'], 3)
+        self.assertEqual(summary['errors'], 0)
+        self.assertGreater(summary['queries_per_request'], 0)
+
+    def test_loadtest_flags_regressions(self):
+        """Test the loadtest fails when the baseline is beaten"""
+        baseline = sample_result(p50_ms=0.0, p95_ms=0.0, p99_ms=0.0)
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as base_file:
+            json.dump(baseline, base_file)
+            base_file.flush()
+            with self.assertRaises(CommandError):
+                call_command('loadtest', requests=2, concurrency=1,
+                             scenario=['movie-list'], output=self.output,
+                             baseline=base_file.name,
+                             host='testserver', stdout=io.StringIO())
+
+
+class SerializerBenchmarkCommandTests(TestCase):
+    """Tests for the bench_serializers command"""
+
+    def test_bench_serializers_reports_every_benchmark(self):
+        """Test each serializer is measured at every size"""
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('bench_serializers', sizes=[1, 2], warmup=0,
+                         repeats=2, min_time=0, output=output.name,
+                         stdout=io.StringIO())
+            results = json.load(open(output.name))
+        benchmarks = results['benchmarks']
+        self.assertIn('movie-validation[2]', benchmarks)
+        self.assertIn('user-representation[1]', benchmarks)
+        self.assertIn('movie-detail-render[2]', benchmarks)
+        self.assertGreater(benchmarks['tag-representation[2]']
+                           ['objects_per_sec'], 0)
+        self.assertFalse(Movie.objects.exists())
@@ -1,8 +1,24 @@
+import io
+import os
+import json
+import decimal
+import datetime
+import tempfile
+import time
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core.management.commands.import_movies import checkpoint_name
+from core.models import Tag, Cast, Movie, Change, SimilarMovie, \
+    MovieDocument, ImportCheckpoint
 
 
 class CommandTests(TestCase):
@@ -21,3 +37,335 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError]*5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class ImportMoviesCommandTests(TestCase):
+    """Tests for the import_movies command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@test.com', 'password123')
+        self.tag = Tag.objects.create(user=self.user, name='Drama')
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as source:
+            source.write(content)
+        return path
+
+    def test_import_jsonl(self):
+        """Test movies are imported with existing and new tags and casts"""
+        path = self.write_file('movies.jsonl', '\n'.join([
+            json.dumps({'title': 'Se7en', 'duration': '01:43:00',
+                        'price': '7.99', 'tags': ['Drama', 'Crime'],
+                        'casts': ['Brad Pitt']}),
+            json.dumps({'title': 'Heat', 'duration': 170, 'price': 5,
+                        'tags': ['Crime']}),
+        ]))
+        call_command('import_movies', path, user=self.user.email,
+                     workers=0, batch_size=1, stdout=io.StringIO())
+
+        self.assertEqual(Movie.objects.filter(user=self.user).count(), 2)
+        heat = Movie.objects.get(title='Heat')
+        self.assertEqual(heat.duration, datetime.timedelta(minutes=170))
+        self.assertEqual(heat.price, decimal.Decimal('5.000'))
+        se7en = Movie.objects.get(title='Se7en')
+        self.assertIn(self.tag, se7en.tag.all())
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(list(se7en.cast.values_list('name', flat=True)),
+                         ['Brad Pitt'])
+        self.assertEqual(dict(Tag.objects.values_list('name', 'usage_count')),
+                         {'Drama': 1, 'Crime': 2})
+        self.assertEqual(Cast.objects.get().usage_count, 1)
+
+    def test_import_updates_similar_movies(self):
+        """Test imported movies are similar to each other and old movies"""
+        heat = Movie.objects.create(user=self.user, title='Heat', price=5,
+                                    duration=datetime.timedelta(hours=2))
+        heat.tag.add(self.tag)
+        path = self.write_file('movies.jsonl', '\n'.join([
+            json.dumps({'title': 'Se7en', 'duration': 90, 'price': 1,
+                        'tags': ['Drama'], 'casts': ['Brad Pitt']}),
+            json.dumps({'title': 'Fight Club', 'duration': 90, 'price': 1,
+                        'tags': ['Drama'], 'casts': ['Brad Pitt']}),
+        ]))
+        call_command('import_movies', path, user=self.user.email,
+                     workers=0, stdout=io.StringIO())
+
+        se7en, fight_club = Movie.objects.exclude(id=heat.id).order_by('id')
+        self.assertEqual(sorted(SimilarMovie.objects.values_list(
+            'movie_id', 'similar_id', 'score')), [
+            (heat.id, se7en.id, 1), (heat.id, fight_club.id, 1),
+            (se7en.id, heat.id, 1), (se7en.id, fight_club.id, 2),
+            (fight_club.id, heat.id, 1), (fight_club.id, se7en.id, 2),
+        ])
+
+    def test_import_csv_reports_errors(self):
+        """Test invalid CSV rows are reported and valid rows imported"""
+        path = self.write_file('movies.csv', (
+            'title,duration,price,tag,cast\n'
+            'Up,01:36:00,3.5,Animation|Drama,Ed Asner\n'
+            ',01:00:00,1,,\n'
+            'Frozen,soon,1,,\n'
+        ))
+        errors = os.path.join(self.directory.name, 'errors.jsonl')
+        call_command('import_movies', path, user=self.user.email,
+                     workers=0, errors=errors, stdout=io.StringIO())
+
+        self.assertEqual(Movie.objects.get().title, 'Up')
+        with open(errors) as report:
+            rejected = [json.loads(line)['record'] for line in report]
+        self.assertEqual(rejected, [2, 3])
+
+    def test_import_resumes_from_checkpoint(self):
+        """Test an import skips records committed by an earlier run"""
+        path = self.write_file('movies.jsonl', '\n'.join(
+            json.dumps({'title': f'Movie {i}', 'duration': 90, 'price': 1})
+            for i in range(3)))
+        ImportCheckpoint.objects.create(name=path, user=self.user,
+                                        records=2, imported=2)
+        call_command('import_movies', path, user=self.user.email,
+                     workers=0, stdout=io.StringIO())
+
+        self.assertEqual(Movie.objects.get().title, 'Movie 2')
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.records, checkpoint.imported), (3, 3))
+
+    def test_checkpoints_of_each_user(self):
+        """Test users importing files of the same name resume their own"""
+        path = self.write_file('movies.jsonl', json.dumps(
+            {'title': 'Heat', 'duration': 90, 'price': 1}))
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        ImportCheckpoint.objects.create(name=path, user=other, records=5)
+        call_command('import_movies', path, user=self.user.email,
+                     workers=0, stdout=io.StringIO())
+
+        self.assertEqual(Movie.objects.get().user, self.user)
+        self.assertEqual(ImportCheckpoint.objects.get(user=other).records, 5)
+        self.assertEqual(
+            ImportCheckpoint.objects.get(user=self.user).records, 1)
+
+    def test_checkpoint_of_long_path(self):
+        """Test paths longer than a checkpoint name are hashed"""
+        long_path = '/' + 'd' * 300 + '/movies.jsonl'
+        name = checkpoint_name(long_path)
+        self.assertEqual(len(name), 255)
+        self.assertTrue(name.endswith('d/movies.jsonl'))
+        self.assertNotEqual(name, checkpoint_name('/e' + long_path))
+        self.assertEqual(checkpoint_name('movies.jsonl'),
+                         os.path.abspath('movies.jsonl'))
+        with self.assertRaises(CommandError):
+            call_command('import_movies', 'movies.jsonl',
+                         user=self.user.email, checkpoint='c' * 256)
+
+    def test_checkpoint_committed_with_batch(self):
+        """Test a failed batch is neither imported nor checkpointed"""
+        path = self.write_file('movies.jsonl', '\n'.join(
+            json.dumps({'title': f'Movie {i}', 'duration': 90, 'price': 1})
+            for i in range(3)))
+        record = Change.objects.record
+        calls = []
+
+        def fail_second_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise OperationalError('connection lost')
+            record(*args)
+
+        with patch.object(Change.objects, 'record', fail_second_batch):
+            with self.assertRaises(OperationalError):
+                call_command('import_movies', path, user=self.user.email,
+                             workers=0, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(ImportCheckpoint.objects.get(name=path).records, 1)
+
+        call_command('import_movies', path, user=self.user.email,
+                     workers=0, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(list(Movie.objects.order_by('id').values_list(
+            'title', flat=True)), ['Movie 0', 'Movie 1', 'Movie 2'])
+
+    def test_import_parallel_parse(self):
+        """Test records parsed in worker processes keep file order"""
+        path = self.write_file('movies.jsonl', '\n'.join(
+            json.dumps({'title': f'Movie {i}', 'duration': 90, 'price': 1})
+            for i in range(20)))
+        call_command('import_movies', path, user=self.user.email,
+                     workers=2, batch_size=3, stdout=io.StringIO())
+
+        titles = list(Movie.objects.order_by('id').values_list(
+            'title', flat=True))
+        self.assertEqual(titles, [f'Movie {i}' for i in range(20)])
+
+
+class RecountUsageCommandTests(TestCase):
+    """Tests for the recount_usage command"""
+
+    def test_recount_usage(self):
+        """Test the usage counts of every batch are corrected"""
+        user = get_user_model().objects.create_user('test@test.com',
+                                                    'password123')
+        movie = Movie.objects.create(user=user, title='Heat',
+                                     duration=datetime.timedelta(hours=2),
+                                     price=5)
+        tags = [Tag.objects.create(user=user, name=f'Tag {i}')
+                for i in range(3)]
+        cast = Cast.objects.create(user=user, name='Al Pacino')
+        movie.tag.add(*tags[:2])
+        movie.cast.add(cast)
+        Tag.objects.update(usage_count=7)
+        Cast.objects.update(usage_count=0)
+
+        out = io.StringIO()
+        call_command('recount_usage', batch_size=1, stdout=out)
+        self.assertEqual(
+            list(Tag.objects.order_by('id').values_list(
+                'usage_count', flat=True)), [1, 1, 0])
+        self.assertEqual(Cast.objects.get().usage_count, 1)
+        self.assertIn('Corrected 3 tags', out.getvalue())
+
+
+class DeleteAccountsCommandTests(TestCase):
+    """Tests for the delete_accounts command"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.media = override_settings(MEDIA_ROOT=self.directory.name)
+        self.media.enable()
+        self.user, self.other = [
+            get_user_model().objects.create_user(f'user{i}@test.com',
+                                                 'password123')
+            for i in range(2)
+        ]
+        Token.objects.create(user=self.user)
+
+    def tearDown(self):
+        self.media.disable()
+        self.directory.cleanup()
+
+    def sample_catalog(self, user, movies):
+        tags = [Tag.objects.create(user=user, name=f'Tag {i}')
+                for i in range(2)]
+        cast = Cast.objects.create(user=user, name='Al Pacino')
+        created = []
+        for i in range(movies):
+            movie = Movie.objects.create(
+                user=user, title=f'Movie {i}',
+                duration=datetime.timedelta(hours=2), price=5)
+            movie.tag.add(*tags)
+            movie.cast.add(cast)
+            created.append(movie)
+        return created
+
+    def delete_account(self, email, **options):
+        out = io.StringIO()
+        call_command('delete_accounts', '--user', email, stdout=out,
+                     **options)
+        return out.getvalue()
+
+    @override_settings(MOVIE_DOCUMENTS=True)
+    def test_catalog_and_posters_deleted(self):
+        """Test the catalog, feed and poster files of the user are gone"""
+        movies = self.sample_catalog(self.user, 5)
+        kept = self.sample_catalog(self.other, 2)
+        for movie in movies[:3] + kept[:1]:
+            movie.image.save('poster.jpg', ContentFile(b'poster'))
+        paths = [movie.image.path for movie in movies[:3]]
+
+        out = self.delete_account(self.user.email, batch_size=2)
+        self.assertFalse(get_user_model().objects.filter(
+            pk=self.user.pk).exists())
+        for model in (Movie, Tag, Cast, Change, SimilarMovie, MovieDocument,
+                      Token):
+            self.assertFalse(model.objects.filter(
+                user_id=self.user.pk).exists())
+        self.assertFalse(Movie.tag.through.objects.filter(
+            movie_id__in=[movie.id for movie in movies]).exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertTrue(os.path.exists(kept[0].image.path))
+        self.assertEqual(Movie.objects.filter(user=self.other).count(), 2)
+        self.assertEqual(SimilarMovie.objects.filter(
+            user=self.other).count(), 2)
+        self.assertIn('deleted 4 of 5 movies and 3 posters', out)
+        self.assertIn('Deleted user0@test.com with 5 movies', out)
+
+        with self.assertRaises(CommandError):
+            self.delete_account(self.user.email)
+
+    def test_catalog_not_loaded(self):
+        """Test no movie, tag or cast of the catalog is loaded in memory"""
+        self.sample_catalog(self.user, 40)
+        with patch.object(Movie, 'from_db') as movie_from_db, \
+                patch.object(Tag, 'from_db') as tag_from_db, \
+                patch.object(Cast, 'from_db') as cast_from_db:
+            out = self.delete_account(self.user.email, batch_size=20)
+        self.assertFalse(movie_from_db.called)
+        self.assertFalse(tag_from_db.called)
+        self.assertFalse(cast_from_db.called)
+        self.assertIn('deleted 40 of 40 movies', out)
+        self.assertFalse(Movie.objects.exists())
+
+
+class GcMediaCommandTests(TestCase):
+    """Tests for the gc_media command"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.media = override_settings(MEDIA_ROOT=self.directory.name)
+        self.media.enable()
+        user = get_user_model().objects.create_user('test@test.com',
+                                                    'password123')
+        self.movie = Movie.objects.create(
+            user=user, title='Heat', duration=datetime.timedelta(hours=2),
+            price=5)
+
+    def tearDown(self):
+        self.media.disable()
+        self.directory.cleanup()
+
+    def write_file(self, name, age_hours):
+        path = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as media_file:
+            media_file.write(b'poster')
+        mtime = time.time() - age_hours * 3600
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_unreferenced_old_files_removed(self):
+        """Test only old files no movie refers to are removed"""
+        self.movie.image = 'uploads/movie/kept.jpg'
+        self.movie.save()
+        kept = [
+            self.write_file('uploads/movie/kept.jpg', 48),
+            self.write_file('uploads/movie/recent.jpg', 1),
+            self.write_file('uploads/other.jpg', 48),
+        ]
+        removed = [
+            self.write_file('uploads/movie/old.jpg', 48),
+            self.write_file('uploads/movie/nested/old.png', 48),
+        ]
+
+        out = io.StringIO()
+        call_command('gc_media', dry_run=True, batch_size=1, stdout=out)
+        self.assertIn('Would remove uploads/movie/old.jpg', out.getvalue())
+        self.assertIn('Would remove 2 unreferenced files (12 bytes) of 4',
+                      out.getvalue())
+        self.assertTrue(all(os.path.exists(path)
+                            for path in kept + removed))
+
+        out = io.StringIO()
+        call_command('gc_media', batch_size=1, stdout=out)
+        self.assertIn('Removed 2 unreferenced files', out.getvalue())
+        self.assertTrue(all(os.path.exists(path) for path in kept))
+        self.assertFalse(any(os.path.exists(path) for path in removed))
+
+    def test_missing_directory(self):
+        """Test nothing is scanned before the first upload"""
+        out = io.StringIO()
+        call_command('gc_media', stdout=out)
+        self.assertIn('Removed 0 unreferenced files (0 bytes) of 0',
+                      out.getvalue())
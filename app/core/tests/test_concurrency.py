@@ -0,0 +1,192 @@
+import time
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, RequestFactory, \
+    override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status, viewsets
+
+from core import concurrency
+from core.concurrency import ConcurrencyLimiter, request_start
+from core.middleware import LoadSheddingMiddleware
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SampleViewSet(viewsets.ViewSet):
+    high_priority_actions = ('retrieve',)
+    low_priority_actions = ('list',)
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+    """Tests for the adaptive concurrency limiter"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = ConcurrencyLimiter(4, 2, 6, target_latency=0.5,
+                                          clock=self.clock)
+
+    def test_limit_and_shares_enforced(self):
+        """Test requests beyond their share of the limit are refused"""
+        self.assertTrue(self.limiter.acquire(0.5))
+        self.assertTrue(self.limiter.acquire(0.5))
+        self.assertFalse(self.limiter.acquire(0.5))
+        self.assertTrue(self.limiter.acquire())
+        self.assertTrue(self.limiter.acquire())
+        self.assertFalse(self.limiter.acquire())
+        self.assertEqual(self.limiter.stats(),
+                         {'limit': 4, 'inflight': 4, 'shed': 2})
+
+    def test_limit_adapts_to_latency(self):
+        """Test the limit grows while fast and backs off once when slow"""
+        for _ in range(30):
+            for _ in range(3):
+                self.limiter.acquire()
+            for _ in range(3):
+                self.limiter.release(0.1)
+        self.assertEqual(self.limiter.limit, 6)
+        grown = self.limiter.limit
+
+        for _ in range(3):
+            self.limiter.acquire()
+            self.limiter.release(2)
+        self.assertAlmostEqual(self.limiter.limit, grown * 0.9)
+        for _ in range(20):
+            self.clock.now += 1
+            self.limiter.acquire()
+            self.limiter.release(2)
+        self.assertGreaterEqual(self.limiter.limit, 2)
+
+        self.limiter.acquire()
+        self.limiter.release(0.1)
+        self.assertGreater(self.limiter.limit, 2)
+
+    def test_request_start(self):
+        """Test the proxy's timestamp is read in any unit"""
+        for value in ('t=1600000000.25', '1600000000250',
+                      '1600000000250000'):
+            self.assertAlmostEqual(
+                request_start({'HTTP_X_REQUEST_START': value}),
+                1600000000.25)
+        self.assertIsNone(request_start({}))
+        self.assertIsNone(request_start({'HTTP_X_REQUEST_START': 'now'}))
+
+
+@override_settings(LOAD_SHED_INITIAL_LIMIT=2, LOAD_SHED_MIN_LIMIT=1,
+                   LOAD_SHED_MAX_QUEUE_SECONDS=2,
+                   LOAD_SHED_SHARES={'high': 1.0, 'normal': 0.8,
+                                     'low': 0.5})
+class LoadSheddingMiddlewareTests(SimpleTestCase):
+    """Tests for shedding requests beyond the concurrency limit"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = LoadSheddingMiddleware(
+            lambda request: HttpResponse())
+        self.limiter = self.middleware.limiter
+
+    def call(self, action, **meta):
+        """Runs a request to an action, returns the shed response if any"""
+        request = self.factory.get('/', **meta)
+        view = SampleViewSet.as_view({'get': action})
+        responses = []
+
+        def get_response(request):
+            responses.append(self.middleware.process_view(
+                request, view, (), {}))
+            return responses[0] or HttpResponse()
+
+        self.middleware.get_response = get_response
+        self.middleware(request)
+        return responses[0]
+
+    def test_expensive_requests_shed_first(self):
+        """Test low priority requests are shed before high priority ones"""
+        self.limiter.acquire()
+        response = self.call('list')
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertIsNone(self.call('retrieve'))
+        self.assertEqual(self.limiter.inflight, 1)
+
+    @override_settings(LOAD_SHED_TRUST_REQUEST_START=True)
+    def test_requests_queued_too_long_shed(self):
+        """Test requests waiting past their share of the queue are shed"""
+        queued = {'HTTP_X_REQUEST_START': f't={time.time() - 1.5:.3f}'}
+        self.assertIsNotNone(self.call('list', **queued))
+        self.assertIsNone(self.call('retrieve', **queued))
+        self.assertEqual(self.limiter.inflight, 0)
+        self.assertLess(self.limiter.limit, 2)
+
+    def test_request_start_untrusted(self):
+        """Test clients cannot claim a queueing delay without a proxy"""
+        self.assertIsNone(self.call('list', HTTP_X_REQUEST_START='t=0'))
+        self.assertGreaterEqual(self.limiter.limit, 2)
+
+    @override_settings(LOAD_SHED_TRUST_REQUEST_START=True)
+    def test_request_start_in_future_clamped(self):
+        """Test a start after the arrival counts as no queueing"""
+        request = self.factory.get(
+            '/', HTTP_X_REQUEST_START=f't={time.time() + 60:.3f}')
+        self.assertEqual(self.middleware.queue_delay(request, time.time()),
+                         0)
+
+    def test_sync_worker_queue_shed(self):
+        """Test requests are shed on the queueing delay serve estimates"""
+        queued = {concurrency.QUEUE_DELAY_ENV: 1.5}
+        self.assertIsNotNone(self.call('list', **queued))
+        self.assertIsNone(self.call('retrieve', **queued))
+        self.assertIsNone(self.call('list'))
+        self.assertEqual(self.limiter.inflight, 0)
+
+    def test_released_when_stream_closed(self):
+        """Test a streamed response is counted out once it is closed"""
+        view = SampleViewSet.as_view({'get': 'list'})
+
+        def get_response(request):
+            self.middleware.process_view(request, view, (), {})
+            return StreamingHttpResponse(iter([b'row\n']))
+
+        self.middleware.get_response = get_response
+        response = self.middleware(self.factory.get('/'))
+        self.assertEqual(self.limiter.inflight, 1)
+        self.assertEqual(b''.join(response.streaming_content), b'row\n')
+        self.assertEqual(self.limiter.inflight, 1)
+        response.close()
+        response.close()
+        self.assertEqual(self.limiter.inflight, 0)
+
+    def test_released_on_error(self):
+        """Test a request failing in the view is counted out"""
+        view = SampleViewSet.as_view({'get': 'list'})
+
+        def get_response(request):
+            self.middleware.process_view(request, view, (), {})
+            raise ValueError
+
+        self.middleware.get_response = get_response
+        with self.assertRaises(ValueError):
+            self.middleware(self.factory.get('/'))
+        self.assertEqual(self.limiter.inflight, 0)
+
+
+class HealthApiTests(TestCase):
+    """Tests for the health endpoint"""
+
+    def test_health(self):
+        """Test the health check answers without credentials"""
+        res = APIClient().get(reverse('health'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], 'ok')
+        self.assertEqual(res.data['inflight'], 1)
+        self.assertIs(concurrency.limiter.stats()['inflight'], 0)
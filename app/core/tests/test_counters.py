@@ -0,0 +1,99 @@
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.counters import CounterBuffer, VIEW, PLAY, start_writer, \
+    write_back
+from core.models import Movie, ViewCount
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(VIEW_COUNTS_FLUSH_SECONDS=10, VIEW_COUNTS_MAX_BUFFERED=3)
+class CounterBufferTests(TestCase):
+    """Tests for the buffered view and play counters"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('test@test.com',
+                                                    'password123')
+        self.movies = [
+            Movie.objects.create(user=user, title=f'Movie {i}',
+                                 duration=datetime.timedelta(hours=2),
+                                 price=5)
+            for i in range(3)
+        ]
+        self.clock = FakeClock()
+        self.buffer = CounterBuffer(clock=self.clock)
+
+    def stored(self):
+        return list(ViewCount.objects.order_by('movie_id').values_list(
+            'movie_id', 'views', 'plays'))
+
+    def test_counts_written_back_in_one_upsert(self):
+        """Test counts are summed in memory and added to the stored ones"""
+        heat, ronin, _ = self.movies
+        for _ in range(5):
+            self.buffer.add(heat.id, VIEW)
+        self.buffer.add(heat.id, PLAY)
+        self.buffer.add(ronin.id, VIEW)
+        self.assertFalse(self.buffer.due())
+        self.assertEqual(ViewCount.objects.count(), 0)
+
+        self.clock.now = 10
+        self.assertTrue(self.buffer.due())
+        with self.assertNumQueries(1):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.buffer.add(heat.id, VIEW)
+        self.buffer.flush()
+        self.assertEqual(self.stored(),
+                         [(heat.id, 6, 1), (ronin.id, 1, 0)])
+        self.assertEqual(ViewCount.objects.get(movie=heat).bucket,
+                         ViewCount.bucket_of(timezone.now()))
+        self.assertFalse(self.buffer.due())
+
+    def test_full_buffer_written_back(self):
+        """Test the buffer is written back once it holds enough keys"""
+        deleted = Movie.objects.create(
+            user=self.movies[0].user, title='Gone',
+            duration=datetime.timedelta(hours=1), price=1)
+        self.buffer.add(deleted.id, VIEW)
+        deleted.delete()
+        self.buffer.add(self.movies[0].id, VIEW)
+        self.assertEqual(ViewCount.objects.count(), 0)
+        self.buffer.add(self.movies[1].id, VIEW)
+        self.assertEqual(self.stored(), [(self.movies[0].id, 1, 0),
+                                         (self.movies[1].id, 1, 0)])
+
+    def test_counts_kept_when_write_fails(self):
+        """Test counts which could not be written are retried"""
+        self.buffer.add(self.movies[0].id, VIEW)
+        with patch.object(ViewCount.objects, 'add',
+                          side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        self.buffer.add(self.movies[0].id, VIEW)
+        self.buffer.flush()
+        self.assertEqual(self.stored(), [(self.movies[0].id, 2, 0)])
+
+    @patch('core.counters.os.register_at_fork')
+    @patch('core.counters.atexit.register')
+    @patch('core.counters.threading.Thread')
+    def test_writer_started(self, thread, register, register_at_fork):
+        """Test other servers write the counts back periodically and at exit"""
+        start_writer()
+        thread.return_value.start.assert_called_once_with()
+        self.assertTrue(thread.call_args[1]['daemon'])
+        register.assert_called_once_with(write_back, force=True)
+        register_at_fork.call_args[1]['after_in_child']()
+        self.assertEqual(thread.return_value.start.call_count, 2)
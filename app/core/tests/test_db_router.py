@@ -0,0 +1,166 @@
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import OperationalError, connections
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, \
+    RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import db_router
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Movie, PrimaryPin
+from movie.views import MovieApiViewSet
+from user.views import AuthTokenView
+
+
+REPLICAS = ['replica0', 'replica1']
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS, REPLICA_MAX_LAG_SECONDS=2,
+                   REPLICA_CHECK_INTERVAL=5)
+class ReplicaRouterTests(SimpleTestCase):
+    """Tests for routing reads to the read replicas"""
+
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        db_router.use_replica()
+
+    def tearDown(self):
+        db_router.use_primary()
+
+    @patch('core.db_router.replica_lag', return_value=0)
+    def test_reads_balanced_over_replicas(self, replica_lag):
+        """Test reads alternate between healthy replicas"""
+        reads = {self.router.db_for_read(Movie) for _ in range(4)}
+        self.assertEqual(reads, set(REPLICAS))
+        self.assertEqual(self.router.db_for_write(Movie), 'default')
+        self.assertEqual(replica_lag.call_count, 2)
+
+    def test_lagging_and_unreachable_replicas_skipped(self):
+        """Test replicas behind or down are not read from"""
+        with patch('core.db_router.replica_lag', side_effect=[10, 0]):
+            self.assertEqual(self.router.healthy_replicas(), ['replica1'])
+        self.router.health.clear()
+        with patch('core.db_router.replica_lag',
+                   side_effect=OperationalError), \
+                patch('core.db_router.connections'):
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+
+    @patch('core.db_router.replica_lag', return_value=0)
+    def test_reads_on_primary_unless_opted_in(self, replica_lag):
+        """Test reads of requests which did not opt in use the primary"""
+        db_router.use_primary()
+        self.assertEqual(self.router.db_for_read(Movie), 'default')
+        replica_lag.assert_not_called()
+
+
+@override_settings(DATABASE_REPLICAS=REPLICAS, REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingMiddlewareTests(TestCase):
+    """Tests for choosing the database of a request"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.list_view = MovieApiViewSet.as_view({'get': 'list',
+                                                  'post': 'create'})
+        self.export_view = MovieApiViewSet.as_view({'get': 'export'})
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.token = Token.objects.create(user=self.user)
+        self.routed = []
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+
+    def get_response(self, request):
+        self.routed.append(getattr(db_router._state, 'replica', False))
+        if request.method == 'POST':
+            # As the view does once it authenticated the token
+            request.user = self.user
+            return HttpResponse(status=201)
+        return HttpResponse()
+
+    def request(self, method, view, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = getattr(self.factory, method)('/', **headers)
+        request.user = AnonymousUser()
+        self.middleware.process_view(request, view, (), {})
+        return self.middleware(request)
+
+    def test_safe_opted_in_actions_use_replicas(self):
+        """Test list reads go to replicas and other actions do not"""
+        self.request('get', self.list_view)
+        self.request('get', self.export_view)
+        self.request('get', AuthTokenView.as_view())
+        self.assertEqual(self.routed, [True, False, False])
+        self.assertFalse(db_router._state.replica)
+
+    def test_writes_pin_user_to_primary(self):
+        """Test a user reads from the primary after writing"""
+        self.request('post', self.list_view, self.token.key)
+        self.assertFalse(self.request('get', self.list_view).cookies)
+        self.request('get', self.list_view, self.token.key)
+        self.request('get', self.list_view, 'unknown')
+        self.assertEqual(self.routed, [False, True, False, True])
+
+        PrimaryPin.objects.update(
+            until=timezone.now() - datetime.timedelta(seconds=1))
+        self.request('get', self.list_view, self.token.key)
+        self.assertEqual(self.routed[-1], True)
+
+
+@override_settings(DATABASE_REPLICAS=['replica0'], REPLICA_PIN_SECONDS=5)
+class ReplicaReadYourWritesTests(TransactionTestCase):
+    """Tests for routing reads between two database connections
+
+    Reads inside a transaction use the primary, so these tests run
+    outside the transaction of a TestCase.
+    """
+    databases = {'default', 'replica0'}
+
+    @classmethod
+    def setUpClass(cls):
+        # A second connection to the test database, as DB_REPLICA_HOSTS
+        # configures for each replica
+        connections.databases['replica0'] = dict(
+            connections.databases['default'], TEST={'MIRROR': 'default'})
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica0'].close()
+        del connections['replica0']
+        del connections.databases['replica0']
+
+    def client_of(self, email):
+        """Returns a client authenticating with a token, without cookies"""
+        user = get_user_model().objects.create_user(email, 'password123')
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user)}')
+        return client
+
+    def test_writer_reads_own_writes(self):
+        """Test the user who wrote reads the primary, others the replica"""
+        writer = self.client_of('test@test.com')
+        reader = self.client_of('other@test.com')
+        movies_url = reverse('movie:movie-list')
+        res = writer.post(movies_url, {'title': 'Heat',
+                                       'duration': '02:50:00',
+                                       'price': '5.99'})
+        self.assertEqual(res.status_code, 201)
+        self.assertFalse(res.cookies)
+        with CaptureQueriesContext(connections['replica0']) as replica:
+            self.assertEqual(len(writer.get(movies_url).data), 1)
+        self.assertEqual(len(replica), 0)
+
+        with CaptureQueriesContext(connections['replica0']) as replica:
+            self.assertEqual(len(reader.get(movies_url).data), 0)
+        self.assertTrue(any('FROM "core_movie"' in query['sql']
+                            for query in replica.captured_queries))
@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import tempfile
+import subprocess
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+
+from core.images import ImageRejected, probe_poster, normalize_poster
+
+
+# Prints how much a poster upload raised the peak RSS of a fresh process
+PEAK_RSS_SCRIPT = '''
+import os, sys, resource, django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+from django.core.files.uploadedfile import SimpleUploadedFile
+from core.images import ImageRejected, probe_poster, normalize_poster
+with open(sys.argv[1], 'rb') as image_file:
+    upload = SimpleUploadedFile('poster', image_file.read())
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    normalize_poster(upload, probe_poster(upload))
+except ImageRejected:
+    pass
+print((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024)
+'''
+
+
+def sample_upload(size, image_format='JPEG', mode='RGB'):
+    """Returns an upload of a blank image"""
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, image_format)
+    return SimpleUploadedFile(f'poster.{image_format.lower()}',
+                              buffer.getvalue())
+
+
+class PosterImageTests(SimpleTestCase):
+    """Tests for the probing and normalizing of poster uploads"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        # A few kilobytes which would decode to 100M pixels
+        cls.bomb = os.path.join(cls.directory.name, 'bomb.png')
+        Image.new('1', (10000, 10000)).save(cls.bomb, 'PNG')
+        cls.large = os.path.join(cls.directory.name, 'large.jpg')
+        Image.new('RGB', (6000, 4000)).save(cls.large, 'JPEG')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def peak_rss_growth(self, path):
+        process = subprocess.run(
+            [sys.executable, '-c', PEAK_RSS_SCRIPT, path],
+            cwd=settings.BASE_DIR, stdout=subprocess.PIPE, check=True,
+            universal_newlines=True
+        )
+        return int(process.stdout)
+
+    def test_probe_rejects_before_decoding(self):
+        """Test format, byte and pixel limits are enforced on the header"""
+        with self.assertRaisesRegex(ImageRejected, 'JPEG or PNG'):
+            probe_poster(sample_upload((10, 10), 'GIF', 'P'))
+        with self.assertRaisesRegex(ImageRejected, 'JPEG or PNG'):
+            probe_poster(SimpleUploadedFile('poster.jpg', b'not an image'))
+        with open(self.bomb, 'rb') as bomb:
+            upload = SimpleUploadedFile('bomb.png', bomb.read())
+        with self.assertRaisesRegex(ImageRejected, 'pixels'):
+            probe_poster(upload)
+        # A complete header but a cut-off image
+        png = sample_upload((10, 10), 'PNG').read()
+        with self.assertRaisesRegex(ImageRejected, 'JPEG or PNG'):
+            probe_poster(SimpleUploadedFile('poster.png', png[:-20]))
+        with override_settings(POSTER_MAX_BYTES=100):
+            with self.assertRaisesRegex(ImageRejected, 'bytes'):
+                probe_poster(sample_upload((100, 100)))
+
+    def test_small_poster_kept(self):
+        """Test posters within the limits are stored as uploaded"""
+        upload = sample_upload((400, 600))
+        self.assertIs(normalize_poster(upload, probe_poster(upload)), upload)
+
+    def test_oversized_poster_normalized(self):
+        """Test large posters are downscaled and re-encoded"""
+        upload = sample_upload((3000, 4500), 'PNG')
+        normalized = normalize_poster(upload, probe_poster(upload))
+        self.assertEqual(normalized.name, 'poster.png')
+        image = Image.open(normalized)
+        self.assertEqual((image.format, image.size), ('PNG', (1333, 2000)))
+        # Over the decode budget in full, but decoded at half scale
+        with open(self.large, 'rb') as large:
+            upload = SimpleUploadedFile('large.jpg', large.read())
+        image = Image.open(normalize_poster(upload, probe_poster(upload)))
+        self.assertEqual((image.format, image.size), ('JPEG', (2000, 1333)))
+        with override_settings(POSTER_DECODE_BUDGET=1024 * 1024):
+            with self.assertRaisesRegex(ImageRejected, 'too large'):
+                normalize_poster(upload, probe_poster(upload))
+
+    def test_peak_rss_bounded(self):
+        """Test bombs and large originals stay within the memory budget"""
+        self.assertLess(self.peak_rss_growth(self.bomb), 8 * 1024 * 1024)
+        # Decoded in full the image alone would take 72MB
+        self.assertLess(self.peak_rss_growth(self.large),
+                        settings.POSTER_DECODE_BUDGET)
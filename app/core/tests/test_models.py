@@ -82,3 +82,64 @@ class ModelTests(TestCase):
         file_path = movie_image_file_path(None, 'hello.jpg')
         exp_path = f'uploads/movie/{uuid}.jpg'
         self.assertEqual(file_path, exp_path)
+
+
+class UsageCountTests(TestCase):
+    """Tests for the usage counts of tags and casts"""
+
+    def setUp(self):
+        self.user = sample_user()
+        self.tag = Tag.objects.create(user=self.user, name='Comedy')
+        self.cast = Cast.objects.create(user=self.user, name='Andy Samberg')
+        self.movie = Movie.objects.create(
+            user=self.user,
+            title='Brooklyn 9-9',
+            duration=datetime.timedelta(minutes=40),
+            price=18.00
+        )
+
+    def usage(self):
+        self.tag.refresh_from_db()
+        self.cast.refresh_from_db()
+        return self.tag.usage_count, self.cast.usage_count
+
+    def test_usage_follows_membership(self):
+        """Test adds, removals and clears adjust the usage counts"""
+        self.movie.tag.add(self.tag)
+        self.movie.tag.add(self.tag)
+        self.movie.cast.set([self.cast])
+        self.assertEqual(self.usage(), (1, 1))
+        self.movie.cast.remove(self.cast)
+        self.movie.cast.remove(self.cast)
+        self.movie.tag.clear()
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_usage_follows_reverse_membership(self):
+        """Test membership changes from the tag side adjust its count"""
+        other = Movie.objects.create(
+            user=self.user,
+            title='Parks and Recreation',
+            duration=datetime.timedelta(minutes=22),
+            price=9.00
+        )
+        self.tag.movie_set.add(self.movie, other)
+        self.assertEqual(self.usage()[0], 2)
+        self.tag.movie_set.remove(other)
+        self.assertEqual(self.usage()[0], 1)
+        self.tag.movie_set.clear()
+        self.assertEqual(self.usage()[0], 0)
+
+    def test_usage_released_on_movie_delete(self):
+        """Test deleting a movie decrements its tags and casts"""
+        self.movie.tag.add(self.tag)
+        self.movie.cast.add(self.cast)
+        self.movie.delete()
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_recount_usage(self):
+        """Test drifted usage counts are recomputed from the movies"""
+        self.movie.tag.add(self.tag)
+        Tag.objects.update(usage_count=5)
+        self.assertEqual(Tag.objects.recount_usage(), 1)
+        self.assertEqual(Tag.objects.recount_usage(), 0)
+        self.assertEqual(self.usage()[0], 1)
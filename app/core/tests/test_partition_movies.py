@@ -0,0 +1,159 @@
+import io
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.management.commands.partition_movies import Command
+from core.models import Tag, Cast, Movie
+
+
+MOVIE_URL = reverse('movie:movie-list')
+
+
+def sample_movie(user, **params):
+    """Create and return a movie"""
+    defaults = {
+        'title': 'Heat',
+        'duration': datetime.timedelta(hours=2, minutes=50),
+        'price': 5.99
+    }
+    defaults.update(params)
+    return Movie.objects.create(user=user, **defaults)
+
+
+def scanned_relations(queryset):
+    """Returns the tables a query plan reads"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    relations = set()
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Relation Name' in node:
+            relations.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return relations
+
+
+class PartitionMoviesCommandTests(TestCase):
+    """Tests for the partition_movies command"""
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(f'user{i}@test.com',
+                                                 'password123')
+            for i in range(3)
+        ]
+        self.tag = Tag.objects.create(user=self.users[0], name='Crime')
+        self.cast = Cast.objects.create(user=self.users[0], name='Pacino')
+        self.movies = [sample_movie(user, title=f'Movie {i}')
+                       for i, user in enumerate(self.users * 3)]
+        self.movies[0].tag.add(self.tag)
+        self.movies[0].cast.add(self.cast)
+
+    def partition(self, **options):
+        call_command('partition_movies', partitions=4, batch_size=2,
+                     stdout=io.StringIO(), **options)
+
+    def test_rows_copied_and_tables_swapped(self):
+        """Test every row moves to the partitioned tables"""
+        self.partition()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class "
+                           "WHERE relname = 'core_movie'")
+            self.assertEqual(cursor.fetchone()[0], 'p')
+            cursor.execute("SELECT indexname FROM pg_indexes "
+                           "WHERE tablename = 'core_movie'")
+            self.assertTrue({'core_movie_pkey', 'core_movie_title_search'}
+                            <= {row[0] for row in cursor.fetchall()})
+            cursor.execute("SELECT pg_get_serial_sequence('core_movie', "
+                           "'id')")
+            self.assertEqual(cursor.fetchone()[0], 'public.core_movie_id_seq')
+        self.assertEqual(Movie.objects.count(), 9)
+        self.assertEqual(list(self.movies[0].tag.all()), [self.tag])
+        self.assertEqual(list(self.movies[0].cast.all()), [self.cast])
+        with self.assertRaises(CommandError):
+            self.partition()
+
+    def test_old_postgres_refused(self):
+        """Test servers without hash partitioning are left untouched"""
+        with patch.object(connection, 'pg_version', 100012):
+            with self.assertRaisesRegex(CommandError, 'PostgreSQL 11'):
+                self.partition()
+        self.assertEqual(Command()._relkind('core_movie'), 'r')
+
+    def test_writes_during_backfill_mirrored(self):
+        """Test changes made while rows are copied reach the new tables"""
+        backfill = Command._backfill
+
+        def write_then_backfill(command, table, batch_size):
+            if table == 'core_movie':
+                Movie.objects.filter(id=self.movies[1].id).update(
+                    title='Renamed')
+                self.movies[2].delete()
+                sample_movie(self.users[0], title='Added')
+            backfill(command, table, batch_size)
+
+        with patch.object(Command, '_backfill', write_then_backfill):
+            self.partition()
+        self.assertEqual(Movie.objects.count(), 9)
+        self.assertTrue(Movie.objects.filter(title='Added').exists())
+        self.assertEqual(Movie.objects.get(id=self.movies[1].id).title,
+                         'Renamed')
+
+    def test_queries_pruned_to_one_partition(self):
+        """Test the per-user and per-movie queries scan one partition"""
+        self.partition()
+        user = self.users[1]
+        relations = scanned_relations(Movie.objects.filter(user=user))
+        self.assertEqual(len(relations), 1)
+        self.assertTrue(relations.pop().startswith('core_movie_p'))
+        relations = scanned_relations(
+            Movie.objects.filter(user=user, id=self.movies[1].id))
+        self.assertEqual(len(relations), 1)
+        relations = scanned_relations(
+            Movie.tag.through.objects.filter(movie_id=self.movies[0].id))
+        self.assertEqual(len(relations), 1)
+        self.assertTrue(relations.pop().startswith('core_movie_tag_p'))
+
+    def test_api_works_on_partitioned_tables(self):
+        """Test movies are created, changed and deleted after the swap"""
+        self.partition()
+        user = self.users[0]
+        client = APIClient()
+        client.force_authenticate(user)
+        res = client.post(MOVIE_URL, {
+            'title': 'Ronin', 'duration': '02:02:00', 'price': 4.5,
+            'tag': [self.tag.id], 'cast': [self.cast.id]})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertGreater(res.data['id'], max(m.id for m in self.movies))
+        res = client.post(reverse('movie:movie-membership',
+                                  args=[res.data['id']]),
+                          {'tag_add': [self.tag.id]})
+        self.assertEqual(res.data['tag_add'], 0)
+        self.movies[0].delete()
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.usage_count, 1)
+        self.assertEqual(Movie.tag.through.objects.count(), 1)
+
+    def test_drop_old_tables(self):
+        """Test the original tables are dropped on request"""
+        with self.assertRaises(CommandError):
+            self.partition(drop_old=True)
+        self.partition()
+        self.partition(drop_old=True)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('core_movie_old')")
+            self.assertIsNone(cursor.fetchone()[0])
+        self.assertEqual(Movie.objects.count(), 9)
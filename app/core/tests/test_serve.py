@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from core import concurrency
+from core.benchmark import child_pids
+from core.server import WorkerServer, bind, listen_backlog
+
+
+MANAGE = os.path.join(settings.BASE_DIR, 'manage.py')
+
+
+def get(url):
+    """Returns the status of a request to url"""
+    try:
+        return urllib.request.urlopen(url, timeout=5).status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+class ServeCommandTests(SimpleTestCase):
+    """Tests for the pre-fork serve command"""
+
+    def start(self, *args):
+        self.server = subprocess.Popen(
+            [sys.executable, MANAGE, 'serve', '--bind', '127.0.0.1:0',
+             '--workers', '2', *args],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True
+        )
+        self.addCleanup(self.stop)
+        line = self.server.stdout.readline()
+        self.assertTrue(line.startswith('Listening at '), line)
+        self.url = line.split()[2] + '/api/movie/tags/'
+        self.wait_for(lambda: len(child_pids(self.server.pid)) == 2)
+
+    def stop(self):
+        if self.server.poll() is None:
+            self.server.send_signal(signal.SIGTERM)
+            self.server.wait(30)
+
+    def wait_for(self, condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+    def test_serve_reload_and_stop(self):
+        """Test workers serve, are replaced on SIGHUP and stop on SIGTERM"""
+        self.start()
+        workers = child_pids(self.server.pid)
+        self.assertEqual(get(self.url), 401)
+
+        self.server.send_signal(signal.SIGHUP)
+        self.wait_for(lambda: not set(workers) &
+                      set(child_pids(self.server.pid)) and
+                      len(child_pids(self.server.pid)) == 2)
+        self.assertEqual(get(self.url), 401)
+
+        self.server.send_signal(signal.SIGTERM)
+        self.assertEqual(self.server.wait(30), 0)
+        self.assertEqual(child_pids(self.server.pid), [])
+
+    def test_workers_recycled_after_max_requests(self):
+        """Test workers are replaced after serving their requests"""
+        self.start('--max-requests', '2')
+        workers = child_pids(self.server.pid)
+        for _ in range(6):
+            self.assertEqual(get(self.url), 401)
+        self.wait_for(lambda: not set(workers) &
+                      set(child_pids(self.server.pid)))
+
+
+class WorkerServerTests(SimpleTestCase):
+    """Tests for the queueing delay sync workers estimate"""
+
+    def setUp(self):
+        self.sock = bind('127.0.0.1:0', 16)
+        self.addCleanup(self.sock.close)
+        self.clients = []
+        for _ in range(3):
+            client = socket.create_connection(self.sock.getsockname())
+            client.sendall(b'GET / HTTP/1.0\r\n\r\n')
+            self.addCleanup(client.close)
+            self.clients.append(client)
+
+    def test_listen_backlog(self):
+        """Test the connections waiting to be accepted are counted"""
+        self.assertEqual(listen_backlog(self.sock), 3)
+        self.sock.setblocking(True)
+        self.sock.accept()[0].close()
+        self.assertEqual(listen_backlog(self.sock), 2)
+        self.assertIsNone(listen_backlog(self.clients[0]))
+
+    def test_queue_delay_in_environ(self):
+        """Test requests carry the delay of the connections behind them"""
+        delays = []
+
+        def application(environ, start_response):
+            delays.append(environ[concurrency.QUEUE_DELAY_ENV])
+            start_response('204 No Content', [])
+            return []
+
+        server = WorkerServer(self.sock, application, workers=2)
+        server.handle_request()
+        server.service_time = 0.5
+        server.handle_request()
+        server.handle_request()
+        self.assertEqual(delays, [0.0, 0.25, 0.0])
+        self.assertEqual(server.handled, 3)
+
+
+class ServeBenchmarkCommandTests(SimpleTestCase):
+    """Tests for the bench_serve command"""
+
+    def test_bench_serve_reports_both_modes(self):
+        """Test start-up and memory are measured with and without preload"""
+        with tempfile.NamedTemporaryFile(suffix='.json') as output, \
+                open(os.devnull, 'w') as devnull:
+            argv = sys.argv
+            sys.argv = [MANAGE]
+            try:
+                call_command('bench_serve', workers=1, requests=2,
+                             output=output.name, stdout=devnull)
+            finally:
+                sys.argv = argv
+            results = json.load(open(output.name))
+        for mode in ('preload', 'no-preload'):
+            stats = results['modes'][mode]
+            self.assertGreater(stats['cold_start_s'], 0)
+            self.assertGreater(stats['worker_pss_bytes'], 0)
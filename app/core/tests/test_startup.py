@@ -0,0 +1,64 @@
+import io
+import os
+import json
+import tempfile
+
+from django.contrib import admin
+from django.core import checks
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from core.models import Movie
+
+
+class ProfileStartupCommandTests(SimpleTestCase):
+    """Tests for the start-up of commands and of the first request"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.output = os.path.join(cls.directory.name, 'startup.json')
+        call_command('profile_startup', 'wait_for_db', repeats=1,
+                     output=cls.output, stdout=io.StringIO())
+        with open(cls.output) as results_file:
+            cls.results = json.load(results_file)['startup']
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_command_defers_heavy_modules(self):
+        """Test a command imports neither Pillow, the admin nor views"""
+        result = self.results['command']
+        self.assertEqual(result['deferred'], [])
+        self.assertGreater(result['wall_s'], 0)
+        self.assertGreater(result['import_s'], 0)
+        self.assertEqual(result['last_line'], 'Database Available!')
+
+    def test_first_request_loads_deferred_modules(self):
+        """Test the first request discovers the admin and loads the views"""
+        result = self.results['first_request']
+        self.assertEqual(result['last_line'], '401 Unauthorized')
+        self.assertIn('core.admin', result['deferred'])
+        self.assertIn('movie.views', result['deferred'])
+        self.assertGreater(result['wall_s'], 0)
+
+    def test_startup_regressions(self):
+        """Test slower start-up and newly imported modules regress"""
+        baseline = os.path.join(self.directory.name, 'baseline.json')
+        with open(self.output) as results_file:
+            results = json.load(results_file)
+        results['startup']['command']['wall_s'] = 0.001
+        with open(baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file)
+        with self.assertRaisesRegex(CommandError, 'command: wall_s'):
+            call_command('profile_startup', 'wait_for_db', repeats=1,
+                         baseline=baseline, stdout=io.StringIO())
+
+    def test_admin_checks_discover_admin(self):
+        """Test the admin checks run on every registered model admin"""
+        self.assertEqual(checks.run_checks(tags=[checks.Tags.admin]), [])
+        self.assertIn(Movie, admin.site._registry)
@@ -1,3 +1,17 @@
-# from django.shortcuts import render
+from rest_framework import views
+from rest_framework.response import Response
 
-# Create your views here.
+from core import concurrency
+
+
+class HealthView(views.APIView):
+    """Reports the server is up with the load of its concurrency limiter"""
+    authentication_classes = ()
+    permission_classes = ()
+    high_priority_actions = ('get',)
+
+    def get(self, request):
+        data = {'status': 'ok'}
+        if concurrency.limiter is not None:
+            data.update(concurrency.limiter.stats())
+        return Response(data)
@@ -1,30 +1,88 @@
+import json
+import base64
+import binascii
+import datetime
+import decimal
+
+from django.core.exceptions import ValidationError
+from django.utils.duration import duration_string
+
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
-from core.models import Tag, Cast, Movie
+from core.images import ImageRejected, probe_poster, normalize_poster
+from core.models import Tag, Cast, Movie, Change
 
 
 class TagSerializer(serializers.ModelSerializer):
     """Serializer for the Tag Model"""
     class Meta:
         model = Tag
-        fields = ('id', 'name',)
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'usage_count')
+        read_only_fields = ('id', 'usage_count')
 
 
 class CastSerializer(serializers.ModelSerializer):
     """Serializer for cast objects"""
     class Meta:
         model = Cast
-        fields = ('id', 'name',)
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'usage_count')
+        read_only_fields = ('id', 'usage_count')
+
+
+class UserManyRelatedField(serializers.ManyRelatedField):
+    """Resolves a list of primary keys with a single query"""
+    default_error_messages = {
+        'does_not_exist':
+            'Invalid pks {pk_values} - objects do not exist.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pks = []
+        for item in data:
+            if isinstance(item, int) and not isinstance(item, bool):
+                pks.append(item)
+            elif isinstance(item, str) and item.isascii() and \
+                    item.isdigit():
+                pks.append(int(item))
+            else:
+                self.child_relation.fail('incorrect_type',
+                                         data_type=type(item).__name__)
+        pks = list(dict.fromkeys(pks))
+        objects = self.child_relation.get_queryset().in_bulk(pks)
+        missing = [pk for pk in pks if pk not in objects]
+        if missing:
+            self.fail('does_not_exist', pk_values=missing)
+        return [objects[pk] for pk in pks]
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field limited to the objects of the requesting user"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return UserManyRelatedField(**list_kwargs)
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        queryset = super().get_queryset()
+        if request is None:
+            return queryset.none()
+        return queryset.filter(user=request.user)
 
 
 class MovieSerializer(serializers.ModelSerializer):
     """Serializer for movie objects"""
-    cast = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Cast.objects.all())
-    tag = serializers.PrimaryKeyRelatedField(many=True,
-                                             queryset=Tag.objects.all())
+    cast = UserPrimaryKeyRelatedField(many=True, queryset=Cast.objects.all())
+    tag = UserPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
 
     class Meta:
         model = Movie
@@ -38,9 +96,167 @@ class MovieDetailSerializer(MovieSerializer):
     tag = TagSerializer(many=True, read_only=True)
 
 
+class TagReferenceSerializer(TagSerializer):
+    """Serializes a tag without its usage count"""
+    class Meta(TagSerializer.Meta):
+        fields = ('id', 'name')
+
+
+class CastReferenceSerializer(CastSerializer):
+    """Serializes a cast without its usage count"""
+    class Meta(CastSerializer.Meta):
+        fields = ('id', 'name')
+
+
+class MovieDocumentSerializer(MovieSerializer):
+    """Serializes the detail Movie stored as a document
+
+    Tags and casts are nested without their usage counts, which change
+    whenever a movie of the user gains or loses them.
+    """
+    cast = CastReferenceSerializer(many=True, read_only=True)
+    tag = TagReferenceSerializer(many=True, read_only=True)
+
+
+NESTED_SERIALIZERS = {'tag': TagSerializer, 'cast': CastSerializer}
+
+
+def expanded_movie_serializer(fields):
+    """Returns a movie serializer nesting the given relations"""
+    nested = {field: NESTED_SERIALIZERS[field](many=True, read_only=True)
+              for field in fields}
+    return type('ExpandedMovieSerializer', (MovieSerializer,), nested)
+
+
+class MovieQuerySerializer(serializers.Serializer):
+    """Validates the filters, ordering, page and sideloading of the list"""
+    ORDERINGS = ('title', 'price', 'duration', 'id')
+    duration_min = serializers.DurationField(required=False)
+    duration_max = serializers.DurationField(required=False)
+    price_min = serializers.DecimalField(max_digits=7, decimal_places=3,
+                                         required=False)
+    price_max = serializers.DecimalField(max_digits=7, decimal_places=3,
+                                         required=False)
+    title = serializers.CharField(max_length=255, required=False)
+    ordering = serializers.ChoiceField(
+        choices=[f'{sign}{field}' for field in ORDERINGS
+                 for sign in ('', '-')],
+        default='-id'
+    )
+    limit = serializers.IntegerField(min_value=1, max_value=1000,
+                                     required=False)
+    cursor = serializers.CharField(required=False)
+    sideload = serializers.BooleanField(default=False)
+
+    @staticmethod
+    def encode_cursor(ordering, movie):
+        """Returns the cursor of the page following a movie"""
+        value = getattr(movie, ordering.lstrip('-'))
+        if isinstance(value, datetime.timedelta):
+            value = duration_string(value)
+        elif isinstance(value, decimal.Decimal):
+            value = str(value)
+        return base64.urlsafe_b64encode(json.dumps(
+            [ordering, value, movie.id]).encode()).decode()
+
+    def validate(self, attrs):
+        if 'cursor' not in attrs:
+            return attrs
+        try:
+            ordering, value, movie_id = json.loads(
+                base64.urlsafe_b64decode(attrs.pop('cursor')))
+            if ordering != attrs['ordering'] or \
+                    not isinstance(movie_id, int):
+                raise ValueError
+            value = Movie._meta.get_field(
+                ordering.lstrip('-')).to_python(value)
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise serializers.ValidationError(
+                {'cursor': ['Invalid cursor for this ordering.']})
+        attrs['after'] = (value, movie_id)
+        return attrs
+
+
+class PosterField(serializers.ImageField):
+    """Image field checking the upload's header before decoding it
+
+    Oversized images are downscaled and re-encoded before being stored.
+    """
+
+    def to_internal_value(self, data):
+        upload = serializers.FileField.to_internal_value(self, data)
+        try:
+            return normalize_poster(upload, probe_poster(upload))
+        except ImageRejected as exc:
+            raise serializers.ValidationError(str(exc))
+
+
 class MovieImageSerializer(serializers.ModelSerializer):
     """Serializer which lets us upload an image for the movie poster."""
+    image = PosterField(allow_null=True, required=False)
+
     class Meta:
         model = Movie
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class MovieMembershipSerializer(serializers.Serializer):
+    """Serializes tags and casts to add to or remove from movies"""
+    max_ids = 1000
+    tag_add = UserPrimaryKeyRelatedField(many=True, required=False,
+                                         queryset=Tag.objects.all())
+    tag_remove = UserPrimaryKeyRelatedField(many=True, required=False,
+                                            queryset=Tag.objects.all())
+    cast_add = UserPrimaryKeyRelatedField(many=True, required=False,
+                                          queryset=Cast.objects.all())
+    cast_remove = UserPrimaryKeyRelatedField(many=True, required=False,
+                                             queryset=Cast.objects.all())
+
+    def validate(self, attrs):
+        for name, objects in attrs.items():
+            if len(objects) > self.max_ids:
+                raise serializers.ValidationError(
+                    {name: [f'At most {self.max_ids} ids are allowed.']})
+        for field in ('tag', 'cast'):
+            overlap = {obj.id for obj in attrs.get(f'{field}_add', [])} & \
+                {obj.id for obj in attrs.get(f'{field}_remove', [])}
+            if overlap:
+                raise serializers.ValidationError({f'{field}_remove': [
+                    f'Ids {sorted(overlap)} are also being added.']})
+        return attrs
+
+
+class BulkMovieMembershipSerializer(MovieMembershipSerializer):
+    """Serializes tag and cast changes of several movies at once"""
+    movies = UserPrimaryKeyRelatedField(many=True, allow_empty=False,
+                                        queryset=Movie.objects.all())
+
+
+class ChangeQuerySerializer(serializers.Serializer):
+    """Validates the position and batch size of a change feed request"""
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, max_value=1000,
+                                     default=500)
+
+
+class TrendingQuerySerializer(serializers.Serializer):
+    """Validates the number of trending movies requested"""
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    """Serializes an entry of the change feed with the object's state"""
+    id = serializers.IntegerField(source='object_id', read_only=True)
+    data = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Change
+        fields = ('seq', 'kind', 'id', 'action', 'data')
+        read_only_fields = fields
+
+    def get_data(self, change):
+        """Returns the current state of an upserted object"""
+        if change.action == Change.ACTION_DELETE:
+            return None
+        return self.context['objects'].get((change.kind, change.object_id))
@@ -91,6 +91,7 @@ class PrivateApiCastTests(TestCase):
         )
         movie.cast.add(cast1)
         res = self.client.get(CAST_URL, {'assigned_only': 1})
+        cast1.refresh_from_db()
         serializer1 = CastSerializer(cast1)
         serializer2 = CastSerializer(cast2)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
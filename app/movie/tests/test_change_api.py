@@ -0,0 +1,166 @@
+import io
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Tag, Cast, Movie, Change, ChangeHorizon
+
+CHANGES_URL = reverse('movie:changes')
+
+
+def sample_movie(user, **params):
+    """Create and return a movie"""
+    defaults = {
+        'title': 'Heat',
+        'duration': datetime.timedelta(hours=2, minutes=50),
+        'price': 5.99
+    }
+    defaults.update(params)
+    return Movie.objects.create(user=user, **defaults)
+
+
+class PublicChangeApiTests(TestCase):
+    """Tests for the change feed without authentication"""
+
+    def test_login_required(self):
+        """Test that login is required for the change feed"""
+        res = APIClient().get(CHANGES_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateChangeApiTests(TestCase):
+    """Tests for the change feed of an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def changes(self, **params):
+        res = self.client.get(CHANGES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_changes_recorded(self):
+        """Test creates, m2m changes and deletes are recorded in order"""
+        tag = Tag.objects.create(user=self.user, name='Crime')
+        movie = sample_movie(self.user)
+        movie.tag.add(tag)
+        since = self.changes()['since']
+        movie_id = movie.id
+        movie.delete()
+
+        data = self.changes()
+        self.assertEqual(
+            [(c['kind'], c['id'], c['action']) for c in data['changes']],
+            [('tag', tag.id, 'upsert'), ('movie', movie_id, 'upsert'),
+             ('movie', movie_id, 'upsert'), ('movie', movie_id, 'delete')]
+        )
+        delta = self.changes(since=since)['changes']
+        self.assertEqual(len(delta), 1)
+        self.assertIsNone(delta[0]['data'])
+
+    def test_changes_include_current_state(self):
+        """Test upserts carry the current state of the object"""
+        cast = Cast.objects.create(user=self.user, name='Al Pacino')
+        movie = sample_movie(self.user)
+        movie.cast.add(cast)
+        last = self.changes()['changes'][-1]
+        self.assertEqual(last['data']['cast'], [cast.id])
+        self.assertEqual(last['data']['title'], 'Heat')
+
+    def test_changes_reverse_membership(self):
+        """Test adding movies to a tag records the movies"""
+        movie = sample_movie(self.user)
+        tag = Tag.objects.create(user=self.user, name='Crime')
+        since = self.changes()['since']
+        tag.movie_set.add(movie)
+        tag_id = tag.id
+        tag.delete()
+        changes = self.changes(since=since)['changes']
+        self.assertEqual(
+            [(c['kind'], c['id']) for c in changes],
+            [('movie', movie.id), ('movie', movie.id), ('tag', tag_id)]
+        )
+
+    def test_changes_deleted_with_user(self):
+        """Test the change feed of a deleted user is removed"""
+        sample_movie(self.user).tag.add(
+            Tag.objects.create(user=self.user, name='Crime'))
+        self.user.delete()
+        self.assertFalse(Change.objects.exists())
+
+    def test_changes_limited_to_user(self):
+        """Test other users' changes are not returned"""
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        sample_movie(other)
+        self.assertEqual(self.changes()['changes'], [])
+
+    def test_changes_batched(self):
+        """Test the feed is returned in bounded batches"""
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+        first = self.changes(limit=3)
+        self.assertEqual(len(first['changes']), 3)
+        self.assertTrue(first['has_more'])
+        second = self.changes(since=first['since'], limit=3)
+        self.assertEqual(len(second['changes']), 2)
+        self.assertFalse(second['has_more'])
+
+    def test_changes_invalid_query(self):
+        """Test positions and batch sizes out of range are rejected"""
+        for query in ({'limit': -5}, {'limit': 0}, {'limit': 1001},
+                      {'limit': 'all'}, {'since': -1}):
+            res = self.client.get(CHANGES_URL, query)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(list(query)[0], res.data)
+
+    def test_changes_behind_horizon(self):
+        """Test clients behind a compacted horizon must resync"""
+        ChangeHorizon.objects.create(user=self.user, seq=10)
+        res = self.client.get(CHANGES_URL, {'since': 5})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        res = self.client.get(CHANGES_URL, {'since': 0})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class CompactChangesCommandTests(TestCase):
+    """Tests for the compact_changes command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+
+    def test_superseded_changes_collapsed(self):
+        """Test only the latest change of each object is kept"""
+        movie = sample_movie(self.user)
+        movie.title = 'Ronin'
+        movie.save()
+        tag = Tag.objects.create(user=self.user, name='Crime')
+        call_command('compact_changes', stdout=io.StringIO())
+        self.assertEqual(
+            list(Change.objects.order_by('seq').values_list(
+                'kind', 'object_id')),
+            [('movie', movie.id), ('tag', tag.id)]
+        )
+
+    def test_expired_tombstones_move_horizon(self):
+        """Test old tombstones are dropped behind the user's horizon"""
+        movie = sample_movie(self.user)
+        movie.delete()
+        tombstone = Change.objects.get(action=Change.ACTION_DELETE)
+        Change.objects.filter(seq=tombstone.seq).update(
+            created=timezone.now() - datetime.timedelta(days=40))
+        call_command('compact_changes', days=30, stdout=io.StringIO())
+        self.assertFalse(Change.objects.exists())
+        self.assertEqual(ChangeHorizon.objects.get(user=self.user).seq,
+                         tombstone.seq)
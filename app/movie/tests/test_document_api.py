@@ -0,0 +1,170 @@
+import io
+import json
+import datetime
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Tag, Cast, Movie, MovieDocument
+
+
+def sample_movie(user, **params):
+    """Create and return a movie"""
+    defaults = {
+        'title': 'Heat',
+        'duration': datetime.timedelta(hours=2, minutes=50),
+        'price': 5.99
+    }
+    defaults.update(params)
+    return Movie.objects.create(user=user, **defaults)
+
+
+def detail_url(movie_id):
+    """Returns the detail URL of a movie"""
+    return reverse('movie:movie-detail', args=[movie_id])
+
+
+@override_settings(MOVIE_DOCUMENTS=True)
+class PrivateMovieDocumentApiTests(TestCase):
+    """Tests for the movie details served from stored documents"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.crime = Tag.objects.create(user=self.user, name='Crime')
+        self.pacino = Cast.objects.create(user=self.user, name='Pacino')
+        self.heat = sample_movie(self.user)
+        self.heat.tag.add(self.crime)
+        self.heat.cast.add(self.pacino)
+
+    def assertDocumentCurrent(self, movie):
+        movies = Movie.objects.filter(id=movie.id).prefetch_related(
+            'tag', 'cast')
+        self.assertEqual(
+            bytes(MovieDocument.objects.get(movie_id=movie.id).body),
+            MovieDocument.objects.render(movies)[0]
+        )
+
+    def test_retrieve_reads_one_row(self):
+        """Test the detail is the stored document, read with one query"""
+        with self.assertNumQueries(1):
+            res = self.client.get(detail_url(self.heat.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(res.content), {
+            'id': self.heat.id, 'title': 'Heat', 'url': '',
+            'tag': [{'id': self.crime.id, 'name': 'Crime'}],
+            'cast': [{'id': self.pacino.id, 'name': 'Pacino'}],
+            'duration': '02:50:00', 'price': '5.990',
+        })
+
+    def test_documents_follow_changes(self):
+        """Test documents are rendered again whatever changes the movie"""
+        drama = Tag.objects.create(user=self.user, name='Drama')
+        ronin = sample_movie(self.user, title='Ronin')
+        self.client.patch(detail_url(self.heat.id),
+                          {'title': 'Heat 2', 'tag': [drama.id]})
+        self.assertDocumentCurrent(self.heat)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('movie:movie-membership',
+                                     args=[self.heat.id]),
+                             {'tag_add': [self.crime.id]})
+        self.assertDocumentCurrent(self.heat)
+        self.assertFalse(any('FOR UPDATE' in query['sql']
+                             for query in queries.captured_queries))
+
+        self.crime.movie_set.add(ronin)
+        self.assertDocumentCurrent(ronin)
+        self.crime.refresh_from_db()
+        self.crime.name = 'Heist'
+        self.crime.save()
+        self.assertDocumentCurrent(self.heat)
+        self.assertDocumentCurrent(ronin)
+        self.crime.movie_set.clear()
+        self.assertDocumentCurrent(ronin)
+        drama.delete()
+        self.assertDocumentCurrent(self.heat)
+        self.pacino.delete()
+        self.assertEqual(json.loads(self.client.get(
+            detail_url(self.heat.id)).content)['cast'], [])
+
+        ronin.delete()
+        self.assertFalse(MovieDocument.objects.filter(
+            movie_id=ronin.id).exists())
+
+    def test_only_renames_render(self):
+        """Test a tag is rendered again only when renamed, atomically"""
+        with patch.object(MovieDocument.objects, 'refresh') as refresh:
+            self.crime.save()
+            self.crime.usage_count = 5
+            self.crime.save(update_fields=['usage_count'])
+            refresh.assert_not_called()
+            self.pacino.name = 'Al Pacino'
+            self.pacino.save()
+            refresh.assert_called_once()
+
+        self.crime.name = 'Heist'
+        with patch.object(MovieDocument.objects, 'refresh',
+                          side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.crime.save()
+        self.assertEqual(Tag.objects.get(id=self.crime.id).name, 'Crime')
+
+    def test_missing_document_rendered(self):
+        """Test a movie without a document is rendered like one"""
+        document = self.client.get(detail_url(self.heat.id)).content
+        MovieDocument.objects.all().delete()
+        res = self.client.get(detail_url(self.heat.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, json.loads(document))
+
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        movie = sample_movie(other)
+        res = self.client.get(detail_url(movie.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MOVIE_DOCUMENTS=False)
+    def test_disabled(self):
+        """Test no document is kept unless they are enabled"""
+        MovieDocument.objects.all().delete()
+        sample_movie(self.user, title='Ronin').tag.add(self.crime)
+        res = self.client.get(detail_url(self.heat.id))
+        self.assertEqual(res.data['tag'][0]['usage_count'], 2)
+        self.assertFalse(MovieDocument.objects.exists())
+
+    def test_check_and_repair(self):
+        """Test missing, stale and orphaned documents are found and fixed"""
+        ronin, up = [sample_movie(self.user, title=title)
+                     for title in ('Ronin', 'Up')]
+        MovieDocument.objects.filter(movie_id=ronin.id).delete()
+        MovieDocument.objects.filter(movie_id=up.id).update(body=b'{}')
+        MovieDocument.objects.create(movie_id=up.id + 100,
+                                     user=self.user, body=b'{}')
+
+        with self.assertRaisesRegex(CommandError,
+                                    '1 missing, 1 stale and 1 orphaned'):
+            call_command('check_movie_documents', batch_size=2,
+                         stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('check_movie_documents', repair=True, batch_size=2,
+                     stdout=out)
+        self.assertIn('Checked 3 movies', out.getvalue())
+        for movie in (self.heat, ronin, up):
+            self.assertDocumentCurrent(movie)
+        self.assertEqual(MovieDocument.objects.count(), 3)
+
+        out = io.StringIO()
+        call_command('check_movie_documents', stdout=out)
+        self.assertIn('0 missing, 0 stale and 0 orphaned', out.getvalue())
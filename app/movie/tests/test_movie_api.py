@@ -1,8 +1,14 @@
+import io
 import os
+import csv
+import gzip
+import json
 import tempfile
 from PIL import Image
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
@@ -39,6 +45,9 @@ def sample_movie(user, **params):
 
 
 MOVIE_URL = reverse('movie:movie-list')
+EXPORT_URL = reverse('movie:movie-export')
+BULK_MEMBERSHIP_URL = reverse('movie:movie-bulk-membership')
+BATCH_URL = reverse('movie:movie-batch-retrieve')
 
 
 def detail_url(movie_id):
@@ -46,6 +55,11 @@ def detail_url(movie_id):
     return reverse('movie:movie-detail', args=[movie_id])
 
 
+def membership_url(movie_id):
+    """Returns the membership URL of a movie"""
+    return reverse('movie:movie-membership', args=[movie_id])
+
+
 def image_upload_url(movie_id):
     """Returns an image upload URL"""
     return reverse('movie:movie-upload-image', args=[movie_id])
@@ -191,6 +205,62 @@ class PrivateApiMovieTests(TestCase):
         tags = movie.tag.all()
         self.assertEqual(len(tags), 0)
 
+    def test_create_movie_rejects_unknown_tags(self):
+        """Test tags of other users and unknown ids are all reported"""
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        own = sample_tag(user=self.user)
+        foreign = sample_tag(user=other, name='Drama')
+        payload = {
+            'title': 'House',
+            'duration': datetime.timedelta(minutes=40),
+            'price': 8.99,
+            'tag': [own.id, foreign.id, foreign.id + 100]
+        }
+        res = self.client.post(MOVIE_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str([foreign.id, foreign.id + 100]),
+                      str(res.data['tag'][0]))
+        self.assertFalse(Movie.objects.exists())
+
+    def test_create_movie_rejects_malformed_tags(self):
+        """Test only integers and digit strings are taken as tag ids"""
+        tag = sample_tag(user=self.user)
+        payload = {'title': 'House', 'duration': '00:40:00',
+                   'price': '8.99', 'cast': []}
+        for value, data_type in ((tag.id + 0.5, 'float'),
+                                 (f'{tag.id}.0', 'str'), (True, 'bool'),
+                                 (f' {tag.id}', 'str'), ([tag.id], 'list')):
+            res = self.client.post(MOVIE_URL, dict(payload, tag=[value]),
+                                   format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(f'received {data_type}', res.data['tag'][0])
+        res = self.client.post(MOVIE_URL, dict(payload, tag=[str(tag.id)]),
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['tag'], [tag.id])
+
+    def test_create_movie_queries_independent_of_tags(self):
+        """Test validating more tags and casts costs no extra queries"""
+        def create(count):
+            tags = [sample_tag(user=self.user, name=f'Tag {i}')
+                    for i in range(count)]
+            casts = [sample_cast(user=self.user, name=f'Cast {i}')
+                     for i in range(count)]
+            payload = {
+                'title': 'House',
+                'duration': datetime.timedelta(minutes=40),
+                'price': 8.99,
+                'tag': [tag.id for tag in tags],
+                'cast': [cast.id for cast in casts],
+            }
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(MOVIE_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(create(1), create(10))
+
 
 class PrivateImageUploadTests(TestCase):
     """Class for testing image uploading functionality"""
@@ -225,6 +295,26 @@ class PrivateImageUploadTests(TestCase):
         res = self.client.post(url, {'image': 'lol'}, format='multipart')
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_upload_oversized_image(self):
+        """Test large posters are stored downscaled and bombs refused"""
+        url = image_upload_url(self.movie.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('1', (10000, 10000)).save(ntf, format='PNG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pixels', res.data['image'][0])
+
+        with tempfile.NamedTemporaryFile(suffix='.jpeg') as ntf:
+            Image.new('RGB', (4000, 3000)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.movie.refresh_from_db()
+        self.assertTrue(self.movie.image.name.endswith('.jpg'))
+        with Image.open(self.movie.image.path) as image:
+            self.assertEqual(image.size, (2000, 1500))
+
     def test_filtering_movies_tags(self):
         """Test for returning movies with specific Tags"""
         movie_1 = sample_movie(user=self.user, title='MindHunter')
@@ -260,3 +350,443 @@ class PrivateImageUploadTests(TestCase):
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
+
+
+class PrivateMovieExportTests(TestCase):
+    """Tests for streaming the movie catalog export"""
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movie = sample_movie(user=self.user, title='Se7en')
+        self.movie.tag.add(sample_tag(user=self.user, name='Crime'))
+        self.movie.cast.add(sample_cast(user=self.user, name='Brad Pitt'))
+        sample_movie(user=self.user, title='Up')
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        sample_movie(user=other, title='Hidden')
+
+    def test_export_jsonl(self):
+        """Test the export streams the user's movies with names"""
+        res = self.client.get(EXPORT_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in
+                b''.join(res.streaming_content).decode().splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Up', 'Se7en'])
+        self.assertEqual(rows[1]['tag'], ['Crime'])
+        self.assertEqual(rows[1]['cast'], ['Brad Pitt'])
+        self.assertEqual(rows[1]['duration'], '02:15:00')
+
+    def test_export_csv(self):
+        """Test the export writes a CSV with joined names"""
+        res = self.client.get(EXPORT_URL, {'output': 'csv'})
+        content = b''.join(res.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]['tag'], 'Crime')
+        self.assertEqual(rows[1]['price'], '8.990')
+
+    def test_export_gzip(self):
+        """Test the export is compressed when the client accepts gzip"""
+        res = self.client.get(EXPORT_URL, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res['Vary'])
+        content = gzip.decompress(b''.join(res.streaming_content))
+        self.assertEqual(len(content.decode().splitlines()), 2)
+
+        res = self.client.get(EXPORT_URL,
+                              HTTP_ACCEPT_ENCODING='br, gzip; q=0.5')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        for refused in ('gzip;q=0', 'identity, gzip; q=0.0', 'x-gzip'):
+            res = self.client.get(EXPORT_URL, HTTP_ACCEPT_ENCODING=refused)
+            self.assertFalse(res.has_header('Content-Encoding'))
+            self.assertIn('Accept-Encoding', res['Vary'])
+
+    def test_export_invalid_output(self):
+        """Test unknown export formats are rejected"""
+        res = self.client.get(EXPORT_URL, {'output': 'xml'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PrivateMovieMembershipTests(TestCase):
+    """Tests for adding and removing tags and casts of movies"""
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movie = sample_movie(user=self.user)
+        self.crime = sample_tag(user=self.user, name='Crime')
+        self.drama = sample_tag(user=self.user, name='Drama')
+        self.cast = sample_cast(user=self.user)
+
+    def test_membership_delta(self):
+        """Test tags and casts are added and removed without a full list"""
+        self.movie.tag.add(self.crime)
+        payload = {'tag_add': [self.crime.id, self.drama.id],
+                   'cast_add': [self.cast.id],
+                   'tag_remove': []}
+        res = self.client.post(membership_url(self.movie.id), payload,
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'tag_add': 1, 'tag_remove': 0,
+                                    'cast_add': 1, 'cast_remove': 0})
+        self.assertEqual(set(self.movie.tag.all()), {self.crime, self.drama})
+        self.assertEqual(list(self.movie.cast.all()), [self.cast])
+
+        res = self.client.post(membership_url(self.movie.id),
+                               {'tag_remove': [self.crime.id]})
+        self.assertEqual(res.data['tag_remove'], 1)
+        self.assertEqual(list(self.movie.tag.all()), [self.drama])
+        self.crime.refresh_from_db()
+        self.drama.refresh_from_db()
+        self.assertEqual((self.crime.usage_count, self.drama.usage_count),
+                         (0, 1))
+
+    def test_membership_rejects_other_users(self):
+        """Test another user's movies and tags cannot be changed"""
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        foreign_tag = sample_tag(user=other, name='Hidden')
+        res = self.client.post(membership_url(self.movie.id),
+                               {'tag_add': [foreign_tag.id]})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        foreign_movie = sample_movie(user=other)
+        res = self.client.post(membership_url(foreign_movie.id),
+                               {'tag_add': [self.crime.id]})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Movie.tag.through.objects.exists())
+
+    def test_membership_add_and_remove_conflict(self):
+        """Test the same id cannot be added and removed at once"""
+        res = self.client.post(membership_url(self.movie.id), {
+            'tag_add': [self.crime.id], 'tag_remove': [self.crime.id]})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tag_remove', res.data)
+
+    def test_bulk_membership(self):
+        """Test tags are added to and removed from many movies at once"""
+        movies = [self.movie] + [sample_movie(user=self.user, title=title)
+                                 for title in ('Heat', 'Ronin')]
+        movies[0].tag.add(self.drama)
+        res = self.client.post(BULK_MEMBERSHIP_URL, {
+            'movies': [movie.id for movie in movies],
+            'tag_add': [self.crime.id],
+            'tag_remove': [self.drama.id],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tag_add'], 3)
+        self.assertEqual(res.data['tag_remove'], 1)
+        for movie in movies:
+            self.assertEqual(list(movie.tag.all()), [self.crime])
+        self.crime.refresh_from_db()
+        self.assertEqual(self.crime.usage_count, 3)
+
+    def test_bulk_membership_queries_independent_of_movies(self):
+        """Test the bulk form costs the same queries for more movies"""
+        def change(count):
+            movies = [sample_movie(user=self.user) for _ in range(count)]
+            payload = {'movies': [movie.id for movie in movies],
+                       'tag_add': [self.crime.id, self.drama.id]}
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(BULK_MEMBERSHIP_URL, payload,
+                                       format='json')
+            self.assertEqual(res.data['tag_add'], count * 2)
+            return len(queries)
+
+        self.assertEqual(change(1), change(10))
+
+
+class PrivateMovieBatchRetrieveTests(TestCase):
+    """Tests for fetching several movies by id"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, ids):
+        return self.client.get(BATCH_URL,
+                               {'ids': ','.join(str(i) for i in ids)})
+
+    def test_batch_in_requested_order(self):
+        """Test details are returned in order with missing ids reported"""
+        first = sample_movie(self.user, title='Heat')
+        second = sample_movie(self.user, title='Ronin')
+        second.tag.add(sample_tag(self.user))
+        second.cast.add(sample_cast(self.user))
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        foreign = sample_movie(other)
+        res = self.batch([second.id, foreign.id, first.id, 0, second.id])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data['results'],
+            MovieDetailSerializer([second, first], many=True).data
+        )
+        self.assertEqual(res.data['missing'], [foreign.id, 0])
+
+    def test_batch_queries_independent_of_ids(self):
+        """Test the batch costs the same queries for more movies"""
+        tag = sample_tag(self.user)
+
+        def fetch(count):
+            movies = [sample_movie(self.user) for _ in range(count)]
+            for movie in movies:
+                movie.tag.add(tag)
+            with CaptureQueriesContext(connection) as queries:
+                res = self.batch([movie.id for movie in movies])
+            self.assertEqual(len(res.data['results']), count)
+            return len(queries)
+
+        self.assertEqual(fetch(1), fetch(20))
+
+    def test_batch_invalid_ids(self):
+        """Test malformed and too many ids are rejected"""
+        res = self.batch(['x'])
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(BATCH_URL)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.batch(range(1, 502))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PrivateMovieIncludeTests(TestCase):
+    """Tests for expanding the relations of the movie list"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.crime = sample_tag(self.user, name='Crime')
+        self.pacino = sample_cast(self.user, name='Pacino')
+        self.movies = [sample_movie(self.user) for _ in range(2)]
+        for movie in self.movies:
+            movie.tag.add(self.crime)
+            movie.cast.add(self.pacino)
+
+    def test_include_inlines_relations(self):
+        """Test included relations are nested like the detail view"""
+        res = self.client.get(MOVIE_URL, {'include': 'tag,cast'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, MovieDetailSerializer(
+            reversed(self.movies), many=True).data)
+        res = self.client.get(MOVIE_URL, {'include': 'cast'})
+        self.assertEqual(res.data[0]['tag'], [self.crime.id])
+        self.assertEqual(res.data[0]['cast'][0]['name'], 'Pacino')
+
+    def test_include_sideloads_relations_once(self):
+        """Test sideloaded relations are listed once beside the ids"""
+        res = self.client.get(MOVIE_URL, {'include': 'tag,cast',
+                                          'sideload': 1})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], MovieSerializer(
+            reversed(self.movies), many=True).data)
+        self.assertEqual([tag['name'] for tag in res.data['included']['tag']],
+                         ['Crime'])
+        self.assertEqual(len(res.data['included']['cast']), 1)
+
+        res = self.client.get(MOVIE_URL, {'include': 'tag',
+                                          'sideload': 'true'})
+        self.assertIn('included', res.data)
+        res = self.client.get(MOVIE_URL, {'include': 'tag',
+                                          'sideload': 'false'})
+        self.assertNotIn('included', res.data)
+        res = self.client.get(MOVIE_URL, {'include': 'tag',
+                                          'sideload': 'maybe'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sideload', res.data)
+
+    def test_include_queries_independent_of_movies(self):
+        """Test each included relation costs one query"""
+        def listing(params):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(MOVIE_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        params = {'include': 'tag,cast'}
+        few = listing(params), listing(dict(params, sideload=1))
+        for _ in range(5):
+            sample_movie(self.user).tag.add(self.crime)
+        self.assertEqual(
+            (listing(params), listing(dict(params, sideload=1))), few)
+
+    def test_include_unknown_relation(self):
+        """Test unknown relations are rejected"""
+        res = self.client.get(MOVIE_URL, {'include': 'tag,user'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def query_plan(sql):
+    """Returns the index scans and sorts of a query's plan"""
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+        plan = cursor.fetchone()[0]
+        cursor.execute('SET LOCAL enable_seqscan = on')
+    indexes, sorts = set(), 0
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if 'Index Name' in node:
+            indexes.add(node['Index Name'])
+        sorts += node['Node Type'] in ('Sort', 'Incremental Sort')
+        nodes.extend(node.get('Plans', []))
+    return indexes, sorts
+
+
+class PrivateMovieListQueryTests(TestCase):
+    """Tests for filtering, ordering and paging the movie list"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.movies = [
+            sample_movie(self.user, title=title,
+                         duration=datetime.timedelta(minutes=minutes),
+                         price=price)
+            for title, minutes, price in (
+                ('Heat', 170, '5.990'), ('Alien', 117, '3.500'),
+                ('Up', 96, '3.500'), ('heathers', 103, '2.000'),
+                ('Ronin', 122, '9.000'))
+        ]
+
+    def titles(self, params):
+        res = self.client.get(MOVIE_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [movie['title'] for movie in res.data]
+
+    def test_range_and_prefix_filters(self):
+        """Test movies are filtered by duration, price and title prefix"""
+        self.assertEqual(
+            self.titles({'duration_max': '01:45:00', 'ordering': 'title'}),
+            ['Up', 'heathers'])
+        self.assertEqual(
+            self.titles({'price_min': '3.5', 'price_max': '6',
+                         'ordering': 'price'}),
+            ['Alien', 'Up', 'Heat'])
+        self.assertEqual(self.titles({'title': 'HEAT', 'ordering': 'id'}),
+                         ['Heat', 'heathers'])
+        self.assertEqual(self.titles({'duration_min': 7200,
+                                      'ordering': '-duration'}),
+                         ['Heat', 'Ronin'])
+
+    def test_invalid_query_rejected(self):
+        """Test malformed filters and unknown orderings are rejected"""
+        for params in ({'price_min': 'cheap'}, {'ordering': 'url'},
+                       {'limit': 0}, {'limit': 2, 'cursor': 'x'}):
+            res = self.client.get(MOVIE_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_keyset_pages(self):
+        """Test pages follow each other without gaps or repeats"""
+        for ordering in ('price', '-price', 'title', '-duration', '-id'):
+            seen = []
+            params = {'ordering': ordering, 'limit': 2}
+            while True:
+                res = self.client.get(MOVIE_URL, params)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                seen += [movie['title'] for movie in res.data['results']]
+                if res.data['next'] is None:
+                    break
+                params['cursor'] = res.data['next']
+            self.assertEqual(seen, self.titles({'ordering': ordering}))
+        res = self.client.get(MOVIE_URL, {'ordering': 'title', 'limit': 2})
+        res = self.client.get(MOVIE_URL, {'ordering': 'price', 'limit': 2,
+                                          'cursor': res.data['next']})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_queries_use_user_indexes(self):
+        """Test each filter and ordering is served by an index in order"""
+        cases = (
+            ({'limit': 10}, 'core_movie_user_id_d6ee04_idx'),
+            ({'ordering': 'title', 'limit': 10},
+             'core_movie_user_id_f49da6_idx'),
+            ({'ordering': '-price', 'price_max': 5, 'limit': 10},
+             'core_movie_user_id_778322_idx'),
+            ({'ordering': 'duration', 'duration_min': 60, 'limit': 2,
+              'cursor': self.client.get(MOVIE_URL, {
+                  'ordering': 'duration', 'limit': 2}).data['next']},
+             'core_movie_user_id_9458f7_idx'),
+            ({'title': 'heat'}, 'core_movie_user_title_prefix'),
+        )
+        # Enough rows for a selective user and prefix to be looked up
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        Movie.objects.bulk_create([
+            Movie(user=user, title=f'Movie {i}', price=1,
+                  duration=datetime.timedelta(minutes=90))
+            for user, count in ((self.user, 300), (other, 1500))
+            for i in range(count)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_movie')
+        for params, index in cases:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(MOVIE_URL, params)
+            sql = next(query['sql'] for query in queries.captured_queries
+                       if query['sql'].startswith('SELECT') and
+                       'FROM "core_movie"' in query['sql'])
+            indexes, sorts = query_plan(sql)
+            self.assertIn(index, indexes, params)
+            if 'title' not in params:
+                self.assertEqual(sorts, 0, params)
+
+
+class PrivateMovieFacetTests(TestCase):
+    """Tests for the tag and cast counts of the filtered movie list"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.crime = sample_tag(self.user, name='Crime')
+        self.drama = sample_tag(self.user, name='Drama')
+        self.pacino = sample_cast(self.user, name='Pacino')
+        heat, ronin, up = [sample_movie(self.user) for _ in range(3)]
+        heat.tag.add(self.crime, self.drama)
+        heat.cast.add(self.pacino)
+        ronin.tag.add(self.crime)
+        up.tag.add(self.drama)
+
+    def test_facets_of_filtered_movies(self):
+        """Test tags and casts are counted over the matching movies"""
+        res = self.client.get(MOVIE_URL, {'tag': self.crime.id,
+                                          'facets': 'tag,cast'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertEqual(res.data['facets'], {
+            'tag': [{'id': self.crime.id, 'name': 'Crime', 'count': 2},
+                    {'id': self.drama.id, 'name': 'Drama', 'count': 1}],
+            'cast': [{'id': self.pacino.id, 'name': 'Pacino', 'count': 1}],
+        })
+
+    def test_facets_cover_every_page(self):
+        """Test facets count all matches, not only the returned page"""
+        res = self.client.get(MOVIE_URL, {'facets': 'tag', 'limit': 1})
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual([tag['count'] for tag in res.data['facets']['tag']],
+                         [2, 2])
+
+    def test_facets_one_query_each(self):
+        """Test each facet costs one query whatever the number of movies"""
+        def listing():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(MOVIE_URL, {'facets': 'tag,cast',
+                                            'limit': 1})
+            return len(queries)
+
+        few = listing()
+        for _ in range(5):
+            sample_movie(self.user).tag.add(self.crime)
+        self.assertEqual(listing(), few)
+        res = self.client.get(MOVIE_URL, {'facets': 'genre'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,144 @@
+import io
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core.models import Tag, Cast, Movie, SimilarMovie
+
+
+def sample_movie(user, **params):
+    """Create and return a movie"""
+    defaults = {
+        'title': 'Heat',
+        'duration': datetime.timedelta(hours=2, minutes=50),
+        'price': 5.99
+    }
+    defaults.update(params)
+    return Movie.objects.create(user=user, **defaults)
+
+
+def similar_url(movie_id):
+    """Returns the similar movies URL of a movie"""
+    return reverse('movie:movie-similar', args=[movie_id])
+
+
+def stored_similar():
+    """Returns the stored similar movies as (movie, similar, score)"""
+    return sorted(SimilarMovie.objects.values_list(
+        'movie_id', 'similar_id', 'score'))
+
+
+class PrivateSimilarMovieApiTests(TestCase):
+    """Tests for the similar movies of an authenticated user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.crime = Tag.objects.create(user=self.user, name='Crime')
+        self.drama = Tag.objects.create(user=self.user, name='Drama')
+        self.pacino = Cast.objects.create(user=self.user, name='Pacino')
+        self.heat, self.ronin, self.up = [
+            sample_movie(self.user, title=title)
+            for title in ('Heat', 'Ronin', 'Up')]
+        self.heat.tag.add(self.crime, self.drama)
+        self.heat.cast.add(self.pacino)
+        self.ronin.tag.add(self.crime)
+        self.ronin.cast.add(self.pacino)
+        self.up.tag.add(self.drama)
+
+    def similar(self, movie, **params):
+        res = self.client.get(similar_url(movie.id), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [(item['title'], item['score']) for item in res.data]
+
+    def test_similar_ranked_by_overlap(self):
+        """Test movies are ranked by the tags and casts they share"""
+        self.assertEqual(self.similar(self.heat),
+                         [('Ronin', 2), ('Up', 1)])
+        self.assertEqual(self.similar(self.ronin), [('Heat', 2)])
+        self.assertEqual(self.similar(self.heat, limit=1), [('Ronin', 2)])
+        res = self.client.get(similar_url(self.heat.id), {'limit': 0})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_similar_updated_incrementally(self):
+        """Test removals, reverse adds and clears update both sides"""
+        self.heat.cast.remove(self.pacino)
+        self.assertEqual(self.similar(self.ronin), [('Heat', 1)])
+        self.drama.movie_set.add(self.ronin)
+        self.assertEqual(self.similar(self.up),
+                         [('Heat', 1), ('Ronin', 1)])
+        self.heat.tag.clear()
+        self.assertEqual(self.similar(self.heat), [])
+        self.assertEqual(self.similar(self.up), [('Ronin', 1)])
+        self.assertEqual(self.similar(self.ronin), [('Up', 1)])
+
+    def test_similar_updated_by_deletes(self):
+        """Test deleting a tag or cast rescores the movies it joined"""
+        self.drama.delete()
+        self.assertEqual(self.similar(self.heat), [('Ronin', 2)])
+        self.assertEqual(self.similar(self.up), [])
+        Cast.objects.filter(id=self.pacino.id).delete()
+        self.assertEqual(self.similar(self.ronin), [('Heat', 1)])
+        incremental = stored_similar()
+        call_command('rebuild_similar_movies', stdout=io.StringIO())
+        self.assertEqual(stored_similar(), incremental)
+
+    def test_similar_updated_by_membership_endpoint(self):
+        """Test the delta membership endpoints update similar movies"""
+        res = self.client.post(
+            reverse('movie:movie-membership', args=[self.up.id]),
+            {'tag_add': [self.crime.id], 'cast_add': [self.pacino.id]})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.similar(self.ronin),
+                         [('Heat', 2), ('Up', 2)])
+        self.assertEqual(self.similar(self.up),
+                         [('Heat', 3), ('Ronin', 2)])
+
+    def test_similar_limited_to_user(self):
+        """Test other users' movies are never similar"""
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        tag = Tag.objects.create(user=other, name='Crime')
+        sample_movie(other).tag.add(tag)
+        self.assertEqual(self.similar(self.heat),
+                         [('Ronin', 2), ('Up', 1)])
+        res = APIClient().get(similar_url(self.heat.id))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(SIMILAR_MOVIES_TOP_K=1, SIMILAR_MOVIES_MAX_USAGE=2)
+    def test_rebuild_bounded(self):
+        """Test the rebuild keeps the top k and skips common tags"""
+        common = Tag.objects.create(user=self.user, name='Common')
+        for movie in (self.heat, self.ronin, self.up):
+            movie.tag.add(common)
+        SimilarMovie.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_similar_movies', batch_size=2, stdout=out)
+        self.assertIn('3 movies', out.getvalue())
+        self.assertEqual(stored_similar(), [
+            (self.heat.id, self.ronin.id, 2),
+            (self.ronin.id, self.heat.id, 2),
+            (self.up.id, self.heat.id, 1),
+        ])
+
+    def test_rebuild_matches_incremental(self):
+        """Test a rebuild agrees with the incrementally kept lists"""
+        self.ronin.tag.add(self.drama)
+        self.up.cast.add(self.pacino)
+        self.pacino.movie_set.remove(self.heat)
+        incremental = stored_similar()
+        call_command('rebuild_similar_movies', user=['test@test.com'],
+                     stdout=io.StringIO())
+        self.assertEqual(stored_similar(), incremental)
+        ronin_id = self.ronin.id
+        self.ronin.delete()
+        self.assertFalse(SimilarMovie.objects.filter(
+            similar_id=ronin_id).exists())
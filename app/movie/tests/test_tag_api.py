@@ -92,6 +92,7 @@ class PrivateApiTagTests(TestCase):
         )
         movie.tag.add(tag1)
         res = self.client.get(TAG_URL, {'assigned_only': 1})
+        tag1.refresh_from_db()
         serializer1 = TagSerializer(tag1)
         serializer2 = TagSerializer(tag2)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -120,3 +121,24 @@ class PrivateApiTagTests(TestCase):
         res = self.client.get(TAG_URL, {'assigned_only': 1})
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]['usage_count'], 2)
+
+    def test_tags_ordered_by_usage(self):
+        """Test tags can be ordered by the number of movies using them"""
+        tag1 = Tag.objects.create(user=self.user, name='Action')
+        tag2 = Tag.objects.create(user=self.user, name='Drama')
+        Tag.objects.create(user=self.user, name='Western')
+        for title in ('Heat', 'Ronin'):
+            movie = Movie.objects.create(
+                user=self.user,
+                title=title,
+                duration=datetime.timedelta(hours=2),
+                price=5.00
+            )
+            movie.tag.add(tag1)
+        movie.tag.add(tag2)
+
+        res = self.client.get(TAG_URL, {'ordering': 'usage'})
+        self.assertEqual([(tag['name'], tag['usage_count'])
+                          for tag in res.data],
+                         [('Action', 2), ('Drama', 1), ('Western', 0)])
@@ -0,0 +1,116 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from core import counters
+from core.models import Tag, Movie, ViewCount
+
+
+TRENDING_URL = reverse('movie:movie-trending')
+
+
+def sample_movie(user, **params):
+    """Create and return a movie"""
+    defaults = {
+        'title': 'Heat',
+        'duration': datetime.timedelta(hours=2, minutes=50),
+        'price': 5.99
+    }
+    defaults.update(params)
+    return Movie.objects.create(user=user, **defaults)
+
+
+def play_url(movie_id):
+    """Returns the play URL of a movie"""
+    return reverse('movie:movie-play', args=[movie_id])
+
+
+class PrivateTrendingMovieApiTests(TestCase):
+    """Tests for the view counters and trending movies of a user"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('test@test.com',
+                                                         'password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.heat, self.ronin, self.up = [
+            sample_movie(self.user, title=title)
+            for title in ('Heat', 'Ronin', 'Up')]
+        self.now = timezone.now()
+        counters.buffer.counts.clear()
+
+    def count(self, movie, hours_ago, views=0, plays=0):
+        ViewCount.objects.create(
+            user=movie.user, movie=movie, views=views, plays=plays,
+            bucket=ViewCount.bucket_of(
+                self.now - datetime.timedelta(hours=hours_ago)))
+
+    def test_views_and_plays_counted(self):
+        """Test details and plays are counted once written back"""
+        self.client.get(reverse('movie:movie-detail', args=[self.heat.id]))
+        res = self.client.post(play_url(self.heat.id))
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.client.post(play_url(self.ronin.id))
+        self.assertFalse(ViewCount.objects.exists())
+
+        counters.buffer.flush()
+        self.assertEqual(
+            list(ViewCount.objects.order_by('movie_id').values_list(
+                'movie_id', 'views', 'plays')),
+            [(self.heat.id, 1, 1), (self.ronin.id, 0, 1)]
+        )
+
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        res = self.client.post(play_url(sample_movie(other).id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_trending_decays_with_age(self):
+        """Test recent counts outweigh older ones within the window"""
+        tag = Tag.objects.create(user=self.user, name='Crime')
+        self.ronin.tag.add(tag)
+        self.count(self.heat, 48, views=10)
+        self.count(self.ronin, 0, views=1, plays=1)
+        self.count(self.ronin, 24, views=2)
+        self.count(self.up, 24 * 8, views=100)
+        other = get_user_model().objects.create_user('other@test.com',
+                                                     'password123')
+        self.count(sample_movie(other), 0, views=100)
+
+        with self.assertNumQueries(4):
+            res = self.client.get(TRENDING_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['title'] for item in res.data],
+                         ['Ronin', 'Heat'])
+        self.assertEqual(res.data[0]['tag'], [tag.id])
+        # The counts are weighed from the start of their hour
+        minutes = (self.now - ViewCount.bucket_of(self.now)).seconds / 60
+        decay = 0.5 ** (minutes / 60 / 24)
+        self.assertAlmostEqual(res.data[0]['score'], 5 * decay, places=2)
+        self.assertAlmostEqual(res.data[1]['score'], 2.5 * decay, places=2)
+
+        res = self.client.get(TRENDING_URL, {'limit': 1})
+        self.assertEqual([item['title'] for item in res.data], ['Ronin'])
+        res = self.client.get(TRENDING_URL, {'limit': 101})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(TRENDING_URL, {'limit': 'ten'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('limit', res.data)
+
+    def test_trending_filtered_before_limit(self):
+        """Test the limit applies to the movies matching the filters"""
+        tag = Tag.objects.create(user=self.user, name='Crime')
+        self.ronin.tag.add(tag)
+        self.count(self.heat, 0, views=10)
+        self.count(self.up, 0, views=5)
+        self.count(self.ronin, 0, views=1)
+
+        res = self.client.get(TRENDING_URL, {'tag': tag.id, 'limit': 1})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['title'] for item in res.data], ['Ronin'])
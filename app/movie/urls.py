@@ -2,7 +2,8 @@ from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
-from .views import TagApiViewSet, CastApiViewSet, MovieApiViewSet
+from .views import TagApiViewSet, CastApiViewSet, MovieApiViewSet,\
+    ChangeFeedView
 
 router = DefaultRouter()
 router.register('tags', TagApiViewSet)
@@ -12,5 +13,6 @@ router.register('movies', MovieApiViewSet)
 app_name = 'movie'
 
 urlpatterns = [
+    path('changes/', ChangeFeedView.as_view(), name='changes'),
     path('', include(router.urls))
 ]
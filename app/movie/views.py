@@ -1,32 +1,57 @@
+import io
+import csv
+import json
+import itertools
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.duration import duration_string
+from django.utils.text import compress_sequence
+
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework import mixins, status
+from rest_framework import mixins, serializers, status, views
 from rest_framework.authentication import TokenAuthentication
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
-from core.models import Tag, Cast, Movie
+from rest_framework.renderers import JSONRenderer
+from batch.authentication import BatchAuthentication
+from core import counters
+from core.models import Tag, Cast, Movie, Change, ChangeHorizon,\
+    SimilarMovie, MovieDocument, ViewCount
 
 from .serializers import CastSerializer, TagSerializer,\
-    MovieSerializer, MovieDetailSerializer, MovieImageSerializer
+    MovieSerializer, MovieDetailSerializer, MovieDocumentSerializer,\
+    MovieImageSerializer, MovieMembershipSerializer,\
+    BulkMovieMembershipSerializer,\
+    ChangeSerializer, ChangeQuerySerializer, MovieQuerySerializer,\
+    TrendingQuerySerializer, NESTED_SERIALIZERS,\
+    expanded_movie_serializer
 from rest_framework.parsers import FormParser, MultiPartParser, JSONParser
 
 
 class BaseMovieAttrViewSet(viewsets.GenericViewSet, mixins.ListModelMixin,
                            mixins.CreateModelMixin):
     """Manages the attributes of movie in the database"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (TokenAuthentication, BatchAuthentication)
     permission_classes = (IsAuthenticated,)
+    replica_actions = ('list',)
 
     def get_queryset(self):
         """Returns objects for authenticated user only"""
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
-        queryset = self.queryset
+        queryset = self.queryset.filter(user=self.request.user)
         if assigned_only:
-            queryset = queryset.filter(movie__isnull=False)
-        return queryset.filter(
-            user=self.request.user).order_by('-name').distinct()
+            queryset = queryset.filter(usage_count__gt=0)
+        if self.request.query_params.get('ordering') == 'usage':
+            return queryset.order_by('-usage_count', '-name')
+        return queryset.order_by('-name')
 
     def perform_create(self, serializer):
         """Creates objects of attribute"""
@@ -51,14 +76,63 @@ class CastApiViewSet(BaseMovieAttrViewSet):
 class MovieApiViewSet(viewsets.ModelViewSet):
     serializer_class = MovieSerializer
     queryset = Movie.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (TokenAuthentication, BatchAuthentication)
     permission_classes = (IsAuthenticated,)
     parser_classes = (FormParser, MultiPartParser, JSONParser)
+    replica_actions = ('list', 'retrieve', 'batch_retrieve', 'similar',
+                       'trending')
+    low_priority_actions = ('list', 'export', 'upload_image',
+                            'batch_retrieve', 'bulk_membership')
+    batch_max_ids = 500
+    export_chunk_size = 2000
+    export_fields = ('id', 'title', 'url', 'duration', 'price', 'tag',
+                     'cast')
 
     def _params_to_int(self, qs):
         """Returns a string format of id to a list format"""
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _relations(self, param):
+        """Returns the relations listed in a query parameter of the list"""
+        value = self.request.query_params.get(param)
+        if self.action != 'list' or not value:
+            return []
+        fields = list(dict.fromkeys(value.split(',')))
+        unknown = [field for field in fields
+                   if field not in NESTED_SERIALIZERS]
+        if unknown:
+            raise serializers.ValidationError({param: [
+                f'Unknown relations {unknown}, expected tag or cast.']})
+        return fields
+
+    def _includes(self):
+        """Returns the relations to expand on the list"""
+        return self._relations('include')
+
+    def _facets(self, queryset, fields):
+        """Returns the movies of the list per tag and per cast
+
+        Each relation is counted in one grouped query over the through
+        table, restricted to the movies matching the filters.
+        """
+        movie_ids = queryset.order_by().values('id')
+        facets = {}
+        for field in fields:
+            through = getattr(Movie, field).through
+            facets[field] = [
+                {'id': row[f'{field}_id'], 'name': row[f'{field}__name'],
+                 'count': row['count']}
+                for row in through.objects.filter(
+                    movie_id__in=movie_ids
+                ).values(f'{field}_id', f'{field}__name').annotate(
+                    count=Count('id')
+                ).order_by('-count', f'{field}__name')
+            ]
+        return facets
+
+    def _sideload(self):
+        return self._query()['sideload']
+
     def get_queryset(self):
         """Returns objects for authenticated user"""
         tag = self.request.query_params.get('tag')
@@ -70,20 +144,141 @@ class MovieApiViewSet(viewsets.ModelViewSet):
         if cast:
             cast_ids = self._params_to_int(cast)
             queryset = queryset.filter(cast__id__in=cast_ids)
+        includes = self._includes()
+        if includes:
+            queryset = queryset.prefetch_related(*includes)
+        queryset = queryset.filter(user=self.request.user)
+        if self.action not in ('list', 'export'):
+            return queryset.order_by('-id')
 
-        return queryset.filter(user=self.request.user).order_by('-id')
+        query = self._query()
+        for name, lookup in (('duration_min', 'duration__gte'),
+                             ('duration_max', 'duration__lte'),
+                             ('price_min', 'price__gte'),
+                             ('price_max', 'price__lte'),
+                             ('title', 'title__istartswith')):
+            if name in query:
+                queryset = queryset.filter(**{lookup: query[name]})
+        # The id breaks ties in the direction of the ordering, so every
+        # ordering is served by one of the (user, field, id) indexes and
+        # pages stably
+        ordering = query['ordering']
+        sign = '-' if ordering.startswith('-') else ''
+        return queryset.order_by(*dict.fromkeys((ordering, f'{sign}id')))
+
+    def _query(self):
+        """Returns the validated filters, ordering and page of the list"""
+        if not hasattr(self, '_validated_query'):
+            serializer = MovieQuerySerializer(data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._validated_query = serializer.validated_data
+        return self._validated_query
+
+    def _keyset_page(self, queryset):
+        """Returns a page of movies after the cursor and the next cursor"""
+        query = self._query()
+        ordering = query['ordering']
+        if 'after' in query:
+            field = Movie._meta.get_field(ordering.lstrip('-'))
+            table = Movie._meta.db_table
+            operator = '<' if ordering.startswith('-') else '>'
+            value, movie_id = query['after']
+            if field.name == 'id':
+                where, params = f'{table}.id {operator} %s', [movie_id]
+            else:
+                where = f'({table}.{field.column}, {table}.id) ' \
+                    f'{operator} (%s, %s)'
+                params = [value, movie_id]
+            queryset = queryset.extra(where=[where], params=params)
+        movies = list(queryset[:query['limit'] + 1])
+        if len(movies) <= query['limit']:
+            return movies, None
+        movies = movies[:query['limit']]
+        return movies, MovieQuerySerializer.encode_cursor(ordering,
+                                                          movies[-1])
 
     def get_serializer_class(self):
         """Retrieval of serializer class"""
-        if self.action == 'retrieve':
+        if self.action == 'retrieve' and settings.MOVIE_DOCUMENTS:
+            return MovieDocumentSerializer
+        if self.action in ('retrieve', 'batch_retrieve'):
             return MovieDetailSerializer
         elif self.action == 'upload_image':
             return MovieImageSerializer
+        elif self.action == 'membership':
+            return MovieMembershipSerializer
+        elif self.action == 'bulk_membership':
+            return BulkMovieMembershipSerializer
+        includes = self._includes()
+        if includes and not self._sideload():
+            return expanded_movie_serializer(includes)
         return self.serializer_class
 
+    def list(self, request, *args, **kwargs):
+        """Lists movies, by keyset pages if a limit is given
+
+        Pages, sideloaded relations and facets are returned under results,
+        next to the cursor of the next page, the included relations and
+        the counts of the filtered movies per tag and cast.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        includes = self._includes()
+        sideload = bool(includes) and self._sideload()
+        paginate = 'limit' in self._query()
+        facets = self._relations('facets')
+        if not sideload and not paginate and not facets:
+            return super().list(request, *args, **kwargs)
+        data = {}
+        if facets:
+            data['facets'] = self._facets(queryset, facets)
+        if paginate:
+            movies, data['next'] = self._keyset_page(queryset)
+        else:
+            movies = list(queryset)
+        data['results'] = self.get_serializer(movies, many=True).data
+        if sideload:
+            data['included'] = {}
+            for field in includes:
+                related = {obj.id: obj for movie in movies
+                           for obj in getattr(movie, field).all()}
+                data['included'][field] = NESTED_SERIALIZERS[field](
+                    sorted(related.values(), key=lambda obj: obj.id),
+                    many=True
+                ).data
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Returns a movie, as its stored document when they are enabled
+
+        Every movie returned counts a view.
+        """
+        if settings.MOVIE_DOCUMENTS and \
+                isinstance(request.accepted_renderer, JSONRenderer):
+            try:
+                movie_id = int(kwargs[self.lookup_field])
+            except ValueError:
+                movie_id = None
+            body = MovieDocument.objects.filter(
+                user=request.user, movie_id=movie_id
+            ).values_list('body', flat=True).first()
+            if body is not None:
+                counters.record_view(movie_id)
+                return HttpResponse(bytes(body),
+                                    content_type='application/json')
+        response = super().retrieve(request, *args, **kwargs)
+        counters.record_view(response.data['id'])
+        return response
+
     def perform_create(self, serializer):
         """Creates a movie"""
-        serializer.save(user=self.request.user)
+        # The movie and its tags and casts are saved with their document
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
+
+    def perform_update(self, serializer):
+        """Updates a movie"""
+        with transaction.atomic():
+            serializer.save()
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
@@ -100,3 +295,272 @@ class MovieApiViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(methods=['GET'], detail=False, url_path='batch')
+    def batch_retrieve(self, request):
+        """Returns the detail of several movies in the requested order"""
+        try:
+            ids = self._params_to_int(request.query_params.get('ids', ''))
+        except ValueError:
+            return Response(
+                {'ids': ['Must be a comma separated list of ids']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > self.batch_max_ids:
+            return Response(
+                {'ids': [f'At most {self.batch_max_ids} ids are allowed']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        movies = self.get_queryset().filter(
+            id__in=ids).prefetch_related('tag', 'cast').in_bulk()
+        found = [movies[movie_id] for movie_id in ids if movie_id in movies]
+        return Response({
+            'results': self.get_serializer(found, many=True).data,
+            'missing': [movie_id for movie_id in ids
+                        if movie_id not in movies],
+        })
+
+    @action(methods=['POST'], detail=True, url_path='play')
+    def play(self, request, pk=None):
+        """Counts a play of a movie"""
+        counters.record_play(self.get_object().id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=['GET'], detail=False, url_path='trending')
+    def trending(self, request):
+        """Returns the movies most viewed and played recently"""
+        query = TrendingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        queryset = self.get_queryset()
+        rows = ViewCount.objects.trending(
+            request.user.id, query.validated_data['limit'], timezone.now(),
+            movies=queryset
+        )
+        movies = queryset.filter(
+            id__in=[movie_id for movie_id, _ in rows]
+        ).prefetch_related('tag', 'cast').in_bulk()
+        found = [(movies[movie_id], score) for movie_id, score in rows
+                 if movie_id in movies]
+        data = self.get_serializer([movie for movie, _ in found],
+                                   many=True).data
+        for item, (_, score) in zip(data, found):
+            item['score'] = round(score, 3)
+        return Response(data)
+
+    @action(methods=['GET'], detail=True, url_path='similar')
+    def similar(self, request, pk=None):
+        """Returns the movies sharing the most tags and casts with a movie"""
+        movie = self.get_object()
+        top_k = settings.SIMILAR_MOVIES_TOP_K
+        try:
+            limit = int(request.query_params.get('limit', top_k))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= top_k:
+            return Response(
+                {'limit': [f'Must be an integer from 1 to {top_k}']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        rows = list(SimilarMovie.objects.filter(movie=movie).order_by(
+            '-score', 'similar_id'
+        ).select_related('similar').prefetch_related(
+            'similar__tag', 'similar__cast')[:limit])
+        data = self.get_serializer([row.similar for row in rows],
+                                   many=True).data
+        for item, row in zip(data, rows):
+            item['score'] = row.score
+        return Response(data)
+
+    def _change_membership(self, movie_ids, data):
+        """Applies tag and cast additions and removals to movies"""
+        counts = {}
+        with transaction.atomic():
+            for field in ('tag', 'cast'):
+                for operation, change in (
+                        ('add', Movie.objects.add_members),
+                        ('remove', Movie.objects.remove_members)):
+                    name = f'{field}_{operation}'
+                    counts[name] = len(change(
+                        self.request.user.id, field, movie_ids,
+                        [obj.id for obj in data.get(name, [])]
+                    ))
+        return counts
+
+    @action(methods=['POST'], detail=True, url_path='membership')
+    def membership(self, request, pk=None):
+        """Adds or removes tags and casts of a movie"""
+        movie = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            return Response(
+                self._change_membership([movie.id],
+                                        serializer.validated_data),
+                status=status.HTTP_200_OK
+            )
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(methods=['POST'], detail=False, url_path='membership')
+    def bulk_membership(self, request):
+        """Adds or removes tags and casts of several movies"""
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            movie_ids = [movie.id
+                         for movie in serializer.validated_data['movies']]
+            return Response(
+                self._change_membership(movie_ids,
+                                        serializer.validated_data),
+                status=status.HTTP_200_OK
+            )
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    def _export_rows(self, queryset):
+        """Yields export rows chunk by chunk from a server-side cursor"""
+        movies = queryset.values_list(
+            'id', 'title', 'url', 'duration', 'price'
+        ).iterator(chunk_size=self.export_chunk_size)
+        while True:
+            chunk = list(itertools.islice(movies, self.export_chunk_size))
+            if not chunk:
+                return
+            ids = [movie[0] for movie in chunk]
+            names = {}
+            for field in ('tag', 'cast'):
+                through = getattr(Movie, field).through
+                for movie_id, name in through.objects.filter(
+                    movie_id__in=ids
+                ).values_list('movie_id', f'{field}__name'):
+                    names.setdefault((field, movie_id), []).append(name)
+            for movie_id, title, url, duration, price in chunk:
+                yield {
+                    'id': movie_id,
+                    'title': title,
+                    'url': url,
+                    'duration': duration_string(duration),
+                    'price': str(price),
+                    'tag': names.get(('tag', movie_id), []),
+                    'cast': names.get(('cast', movie_id), []),
+                }
+
+    def _export_jsonl(self, rows):
+        for row in rows:
+            yield json.dumps(row) + '\n'
+
+    def _export_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.export_fields)
+        for row in rows:
+            row['tag'] = '|'.join(row['tag'])
+            row['cast'] = '|'.join(row['cast'])
+            writer.writerow([row[field] for field in self.export_fields])
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def _accepts_gzip(self, request):
+        """Returns if the client accepts gzip with a non-zero weight"""
+        header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        for coding in header.split(','):
+            name, *params = [part.strip() for part in coding.split(';')]
+            if name.lower() != 'gzip':
+                continue
+            for param in params:
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """Streams the user's catalog as JSONL or CSV"""
+        output = request.query_params.get('output', 'jsonl')
+        if output not in ('jsonl', 'csv'):
+            return Response(
+                {'output': ['Must be one of: jsonl, csv']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        rows = self._export_rows(self.get_queryset())
+        if output == 'csv':
+            content = self._export_csv(rows)
+            content_type = 'text/csv'
+        else:
+            content = self._export_jsonl(rows)
+            content_type = 'application/x-ndjson'
+        gzip = self._accepts_gzip(request)
+        if gzip:
+            content = compress_sequence(data.encode() for data in content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = \
+            f'attachment; filename="movies.{output}"'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+
+class ChangeFeedView(views.APIView):
+    """Returns the changes of the user's catalog after a sequence number"""
+    authentication_classes = (TokenAuthentication, BatchAuthentication)
+    permission_classes = (IsAuthenticated,)
+    kinds = {
+        Change.KIND_MOVIE: (Movie, MovieSerializer),
+        Change.KIND_TAG: (Tag, TagSerializer),
+        Change.KIND_CAST: (Cast, CastSerializer),
+    }
+
+    def _objects(self, changes):
+        """Returns the serialized objects of upserted changes by kind"""
+        objects = {}
+        for kind, (model, serializer_class) in self.kinds.items():
+            ids = {change.object_id for change in changes
+                   if change.kind == kind and
+                   change.action == Change.ACTION_UPSERT}
+            if not ids:
+                continue
+            queryset = model.objects.filter(user=self.request.user,
+                                            id__in=ids)
+            if model is Movie:
+                queryset = queryset.prefetch_related('tag', 'cast')
+            for data in serializer_class(queryset, many=True).data:
+                objects[(kind, data['id'])] = data
+        return objects
+
+    def get(self, request):
+        query = ChangeQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since = query.validated_data['since']
+        limit = query.validated_data['limit']
+        horizon = ChangeHorizon.objects.filter(
+            user=request.user).values_list('seq', flat=True).first() or 0
+        if 0 < since < horizon:
+            return Response(
+                {'detail': 'Changes were compacted, sync from 0 again',
+                 'horizon': horizon},
+                status=status.HTTP_410_GONE
+            )
+
+        changes = list(Change.objects.filter(
+            user=request.user, seq__gt=since
+        ).order_by('seq')[:limit + 1])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        serializer = ChangeSerializer(
+            changes, many=True, context={'objects': self._objects(changes)})
+        return Response({
+            'changes': serializer.data,
+            'since': changes[-1].seq if changes else since,
+            'has_more': has_more,
+        })
@@ -1,6 +1,8 @@
 from rest_framework import generics, authentication, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
+
+from batch.authentication import BatchAuthentication
 # django.shortcuts import render
 
 from .serializers import UserSerializer, AuthTokenSerializer
@@ -15,13 +17,16 @@ class AuthTokenView(ObtainAuthToken):
     """Create a new auth token for the user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    high_priority_actions = ('post',)
 
 
 class UpdateUserView(generics.RetrieveUpdateAPIView):
     """Manages the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (authentication.TokenAuthentication,
+                              BatchAuthentication)
     permission_classes = (permissions.IsAuthenticated,)
+    replica_actions = ('get',)
 
     def get_object(self):
         return self.request.user